@@ -1,15 +1,160 @@
+import os
+import bisect
+import hashlib
+import tempfile
+import threading
 import datetime as dt
+import numpy as np
 import pandas as pd
+from enum import StrEnum
 from dataclasses import dataclass, field
 
 
+class TDateType(StrEnum):
+    """
+    STR:    "YYYYMMDD", default type used by most classes in husfort
+    INT:    YYYYMMDD, as int32
+    SERIAL: serial number of a trade date in a calendar, as int32. It is only meaningful
+            with the same calendar file, so it should not be saved to database.
+    """
+    STR = "str"
+    INT = "int"
+    SERIAL = "serial"
+
+
+def convert_int_to_datetime64(dates: np.ndarray) -> np.ndarray:
+    """
+
+    :param dates: int array with format = YYYYMMDD, like [20240102, 20240103]
+    :return: np.datetime64[D] array
+    """
+    dates = np.asarray(dates, dtype=np.int64)
+    years = (dates // 10000 - 1970).astype("datetime64[Y]")
+    months = years.astype("datetime64[M]") + (dates // 100 % 100 - 1)
+    return months.astype("datetime64[D]") + (dates % 100 - 1)
+
+
+def convert_datetime64_to_int(dates: np.ndarray) -> np.ndarray:
+    """
+
+    :param dates: np.datetime64[D] array
+    :return: int array with format = YYYYMMDD
+    """
+    d = np.asarray(dates).astype("datetime64[D]")
+    years = d.astype("datetime64[Y]")
+    months = d.astype("datetime64[M]")
+    y = years.astype(np.int64) + 1970
+    m = (months - years.astype("datetime64[M]")).astype(np.int64) + 1
+    dd = (d - months.astype("datetime64[D]")).astype(np.int64) + 1
+    return (y * 10000 + m * 100 + dd).astype(np.int32)
+
+
+"""
+------ calendar registry ------
+"""
+
+
+class CCalendarRegistry(object):
+    """
+    A process-wide registry for calendar files.
+    0.  each calendar file is parsed by pandas only once in a process, trade dates are
+        kept as a read-only int32 array with format = YYYYMMDD.
+    1.  a binary copy(.npy) of this array is saved in cache_dir, keyed by the path and the
+        mtime of the calendar file. Workers spawned by husfort.qmultiprocessing load this
+        copy directly instead of parsing the csv file again. If the calendar file is
+        modified, the binary copy is rebuilt automatically.
+    2.  cache_dir could be set by environment variable HUSFORT_CALENDAR_CACHE_DIR, which
+        is inherited by child processes.
+    """
+
+    ENV_CACHE_DIR = "HUSFORT_CALENDAR_CACHE_DIR"
+
+    def __init__(self, cache_dir: str | None = None):
+        self._cache_dir = cache_dir
+        self.__dates: dict[tuple[str, int | None], tuple[int, np.ndarray]] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def cache_dir(self) -> str:
+        return (
+                self._cache_dir
+                or os.environ.get(self.ENV_CACHE_DIR)
+                or os.path.join(tempfile.gettempdir(), "husfort-calendar")
+        )
+
+    def get_cache_path(self, calendar_path: str, header: int | None, mtime: int) -> str:
+        tag = hashlib.md5(f"{calendar_path}|{header}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{tag}-{mtime}.npy")
+
+    @staticmethod
+    def parse(calendar_path: str, header: int | None) -> np.ndarray:
+        if header is None:
+            calendar_df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
+        else:
+            calendar_df = pd.read_csv(calendar_path, dtype=str, header=header)
+        return calendar_df["trade_date"].str.replace("-", "").astype(np.int32).values
+
+    @staticmethod
+    def __load_from_cache(cache_path: str) -> np.ndarray | None:
+        try:
+            return np.load(cache_path)
+        except (OSError, ValueError):
+            return None
+
+    def __save_to_cache(self, cache_path: str, dates: np.ndarray):
+        # cache is optional, failing to write it should never break the caller
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tag = os.path.basename(cache_path).split("-")[0]
+            for f in os.listdir(self.cache_dir):
+                if f.startswith(f"{tag}-"):
+                    os.remove(os.path.join(self.cache_dir, f))
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, dates)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+        return 0
+
+    def load(self, calendar_path: str, header: int | None) -> np.ndarray:
+        """
+
+        :param calendar_path: path of calendar file
+        :param header: row number to use as the column names, None if there is no header
+        :return: a read-only int32 array of trade dates, with format = YYYYMMDD
+        """
+        path = os.path.abspath(calendar_path)
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, header)
+        with self.__lock:
+            cached = self.__dates.get(key)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            cache_path = self.get_cache_path(path, header, mtime)
+            dates = self.__load_from_cache(cache_path)
+            if dates is None:
+                dates = self.parse(path, header)
+                self.__save_to_cache(cache_path, dates)
+            dates.flags.writeable = False
+            self.__dates[key] = (mtime, dates)
+        return dates
+
+    def clear(self):
+        with self.__lock:
+            self.__dates.clear()
+        return 0
+
+
+calendar_registry = CCalendarRegistry()
+
+
 class CCalendar(object):
     def __init__(self, calendar_path: str, header: int = 0):
-        if isinstance(header, int):
-            calendar_df = pd.read_csv(calendar_path, dtype=str, header=header)
-        else:
-            calendar_df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
-        self.__trade_dates = [_.replace("-", "") for _ in calendar_df["trade_date"]]
+        trade_dates = calendar_registry.load(calendar_path, header=header if isinstance(header, int) else None)
+        self.__trade_dates: list[str] = trade_dates.astype(str).tolist()
+        self.__trade_dates_int: np.ndarray = trade_dates
+        self.__trade_dates_sn: dict[str, int] = {d: i for i, d in enumerate(self.__trade_dates)}
 
     @property
     def last_date(self):
@@ -23,15 +168,19 @@ class CCalendar(object):
     def trade_dates(self) -> list[str]:
         return self.__trade_dates
 
+    @property
+    def trade_dates_int(self) -> np.ndarray:
+        """
+
+        :return: a read-only int32 array of trade dates, with format = YYYYMMDD
+        """
+        return self.__trade_dates_int
+
     def get_iter_list(self, bgn_date: str, stp_date: str, ascending: bool = True) -> list[str]:
-        res = []
-        for t_date in self.__trade_dates:
-            if t_date < bgn_date:
-                continue
-            if t_date >= stp_date:
-                break
-            res.append(t_date)
-        return res if ascending else sorted(res, reverse=True)
+        bgn_sn = bisect.bisect_left(self.__trade_dates, bgn_date)
+        stp_sn = bisect.bisect_left(self.__trade_dates, stp_date)
+        res = self.__trade_dates[bgn_sn:stp_sn]
+        return res if ascending else res[::-1]
 
     def shift_iter_dates(self, iter_dates: list[str], shift: int) -> list[str]:
         """
@@ -50,13 +199,83 @@ class CCalendar(object):
         return shift_dates
 
     def get_sn(self, base_date: str) -> int:
-        return self.__trade_dates.index(base_date)
+        try:
+            return self.__trade_dates_sn[base_date]
+        except KeyError:
+            raise ValueError(f"{base_date} is not a trade date in calendar")
 
     def get_date(self, sn: int) -> str:
         return self.__trade_dates[sn]
 
     def has_date(self, trade_date: str) -> bool:
-        return trade_date in self.__trade_dates
+        return trade_date in self.__trade_dates_sn
+
+    @staticmethod
+    def convert_dates_to_int(dates: list[str] | np.ndarray | pd.Series) -> np.ndarray:
+        """
+
+        :param dates: dates with format "YYYYMMDD", like ["20240102", "20240103"]
+        :return: int32 array, like [20240102, 20240103]
+        """
+        return np.asarray(dates).astype(np.int32)
+
+    @staticmethod
+    def convert_dates_to_str(dates: list[int] | np.ndarray | pd.Series) -> list[str]:
+        """
+
+        :param dates: dates with format YYYYMMDD, like [20240102, 20240103]
+        :return: ["20240102", "20240103"]
+        """
+        return np.asarray(dates).astype(np.int32).astype(str).tolist()
+
+    def get_serials(self, dates: list[str] | list[int] | np.ndarray | pd.Series) -> np.ndarray:
+        """
+
+        :param dates: trade dates with format "YYYYMMDD" or YYYYMMDD
+        :return: int32 array, serial number of each date in this calendar
+        """
+        int_dates = self.convert_dates_to_int(dates)
+        serials = np.searchsorted(self.__trade_dates_int, int_dates)
+        illegal = (serials >= len(self.__trade_dates_int)) | (
+                self.__trade_dates_int[np.minimum(serials, len(self.__trade_dates_int) - 1)] != int_dates)
+        if illegal.any():
+            raise ValueError(f"{int_dates[illegal][0]} is not a trade date in calendar")
+        return serials.astype(np.int32)
+
+    def get_dates_from_serials(self, serials: list[int] | np.ndarray | pd.Series) -> list[str]:
+        return self.__trade_dates_int[np.asarray(serials)].astype(str).tolist()
+
+    def encode_dates(self, dates: list[str] | np.ndarray | pd.Series, date_type: TDateType) -> np.ndarray:
+        """
+
+        :param dates: dates with format "YYYYMMDD"
+        :param date_type: type of output
+        :return:
+        """
+        if date_type == TDateType.STR:
+            return np.asarray(dates)
+        elif date_type == TDateType.INT:
+            return self.convert_dates_to_int(dates)
+        elif date_type == TDateType.SERIAL:
+            return self.get_serials(dates)
+        else:
+            raise ValueError(f"Invalid date type = {date_type}")
+
+    def decode_dates(self, values: list | np.ndarray | pd.Series, date_type: TDateType) -> list[str]:
+        """
+
+        :param values: output of self.encode_dates
+        :param date_type: type of values
+        :return: dates with format "YYYYMMDD"
+        """
+        if date_type == TDateType.STR:
+            return list(values)
+        elif date_type == TDateType.INT:
+            return self.convert_dates_to_str(values)
+        elif date_type == TDateType.SERIAL:
+            return self.get_dates_from_serials(values)
+        else:
+            raise ValueError(f"Invalid date type = {date_type}")
 
     def get_next_date(self, this_date: str, shift: int = 1) -> str:
         """
@@ -260,13 +479,10 @@ class CCalendarSection(object):
             ts2_end_time: str = "19:00:00.000000",
     ):
         self.sections: list[CSection] = []
-        if header:
-            df = pd.read_csv(calendar_path, dtype=str, header=header)
-        else:
-            df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
-        for this_trade_date, next_trade_date in zip(df["trade_date"][:-1], df["trade_date"][1:]):
-            next_date = (dt.datetime.strptime(this_trade_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
-
+        trade_dates = calendar_registry.load(calendar_path, header=header or None)
+        next_dates = convert_datetime64_to_int(convert_int_to_datetime64(trade_dates[:-1]) + 1).astype(str).tolist()
+        trade_dates = trade_dates.astype(str).tolist()
+        for this_trade_date, next_trade_date, next_date in zip(trade_dates[:-1], trade_dates[1:], next_dates):
             # this section TS2
             bgn_time = f"{this_trade_date} {ts2_bgn_time}"
             end_time = f"{this_trade_date} {ts2_end_time}"
@@ -281,6 +497,10 @@ class CCalendarSection(object):
 
         self.sections_size = len(self.sections)
 
+        # --- sections are sorted by secId, so they could be indexed by secId
+        self.__sec_ids: list[str] = [sec.secId for sec in self.sections]
+        self.__sec_sn: dict[str, int] = {sec_id: sn for sn, sec_id in enumerate(self.__sec_ids)}
+
     def head(self, n: int) -> list[CSection]:
         return self.sections[0:n]
 
@@ -288,7 +508,18 @@ class CCalendarSection(object):
         return self.sections[-n:]
 
     def get_sn(self, sec: CSection) -> int:
-        return self.sections.index(sec)
+        return self.get_sn_from_id(sec.secId)
+
+    def get_sn_from_id(self, sec_id: str) -> int:
+        """
+
+        :param sec_id: like "20240102-TS2"
+        :return: index of section in self.sections
+        """
+        try:
+            return self.__sec_sn[sec_id]
+        except KeyError:
+            raise ValueError(f"Section {sec_id} is not in calendar")
 
     def get_next_sec(self, this_sec: CSection, shift: int = 1) -> CSection | None:
         sn = self.get_sn(this_sec)
@@ -299,13 +530,9 @@ class CCalendarSection(object):
             return None
 
     def get_iter_list(self, bgn_sec: CSection, stp_sec: CSection) -> list[CSection]:
-        iter_list: list[CSection] = []
-        for sec in self.sections:
-            if sec >= stp_sec:
-                break
-            if sec >= bgn_sec:
-                iter_list.append(sec)
-        return iter_list
+        bgn_sn = bisect.bisect_left(self.__sec_ids, bgn_sec.secId)
+        stp_sn = bisect.bisect_left(self.__sec_ids, stp_sec.secId)
+        return self.sections[bgn_sn:stp_sn]
 
     def match(self, tp: str) -> tuple[bool, CSection | None]:
         for sec in self.sections:
@@ -314,9 +541,8 @@ class CCalendarSection(object):
         return False, None
 
     def match_id(self, tgt_sec_id: str) -> tuple[bool, CSection | None]:
-        for sec in self.sections:
-            if sec.secId == tgt_sec_id:
-                return True, sec
+        if (sn := self.__sec_sn.get(tgt_sec_id)) is not None:
+            return True, self.sections[sn]
         return False, None
 
     def match_date(self, tgt_date: str) -> tuple[bool, list[CSection]]:
@@ -379,29 +605,35 @@ class CMonth(object):
 
 class CCalendarMonth(object):
     def __init__(self, calendar_path: str, header: int = 0):
-        if isinstance(header, int):
-            calendar_df = pd.read_csv(calendar_path, dtype=str, header=header)
-        else:
-            calendar_df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
-        calendar_df["trade_month"] = calendar_df["trade_date"].map(lambda z: z.replace("-", "")[0:6])
+        trade_dates = calendar_registry.load(calendar_path, header=header if isinstance(header, int) else None)
+        trade_months, bgn_locs = np.unique(trade_dates // 100, return_index=True)
+        trade_dates_by_month = np.split(trade_dates.astype(str), bgn_locs[1:])
         self.trade_months: list[CMonth] = []
-        for trade_month, trade_month_df in calendar_df.groupby(by="trade_month"):
+        for trade_month, month_dates in zip(trade_months, trade_dates_by_month):
             month = CMonth(
-                trade_month=trade_month,  # type:ignore
-                trade_dates=tuple(trade_month_df["trade_date"].tolist()),
+                trade_month=str(trade_month),
+                trade_dates=tuple(month_dates.tolist()),
             )
             self.trade_months.append(month)
 
+        # indexes: month id -> sn, and sorted begin/end dates of months for bisect
+        self.__month_sn: dict[str, int] = {m.trade_month: i for i, m in enumerate(self.trade_months)}
+        self.__bgn_dates: list[str] = [m.bgn_date for m in self.trade_months]
+        self.__end_dates: list[str] = [m.end_date for m in self.trade_months]
+        self.__bgn_dates_int: np.ndarray = np.array(self.__bgn_dates, dtype=np.int64)
+        self.__end_dates_int: np.ndarray = np.array(self.__end_dates, dtype=np.int64)
+
+    def get_month_sn(self, trade_month: CMonth) -> int:
+        return self.__month_sn[trade_month.trade_month]
+
     def match_month_from_id(self, month_id: str) -> tuple[bool, CMonth | None]:
         """
 
         :param month_id: "YYYYMM"
         :return:
         """
-        for trade_month in self.trade_months:
-            if trade_month.match_from_month(month_id):
-                return True, trade_month
-        return False, None
+        sn = self.__month_sn.get(month_id)
+        return (False, None) if sn is None else (True, self.trade_months[sn])
 
     def match_month_from_date(self, trade_date: str) -> tuple[bool, CMonth | None]:
         """
@@ -409,11 +641,32 @@ class CCalendarMonth(object):
         :param trade_date: "YYYYMMDD"
         :return:
         """
-        for trade_month in self.trade_months:
-            if trade_month.match_from_date(trade_date):
-                return True, trade_month
+        sn = bisect.bisect_right(self.__bgn_dates, trade_date) - 1
+        if sn >= 0 and trade_date <= self.__end_dates[sn]:
+            return True, self.trade_months[sn]
         return False, None
 
+    def match_month_sns_from_dates(self, trade_dates: list[str] | np.ndarray) -> np.ndarray:
+        """
+
+        :param trade_dates: an array of dates with format "YYYYMMDD", str or int are both accepted
+        :return: an int array with the same size as trade_dates, each element is the sn of the
+                 month in self.trade_months, -1 means no month matched.
+        """
+        dates = np.asarray(trade_dates).astype(np.int64)
+        sns = np.searchsorted(self.__bgn_dates_int, dates, side="right") - 1
+        matched = (sns >= 0) & (dates <= self.__end_dates_int[np.maximum(sns, 0)])
+        return np.where(matched, sns, -1)
+
+    def map_dates_to_months(self, trade_dates: list[str] | np.ndarray) -> list[CMonth | None]:
+        """
+
+        :param trade_dates: an array of dates with format "YYYYMMDD", str or int are both accepted
+        :return: a list with the same size as trade_dates, None if no month matched
+        """
+        sns = self.match_month_sns_from_dates(trade_dates)
+        return [self.trade_months[sn] if sn >= 0 else None for sn in sns]
+
     def get_next_month(self, trade_month: CMonth, shift: int) -> CMonth:
         """
 
@@ -421,12 +674,12 @@ class CCalendarMonth(object):
         :param shift: > 0, in the future; < 0, in the past
         :return:
         """
-        trade_month_idx = self.trade_months.index(trade_month)
+        trade_month_idx = self.get_month_sn(trade_month)
         return self.trade_months[trade_month_idx + shift]
 
     def get_iter_months(self, bgn_month: CMonth, stp_month: CMonth) -> list[CMonth]:
-        bgn_idx = self.trade_months.index(bgn_month)
-        stp_idx = self.trade_months.index(stp_month)
+        bgn_idx = self.get_month_sn(bgn_month)
+        stp_idx = self.get_month_sn(stp_month)
         return self.trade_months[bgn_idx:stp_idx]
 
     def map_iter_dates_to_iter_month(
@@ -442,15 +695,30 @@ class CCalendarMonth(object):
         :return:
         """
         iter_dates = calendar.get_iter_list(bgn_date, stp_date)
-        _, bgn_month = self.match_month_from_date(iter_dates[0])
+        return self.map_dates_to_iter_months(iter_dates, calendar, exclude_last)
+
+    def map_dates_to_iter_months(
+            self, iter_dates: list[str] | np.ndarray, calendar: CCalendar, exclude_last: bool = True
+    ) -> list[CMonth]:
+        """
+
+        :param iter_dates: continuous trade dates in ascending order, like the result of
+                           calendar.get_iter_list(bgn_date, stp_date), str or int are both accepted
+        :param calendar:
+        :param exclude_last: if true, last month between iter dates is not full will be excluded from
+                             the final results
+        :return:
+        """
+        first_date, last_date = str(iter_dates[0]), str(iter_dates[-1])
         if exclude_last:
-            true_stp_date = calendar.get_next_date(iter_dates[-1], shift=1)
-            _, stp_month = self.match_month_from_date(true_stp_date)
+            edge_dates = [first_date, calendar.get_next_date(last_date, shift=1)]
+            bgn_sn, stp_sn = self.match_month_sns_from_dates(edge_dates)
         else:
-            _, end_month = self.match_month_from_date(iter_dates[-1])
-            stp_month = self.get_next_month(end_month, shift=1)
-        months = self.get_iter_months(bgn_month, stp_month)
-        return months
+            bgn_sn, end_sn = self.match_month_sns_from_dates([first_date, last_date])
+            stp_sn = end_sn + 1 if end_sn >= 0 else -1
+        if bgn_sn < 0 or stp_sn < 0:
+            raise ValueError(f"Could not match months for dates from {first_date} to {last_date}")
+        return self.trade_months[bgn_sn:stp_sn]
 
     def get_bgn_and_end_dates_for_trailing_window(self, end_month: CMonth, trn_win: int) -> tuple[str, str]:
         bgn_month = self.get_next_month(end_month, -trn_win + 1)
@@ -1,14 +1,116 @@
+import json
+import functools
 import numpy as np
 import pandas as pd
+import scipy.stats as sps
+from multiprocessing import Pool
 from typing import Literal
 from dataclasses import dataclass
+from numba import njit
+from husfort.qsqlite import CDbStruct, CSqlTable, CSqlVar, CMgrSqlDb
 
 '''
 created @ 2024-01-05
 0.  define a class to evaluate the performance of some portfolio
 1.  this class provide methods to calculate some frequently used index
+2.  rolling and expanding versions of some indicators are provided, which are
+    calculated in one pass over the whole series.
+3.  significance of indicators could be tested with bootstrap and deflated Sharpe ratio.
+4.  CNAVStream updates indicators in O(1) when a new day is appended, its state could be
+    saved to and loaded from a sqlite table.
 '''
 
+TRollingIndicator = Literal["mean", "std", "sharpe", "calmar", "mdd"]
+TBootstrapMethod = Literal["stationary", "block"]
+
+
+def gen_bootstrap_index(
+        obs: int, n_samples: int, block_size: int, method: TBootstrapMethod, rng: np.random.Generator,
+) -> np.ndarray:
+    """
+
+    :param obs: size of the original series
+    :param n_samples: number of resamples
+    :param block_size: size of blocks for "block", or average size of blocks for "stationary"
+    :param method: "stationary": blocks with random sizes of geometric distribution, Politis and Romano(1994)
+                   "block": blocks with fixed size
+                   in both methods, blocks start at random positions and wrap around the end of the series
+    :param rng:
+    :return: an int array with shape = (n_samples, obs), each row is the index of a resample
+    """
+    t = np.arange(obs)
+    if method == "stationary":
+        new_block = rng.random((n_samples, obs)) < 1 / block_size
+        new_block[:, 0] = True
+    elif method == "block":
+        new_block = np.broadcast_to(t % block_size == 0, (n_samples, obs))
+    else:
+        raise ValueError(f"method = {method} is not a legal option")
+    starts = rng.integers(0, obs, size=(n_samples, obs))
+    block_bgn = np.maximum.accumulate(np.where(new_block, t, 0), axis=1)
+    return (np.take_along_axis(starts, block_bgn, axis=1) + t - block_bgn) % obs
+
+
+def bootstrap_task(
+        rtn: np.ndarray, seed: np.random.SeedSequence, n_samples: int, block_size: int, method: TBootstrapMethod,
+        annual_factor: float, annual_rf_rate: float, cal_method: str, qs: tuple[int, ...],
+) -> pd.DataFrame:
+    idx = gen_bootstrap_index(len(rtn), n_samples, block_size, method, np.random.default_rng(seed))
+    nav_matrix = CNAVMatrix(
+        input_df=pd.DataFrame(rtn[idx].T), input_type="RET",
+        annual_factor=annual_factor, annual_rf_rate=annual_rf_rate,
+    )
+    nav_matrix.cal_all_indicators(method=cal_method, qs=qs)
+    # dates of indicators are meaningless for resamples
+    return nav_matrix.to_frame().drop(columns=["mddT", "lddDurT", "lrdT"])
+
+
+@njit(cache=True)
+def rolling_max_drawdown(nav: np.ndarray, win: int) -> np.ndarray:
+    """
+    max drawdown scale in each window with size = win, O(n) for the whole series.
+    The window is kept as a queue of two stacks. For any segment of nav, (max, min, mdd)
+    could be combined associatively, the front stack saves the aggregation from each element
+    to the end of the front stack, and the back stack only saves the aggregation of itself.
+
+    :param nav: nav series, all values must be positive
+    :param win: window size
+    :return: an array with the same size as nav, res[i] is the max drawdown scale of nav[i-win+1:i+1]
+    """
+    n = len(nav)
+    res = np.empty(n)
+    f_max, f_min, f_mdd = np.empty(n), np.empty(n), np.empty(n)
+    fb, fe = 0, 0  # front stack = nav[fb:fe], back stack = nav[fe:i+1]
+    b_max, b_min, b_mdd = 0.0, 0.0, 0.0
+    for i in range(n):
+        x = nav[i]
+        if i == fe:
+            b_max, b_min, b_mdd = x, x, 0.0
+        else:
+            b_mdd = max(b_mdd, 1 - x / b_max)
+            b_max, b_min = max(b_max, x), min(b_min, x)
+
+        if i - fb + 1 > win:
+            if fb == fe:
+                # move back stack to front stack
+                m_max, m_min, m_mdd = nav[i], nav[i], 0.0
+                f_max[i], f_min[i], f_mdd[i] = m_max, m_min, m_mdd
+                for k in range(i - 1, fe - 1, -1):
+                    y = nav[k]
+                    m_mdd = max(m_mdd, 1 - m_min / y)
+                    m_max, m_min = max(m_max, y), min(m_min, y)
+                    f_max[k], f_min[k], f_mdd[k] = m_max, m_min, m_mdd
+                fe = i + 1
+            fb += 1
+
+        if fb == fe:
+            res[i] = b_mdd
+        elif fe > i:
+            res[i] = f_mdd[fb]
+        else:
+            res[i] = max(f_mdd[fb], b_mdd, 1 - b_min / f_max[fb])
+    return res
+
 
 @dataclass
 class CIndicatorsGeneric:
@@ -30,9 +132,18 @@ class CIndicators(CIndicatorsGeneric):
 
 @dataclass
 class CIndicatorsWithSeries(CIndicators):
-    srs: pd.Series = None
+    """
+    values at all dates are saved in arr and index, srs is created from them when requested,
+    so it is None before the indicator is calculated, and could not be set directly.
+    """
+    arr: np.ndarray = None
+    index: pd.Index = None
     idx: int | str = None
 
+    @property
+    def srs(self) -> pd.Series | None:
+        return None if self.arr is None else pd.Series(data=self.arr, index=self.index)
+
     def displayIdx(self) -> str:
         if isinstance(self.idx, int):
             return f"{self.idx:d}"
@@ -50,6 +161,73 @@ class CIndicatorsWithDict(CIndicatorsGeneric):
         return ",".join([f"{k}={v * self.display_scale:{self.display_fmt}}" for k, v in self.val.items()])
 
 
+@njit(cache=True)
+def cal_drawdown_duration(nav: np.ndarray) -> tuple[np.ndarray, int, int]:
+    """
+
+    :param nav: nav series
+    :return: duration from the last high to the lowest point after it at each point,
+             max and argmax(first one) of the durations
+    """
+    n = len(nav)
+    res = np.zeros(n, dtype=np.int64)
+    prev_high, prev_high_loc, prev_drawdown_scale, drawdown_loc = nav[0], 0, 0.0, 0
+    max_val, max_loc = 0, 0
+    for i in range(n):
+        nav_i = nav[i]
+        if nav_i > prev_high:
+            prev_high, prev_high_loc, prev_drawdown_scale = nav_i, i, 0.0
+        drawdown_scale = 1 - nav_i / prev_high
+        if drawdown_scale > prev_drawdown_scale:
+            prev_drawdown_scale, drawdown_loc = drawdown_scale, i
+        res[i] = drawdown_loc - prev_high_loc
+        if i == 0 or res[i] > max_val:
+            max_val, max_loc = res[i], i
+    return res, max_val, max_loc
+
+
+@njit(cache=True)
+def cal_recover_duration(nav: np.ndarray) -> tuple[np.ndarray, int, int]:
+    """
+
+    :param nav: nav series
+    :return: duration since the last high at each point, max and argmax(first one) of the durations
+    """
+    n = len(nav)
+    res = np.zeros(n, dtype=np.int64)
+    prev_high, prev_high_loc = nav[0], 0
+    max_val, max_loc = 0, 0
+    for i in range(n):
+        nav_i = nav[i]
+        if nav_i > prev_high:
+            prev_high, prev_high_loc = nav_i, i
+        res[i] = i - prev_high_loc
+        if i == 0 or res[i] > max_val:
+            max_val, max_loc = res[i], i
+    return res, max_val, max_loc
+
+
+@njit(cache=True)
+def cal_durations_matrix(navs: np.ndarray, recover: bool) -> tuple[np.ndarray, np.ndarray]:
+    """
+
+    :param navs: nav matrix with shape = (T, K)
+    :param recover: calculate recover durations if True, else drawdown durations
+    :return: max and argmax of the durations of each column, each with size = K
+    """
+    k_size = navs.shape[1]
+    max_vals = np.zeros(k_size, dtype=np.int64)
+    max_locs = np.zeros(k_size, dtype=np.int64)
+    for j in range(k_size):
+        nav = np.ascontiguousarray(navs[:, j])
+        if recover:
+            _, max_val, max_loc = cal_recover_duration(nav)
+        else:
+            _, max_val, max_loc = cal_drawdown_duration(nav)
+        max_vals[j], max_locs[j] = max_val, max_loc
+    return max_vals, max_locs
+
+
 class CNAV(object):
     def __init__(
             self, input_srs: pd.Series, input_type: Literal["NAV", "RET"],
@@ -65,6 +243,11 @@ class CNAV(object):
                                     the Assets Return series, the return should NOT be multiplied by RETURN_SCALE
                               B. the index of the series is supposed to be continuous, i.e., there are not any missing
                                  dates or timestamp in the index.
+                              C. nan values are dropped when initialized, like skipna of pandas. So indicators are
+                                 calculated on the other dates: obs, durations and the compound annual return do not
+                                 count nan dates, value at risks skip nan instead of returning nan, and with
+                                 input_type == "NAV", return of the next valid date is from the last valid nav
+                                 (instead of 0 for both the nan date and the next date).
         :param input_type: "NAV" or "RET"
         :param annual_rf_rate: annualized risk-free rate, must NOT be multiplied by the return scale.
                                the class will do the conversion when initialized
@@ -81,16 +264,24 @@ class CNAV(object):
         self.annual_rf_rate: float = annual_rf_rate
         self.ret_scale_display: float = ret_scale_display
 
+        # values are saved as np.ndarray, pd.Series are only created when nav_srs or rtn_srs is requested
+        self.index: pd.Index = input_srs.index
+        self.name = input_srs.name
+        values = input_srs.values.astype(np.float64)
+        if np.isnan(values).any():
+            keep = ~np.isnan(values)
+            self.index, values = self.index[keep], values[keep]
         if self.return_type == "NAV":
-            self.nav_srs: pd.Series = input_srs / input_srs.iloc[0]  # always set the first value to be 1
-            self.rtn_srs: pd.Series = (input_srs / input_srs.shift(1) - 1).fillna(0)  # has the same length as nav srs
+            self.nav: np.ndarray = values / values[0]  # always set the first value to be 1
+            self.rtn: np.ndarray = np.zeros(len(values))  # has the same length as nav
+            self.rtn[1:] = values[1:] / values[:-1] - 1
         elif self.return_type == "RET":
-            self.rtn_srs: pd.Series = input_srs
-            self.nav_srs: pd.Series = (input_srs + 1).cumprod()
+            self.rtn: np.ndarray = values
+            self.nav: np.ndarray = (values + 1).cumprod()
         else:
             raise ValueError(f"input type = {input_type} is illegal, please check again.")
 
-        self.obs: int = len(input_srs)
+        self.obs: int = len(values)
 
         # frequently used performance indicators
         # primary
@@ -104,41 +295,43 @@ class CNAV(object):
         self.score: CIndicators = CIndicators(1, display_fmt=".3f")
         self.value_at_risks: CIndicatorsWithDict = CIndicatorsWithDict(ret_scale_display, display_fmt=".3f")
 
-        # secondary
-        self.max_drawdown_scale: CIndicatorsWithSeries = CIndicatorsWithSeries(
-            display_scale=ret_scale_display, display_fmt=".3f", srs=pd.Series(index=self.nav_srs.index),
-        )
-        self.longest_drawdown_duration: CIndicatorsWithSeries = CIndicatorsWithSeries(
-            display_scale=1, display_fmt="d", srs=pd.Series(data=0, index=self.nav_srs.index),
-        )
-        self.longest_recover_duration: CIndicatorsWithSeries = CIndicatorsWithSeries(
-            display_scale=1, display_fmt="d", srs=pd.Series(data=0, index=self.nav_srs.index),
-        )
+        # secondary, arrays of them are filled when they are calculated
+        self.max_drawdown_scale: CIndicatorsWithSeries = CIndicatorsWithSeries(ret_scale_display, display_fmt=".3f")
+        self.longest_drawdown_duration: CIndicatorsWithSeries = CIndicatorsWithSeries(1, display_fmt="d")
+        self.longest_recover_duration: CIndicatorsWithSeries = CIndicatorsWithSeries(1, display_fmt="d")
+
+    @functools.cached_property
+    def nav_srs(self) -> pd.Series:
+        return pd.Series(data=self.nav, index=self.index, name=self.name)
+
+    @functools.cached_property
+    def rtn_srs(self) -> pd.Series:
+        return pd.Series(data=self.rtn, index=self.index, name=self.name)
 
     def cal_return_mean(self):
         if not self.return_mean.avlb:
-            self.return_mean.val = self.rtn_srs.mean()
+            self.return_mean.val = self.rtn.mean()
             self.return_mean.avlb = True
         return 0
 
     def cal_return_std(self):
         if not self.return_std.avlb:
-            self.return_std.val = self.rtn_srs.std()
+            self.return_std.val = self.rtn.std(ddof=1) if self.obs > 1 else np.nan
             self.return_std.avlb = True
         return 0
 
     def cal_hold_period_return(self):
         if not self.hold_period_return.avlb:
-            self.hold_period_return.val = self.nav_srs.iloc[-1] - 1
+            self.hold_period_return.val = self.nav[-1] - 1
             self.hold_period_return.avlb = True
         return 0
 
     def cal_annual_return(self, method: str = "linear"):
         if not self.annual_return.avlb:
             if method.lower() == "linear":
-                self.annual_return.val = self.rtn_srs.mean() * self.annual_factor
+                self.annual_return.val = self.rtn.mean() * self.annual_factor
             elif method.lower() == "compound":
-                self.annual_return.val = np.power(self.nav_srs.iloc[-1], self.annual_factor / self.obs) - 1
+                self.annual_return.val = np.power(self.nav[-1], self.annual_factor / self.obs) - 1
             else:
                 raise ValueError(f"method = {method} is not a legal option")
             self.annual_return.avlb = True
@@ -146,24 +339,27 @@ class CNAV(object):
 
     def cal_annual_volatility(self):
         if not self.annual_volatility.avlb:
-            self.annual_volatility.val = self.rtn_srs.std() * np.sqrt(self.annual_factor)
+            self.cal_return_std()
+            self.annual_volatility.val = self.return_std.val * np.sqrt(self.annual_factor)
             self.annual_volatility.avlb = True
         return 0
 
     def cal_sharpe_ratio(self):
         if not self.sharpe_ratio.avlb:
-            diff_srs = self.rtn_srs - self.annual_rf_rate / self.annual_factor
-            mu = diff_srs.mean()
-            sd = diff_srs.std()
-            self.sharpe_ratio.val = mu / sd * np.sqrt(self.annual_factor)
+            diff = self.rtn - self.annual_rf_rate / self.annual_factor
+            mu = diff.mean()
+            sd = diff.std(ddof=1) if self.obs > 1 else np.nan
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.sharpe_ratio.val = np.float64(mu) / sd * np.sqrt(self.annual_factor)
             self.sharpe_ratio.avlb = True
         return 0
 
     def cal_max_drawdown_scale(self):
         if not self.max_drawdown_scale.avlb:
-            self.max_drawdown_scale.srs = (1 - self.nav_srs / self.nav_srs.cummax())
-            self.max_drawdown_scale.val = self.max_drawdown_scale.srs.max()
-            self.max_drawdown_scale.idx = self.max_drawdown_scale.srs.idxmax()
+            self.max_drawdown_scale.arr = 1 - self.nav / np.maximum.accumulate(self.nav)
+            self.max_drawdown_scale.index = self.index
+            self.max_drawdown_scale.val = self.max_drawdown_scale.arr.max()
+            self.max_drawdown_scale.idx = self.index[self.max_drawdown_scale.arr.argmax()]
             self.max_drawdown_scale.avlb = True
         return 0
 
@@ -171,7 +367,8 @@ class CNAV(object):
         if not self.calmar_ratio.avlb:
             self.cal_annual_return()
             self.cal_max_drawdown_scale()
-            self.calmar_ratio.val = self.annual_return.val / self.max_drawdown_scale.val
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.calmar_ratio.val = np.float64(self.annual_return.val) / self.max_drawdown_scale.val
             self.calmar_ratio.avlb = True
         return 0
 
@@ -186,50 +383,172 @@ class CNAV(object):
         return 0
 
     def cal_longest_drawdown_duration(self):
-        if self.longest_drawdown_duration.avlb:
-            return 0
-        prev_high = self.nav_srs.iloc[0]
-        prev_high_loc = 0
-        prev_drawdown_scale = 0.0
-        drawdown_loc = 0
-        for i, nav_i in enumerate(self.nav_srs):
-            if nav_i > prev_high:
-                prev_high = nav_i
-                prev_high_loc = i
-                prev_drawdown_scale = 0
-            drawdown_scale = 1 - nav_i / prev_high  # type:ignore
-            if drawdown_scale > prev_drawdown_scale:
-                prev_drawdown_scale = drawdown_scale
-                drawdown_loc = i
-            self.longest_drawdown_duration.srs.iloc[i] = drawdown_loc - prev_high_loc
-        self.longest_drawdown_duration.val = self.longest_drawdown_duration.srs.max()
-        self.longest_drawdown_duration.idx = self.longest_drawdown_duration.srs.idxmax()
-        self.longest_drawdown_duration.avlb = True
+        if not self.longest_drawdown_duration.avlb:
+            durations, max_val, max_loc = cal_drawdown_duration(self.nav)
+            self.longest_drawdown_duration.arr = durations
+            self.longest_drawdown_duration.index = self.index
+            self.longest_drawdown_duration.val = np.int64(max_val)
+            self.longest_drawdown_duration.idx = self.index[max_loc]
+            self.longest_drawdown_duration.avlb = True
         return 0
 
     def cal_longest_recover_duration(self):
-        if self.longest_recover_duration.avlb:
-            return 0
-        prev_high = self.nav_srs.iloc[0]
-        prev_high_loc = 0
-        for i, nav_i in enumerate(self.nav_srs):
-            if nav_i > prev_high:
-                self.longest_recover_duration.srs.iloc[i] = 0
-                prev_high = nav_i
-                prev_high_loc = i
-            else:
-                self.longest_recover_duration.srs.iloc[i] = i - prev_high_loc
-        self.longest_recover_duration.val = self.longest_recover_duration.srs.max()
-        self.longest_recover_duration.idx = self.longest_recover_duration.srs.idxmax()
-        self.longest_recover_duration.avlb = True
+        if not self.longest_recover_duration.avlb:
+            durations, max_val, max_loc = cal_recover_duration(self.nav)
+            self.longest_recover_duration.arr = durations
+            self.longest_recover_duration.index = self.index
+            self.longest_recover_duration.val = np.int64(max_val)
+            self.longest_recover_duration.idx = self.index[max_loc]
+            self.longest_recover_duration.avlb = True
         return 0
 
     def cal_value_at_risk(self, qs: tuple[int, ...]):
         if (not self.value_at_risks.avlb) and qs:
-            self.value_at_risks.val = {f"q{q:02d}": np.percentile(self.rtn_srs, q) for q in qs}
+            self.value_at_risks.val = {f"q{q:02d}": v for q, v in zip(qs, np.percentile(self.rtn, qs))}
             self.value_at_risks.avlb = True
         return 0
 
+    @staticmethod
+    def __window_sum(x: np.ndarray, win: int) -> np.ndarray:
+        cum = np.zeros(len(x) + 1)
+        np.cumsum(x, out=cum[1:])
+        return cum[1:] - cum[np.maximum(np.arange(1, len(x) + 1) - win, 0)]
+
+    def cal_rolling(
+            self, indicator: TRollingIndicator, win: int = None, min_periods: int = None, method: str = "linear",
+    ) -> pd.Series:
+        """
+        calculate an indicator at every date in one pass, with rolling or expanding windows.
+        For a window ending at T, the value is the same as the one calculated by
+        CNAV(input_srs=self.rtn_srs[T-win+1:T+1], input_type="RET")
+
+        :param indicator: "mean", "std", "sharpe", "calmar" or "mdd"
+        :param win: window size, if None, expanding windows are used
+        :param min_periods: minimum number of observations in window to get a result,
+                            by default = win for rolling windows and 1 for expanding windows
+        :param method: "linear" or "compound", method to calculate annual return for "calmar"
+        :return: a pd.Series with the same index as self.nav_srs
+        """
+        win = win or self.obs
+        if min_periods is None:
+            min_periods = 1 if win == self.obs else win
+        cnt = np.minimum(np.arange(1, self.obs + 1), win)
+        rtn = self.rtn
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if indicator in ("mean", "std", "sharpe", "calmar"):
+                # center returns to reduce the loss of precision of cumulative sums
+                center = rtn.mean() if self.obs > 0 else 0.0
+                s = self.__window_sum(rtn - center, win)
+                mu = s / cnt + center
+                if indicator == "mean":
+                    res = mu
+                elif indicator in ("std", "sharpe"):
+                    ss = self.__window_sum((rtn - center) ** 2, win)
+                    sd = np.sqrt(np.maximum(ss - s * s / cnt, 0) / (cnt - 1))
+                    sd[cnt < 2] = np.nan
+                    if indicator == "std":
+                        res = sd
+                    else:
+                        res = (mu - self.annual_rf_rate / self.annual_factor) / sd * np.sqrt(self.annual_factor)
+                else:
+                    if method.lower() == "linear":
+                        annual_return = mu * self.annual_factor
+                    elif method.lower() == "compound":
+                        nav = np.concatenate(([1.0], (rtn + 1).cumprod()))
+                        hpr = nav[1:] / nav[np.arange(1, self.obs + 1) - cnt]
+                        annual_return = np.power(hpr, self.annual_factor / cnt) - 1
+                    else:
+                        raise ValueError(f"method = {method} is not a legal option")
+                    res = annual_return / rolling_max_drawdown((rtn + 1).cumprod(), win)
+            elif indicator == "mdd":
+                res = rolling_max_drawdown((rtn + 1).cumprod(), win)
+            else:
+                raise ValueError(f"indicator = {indicator} is not a legal option")
+        res[cnt < min_periods] = np.nan
+        return pd.Series(data=res, index=self.index, name=indicator)
+
+    def cal_expanding(
+            self, indicator: TRollingIndicator, min_periods: int = 1, method: str = "linear",
+    ) -> pd.Series:
+        return self.cal_rolling(indicator=indicator, win=None, min_periods=min_periods, method=method)
+
+    def cal_deflated_sharpe(self, trials_sharpe: list[float] | np.ndarray | pd.Series) -> float:
+        """
+        deflated Sharpe ratio, Bailey and Lopez de Prado(2014). The probability that the true
+        Sharpe ratio is above the expected max Sharpe ratio of all trials when none of them has skill.
+
+        :param trials_sharpe: annualized Sharpe ratios of all strategies tried, including this one.
+                              If there is only one trial, the result is the probabilistic Sharpe ratio.
+        :return:
+        """
+        self.cal_sharpe_ratio()
+        sqrt_af = np.sqrt(self.annual_factor)
+        sr = self.sharpe_ratio.val / sqrt_af
+        trials = np.asarray(trials_sharpe, dtype=np.float64) / sqrt_af
+        n = len(trials)
+        if n > 1:
+            emc = 0.5772156649015329  # Euler-Mascheroni constant
+            sr0 = np.sqrt(trials.var(ddof=1)) * (
+                    (1 - emc) * sps.norm.ppf(1 - 1 / n) + emc * sps.norm.ppf(1 - 1 / (n * np.e)))
+        else:
+            sr0 = 0.0
+        diff = self.rtn - self.annual_rf_rate / self.annual_factor
+        skew, kurt = sps.skew(diff), sps.kurtosis(diff, fisher=False)
+        # kurt >= skew ** 2 + 1 always holds for sample moments, so sr_var >= (1 - skew * sr / 2) ** 2 >= 0,
+        # it could only be slightly negative from rounding, like two-valued returns, and is clipped.
+        sr_var = max(1 - skew * sr + (kurt - 1) / 4 * sr ** 2, np.finfo(np.float64).eps)
+        z = (sr - sr0) * np.sqrt(self.obs - 1) / np.sqrt(sr_var)
+        return float(sps.norm.cdf(z))
+
+    def bootstrap(
+            self, n_samples: int = 1000, block_size: int = 20, method: TBootstrapMethod = "stationary",
+            alpha: float = 0.05, cal_method: str = "linear", qs: tuple[int, ...] = (),
+            seed: int = 0, chunk_size: int = 200, processes: int | None = 1,
+    ) -> pd.DataFrame:
+        """
+        resample returns with bootstrap, and evaluate all the resamples with CNAVMatrix.
+
+        :param n_samples: number of resamples
+        :param block_size: see gen_bootstrap_index
+        :param method: see gen_bootstrap_index
+        :param alpha: confidence intervals are [alpha/2, 1 - alpha/2] quantiles of resamples
+        :param cal_method: "linear" or "compound", see cal_all_indicators
+        :param qs: see cal_all_indicators
+        :param seed: results are the same for the same seed and chunk_size, whatever the processes is
+        :param chunk_size: number of resamples evaluated in each task
+        :param processes: number of processes, if 1, all tasks are run in this process, else they are
+                          run in a multiprocessing.Pool, None for os.cpu_count(). Pool is not allowed
+                          in daemonic processes, like workers of another Pool, keep it 1 there.
+        :return: a pd.DataFrame with index = indicators, columns = ["val", "mean", "std", "lower", "upper"],
+                 "val" is the indicator of the original series
+        """
+        rtn = self.rtn
+        sizes = [min(chunk_size, n_samples - k) for k in range(0, n_samples, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = [
+            (rtn, sd, size, block_size, method, self.annual_factor, self.annual_rf_rate, cal_method, qs)
+            for sd, size in zip(seeds, sizes)
+        ]
+        if processes == 1:
+            res = [bootstrap_task(*arg) for arg in args]
+        else:
+            with Pool(processes=processes) as pool:
+                res = pool.starmap(bootstrap_task, args)
+        samples = pd.concat(res, axis=0, ignore_index=True)
+
+        nav_matrix = CNAVMatrix(
+            input_df=self.rtn_srs.to_frame(), input_type="RET",
+            annual_factor=self.annual_factor, annual_rf_rate=self.annual_rf_rate,
+        )
+        nav_matrix.cal_all_indicators(method=cal_method, qs=qs)
+        return pd.DataFrame({
+            "val": nav_matrix.to_frame()[samples.columns].iloc[0],
+            "mean": samples.mean(),
+            "std": samples.std(),
+            "lower": samples.quantile(alpha / 2),
+            "upper": samples.quantile(1 - alpha / 2),
+        })
+
     def cal_all_indicators(self, method: str = "linear",
                            excluded: tuple[str, ...] = (),
                            qs: tuple[int, ...] = ()):
@@ -238,7 +557,7 @@ class CNAV(object):
         :param method: "linear" or "compound"
         :param excluded: indicators in this tuple will not be calculated, only
                          ("ldd", "lrd", "var")
-                         can be excluded, using this to save time when
+                         can be excluded.
         :param qs: Percentage or sequence of percentages for the percentiles to compute.
                    Values must be between 0 and 100 inclusive.
                    This parameter must be provided if user want to calculate the indicator 'VaR',
@@ -361,3 +680,379 @@ class CNAV(object):
                 k, v = val.split("=")
                 d[k] = v
         return d
+
+
+class CNAVMatrix(object):
+    def __init__(
+            self, input_df: pd.DataFrame, input_type: Literal["NAV", "RET"],
+            annual_factor: float = 250, annual_rf_rate: float = 0,
+    ):
+        """
+        evaluate many nav series at once, each column is calculated in the same way as CNAV,
+        and the results are the same as CNAV(input_df[col], ...).to_dict() if there are no nan values
+
+        :param input_df: a pd.DataFrame with index = dates, columns = strategies, see input_srs of CNAV
+        :param input_type: "NAV" or "RET"
+        :param annual_factor: see CNAV
+        :param annual_rf_rate: see CNAV
+        """
+        self.return_type = input_type.upper()
+        self.annual_factor = annual_factor
+        self.annual_rf_rate: float = annual_rf_rate
+
+        if self.return_type == "NAV":
+            self.nav_df: pd.DataFrame = input_df / input_df.iloc[0]
+            self.rtn_df: pd.DataFrame = (input_df / input_df.shift(1) - 1).fillna(0)
+        elif self.return_type == "RET":
+            self.rtn_df: pd.DataFrame = input_df
+            self.nav_df: pd.DataFrame = (input_df + 1).cumprod()
+        else:
+            raise ValueError(f"input type = {input_type} is illegal, please check again.")
+
+        self.obs: int = len(input_df)
+        self.indicators: dict[str, pd.Series] = {}
+
+    def cal_all_indicators(self, method: str = "linear",
+                           excluded: tuple[str, ...] = (),
+                           qs: tuple[int, ...] = ()):
+        """
+
+        :param method: "linear" or "compound"
+        :param excluded: see CNAV.cal_all_indicators
+        :param qs: see CNAV.cal_all_indicators
+        :return:
+        """
+        d = self.indicators
+        d["retMean"] = self.rtn_df.mean()
+        d["retStd"] = self.rtn_df.std()
+        d["hpr"] = self.nav_df.iloc[-1] - 1
+        if method.lower() == "linear":
+            d["retAnnual"] = d["retMean"] * self.annual_factor
+        elif method.lower() == "compound":
+            d["retAnnual"] = np.power(self.nav_df.iloc[-1], self.annual_factor / self.obs) - 1
+        else:
+            raise ValueError(f"method = {method} is not a legal option")
+        d["volAnnual"] = d["retStd"] * np.sqrt(self.annual_factor)
+        diff_df = self.rtn_df - self.annual_rf_rate / self.annual_factor
+        d["sharpe"] = diff_df.mean() / diff_df.std() * np.sqrt(self.annual_factor)
+        mdd_df = 1 - self.nav_df / self.nav_df.cummax()
+        d["mdd"], d["mddT"] = mdd_df.max(), mdd_df.idxmax()
+        d["calmar"] = d["retAnnual"] / d["mdd"]
+        d["score"] = d["sharpe"] + d["calmar"]
+
+        navs = np.asfortranarray(self.nav_df.values, dtype=np.float64)
+        for key, recover in (("lddDur", False), ("lrd", True)):
+            if ("lrd" if recover else "ldd") not in excluded:
+                max_vals, max_locs = cal_durations_matrix(navs, recover)
+                d[key] = pd.Series(data=max_vals, index=self.nav_df.columns)
+                d[f"{key}T"] = pd.Series(data=self.nav_df.index[max_locs], index=self.nav_df.columns)
+        if ("var" not in excluded) and qs:
+            percentiles = np.percentile(self.rtn_df.values, qs, axis=0)
+            for q, p in zip(qs, percentiles):
+                d[f"q{q:02d}"] = pd.Series(data=p, index=self.rtn_df.columns)
+        return 0
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+
+        :return: a pd.DataFrame with index = columns of input_df, columns = keys of CNAV.to_dict
+        """
+        keys = ["retMean", "retStd", "hpr", "retAnnual", "volAnnual", "sharpe", "calmar", "score",
+                "mdd", "mddT", "lddDur", "lddDurT", "lrd", "lrdT"]
+        keys = [k for k in keys if k in self.indicators] + [k for k in self.indicators if k not in keys]
+        return pd.DataFrame({k: self.indicators[k] for k in keys})
+
+
+class CP2Quantile(object):
+    def __init__(self, p: float):
+        """
+        P-square algorithm to estimate a quantile without saving observations, Jain and Chlamtac(1985).
+        The result is exact when there are no more than 5 observations.
+
+        :param p: quantile to estimate, in (0, 1)
+        """
+        self.p = p
+        self.heights: list[float] = []
+        self.pos: list[int] = [1, 2, 3, 4, 5]
+        self.desired: list[float] = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments: list[float] = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def update(self, x: float):
+        q, n = self.heights, self.pos
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return 0
+
+        if x < q[0]:
+            q[0], k = x, 0
+        elif x >= q[4]:
+            q[4], k = x, 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                        + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not (q[i - 1] < qp < q[i + 1]):
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i], n[i] = qp, n[i] + d
+        return 0
+
+    @property
+    def value(self) -> float:
+        if len(self.heights) < 5:
+            return float(np.percentile(self.heights, self.p * 100)) if self.heights else np.nan
+        return self.heights[2]
+
+    def get_state(self) -> dict:
+        return {"p": self.p, "heights": self.heights, "pos": self.pos, "desired": self.desired}
+
+    @staticmethod
+    def from_state(state: dict) -> "CP2Quantile":
+        sketch = CP2Quantile(state["p"])
+        sketch.heights, sketch.pos, sketch.desired = state["heights"], state["pos"], state["desired"]
+        return sketch
+
+
+def encode_non_finite(obj):
+    """
+    np.nan and np.inf are written as NaN and Infinity by json.dumps, which are not valid JSON,
+    so np.nan is encoded as null, np.inf and -np.inf are encoded as "inf" and "-inf".
+
+    """
+    if isinstance(obj, float):
+        if np.isnan(obj):
+            return None
+        if np.isinf(obj):
+            return "inf" if obj > 0 else "-inf"
+        return obj
+    if isinstance(obj, dict):
+        return {k: encode_non_finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_non_finite(v) for v in obj]
+    return obj
+
+
+def decode_non_finite(obj):
+    """
+    reverse of encode_non_finite
+
+    """
+    if obj is None:
+        return np.nan
+    if obj in ("inf", "-inf"):
+        return float(obj)
+    if isinstance(obj, dict):
+        return {k: decode_non_finite(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [decode_non_finite(v) for v in obj]
+    return obj
+
+
+def gen_nav_stream_db(save_dir: str, save_id: str) -> CDbStruct:
+    """
+    state of CNAVStream, saved in the same db as the nav table
+
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="nav_stream",
+            primary_keys=[CSqlVar("save_id", "TEXT")],
+            value_columns=[CSqlVar("trade_date", "TEXT"), CSqlVar("state", "TEXT")],
+        )
+    )
+
+
+class CNAVStream(object):
+    def __init__(
+            self, input_type: Literal["NAV", "RET"],
+            annual_factor: float = 250, annual_rf_rate: float = 0, qs: tuple[int, ...] = (),
+    ):
+        """
+        evaluate a nav series which grows day by day, all indicators are updated in O(1) for each new day.
+        After the same days are appended, to_dict returns the same keys and values as CNAV.to_dict after
+        CNAV.cal_all_indicators(qs=qs), except the value at risks, which are estimated by CP2Quantile.
+
+        :param input_type: "NAV" or "RET", type of values to append, see CNAV
+        :param annual_factor: see CNAV
+        :param annual_rf_rate: see CNAV
+        :param qs: percentiles for value at risks
+        """
+        self.return_type = input_type.upper()
+        if self.return_type not in ("NAV", "RET"):
+            raise ValueError(f"input type = {input_type} is illegal, please check again.")
+        self.annual_factor = annual_factor
+        self.annual_rf_rate: float = annual_rf_rate
+        self.qs = qs
+        self.sketches: list[CP2Quantile] = [CP2Quantile(q / 100) for q in qs]
+
+        self.obs: int = 0
+        self.last_date: str = ""
+        self.base_val: float = np.nan  # first value of input if input_type = "NAV"
+        self.last_val: float = np.nan  # last value of input if input_type = "NAV"
+        self.nav: float = 1.0
+
+        # Welford's algorithm for mean and variance
+        self.ret_mean: float = 0.0
+        self.ret_m2: float = 0.0
+
+        # drawdown
+        self.prev_high: float = np.nan
+        self.prev_high_loc: int = 0
+        self.prev_drawdown_scale: float = 0.0
+        self.drawdown_loc: int = 0
+        self.mdd: float = 0.0
+        self.mdd_date: str = ""
+        self.ldd: int = 0
+        self.ldd_date: str = ""
+        self.lrd: int = 0
+        self.lrd_date: str = ""
+
+    def append(self, trade_date: str, value: float):
+        """
+
+        :param trade_date: must be later than dates appended before
+        :param value: nav or return of this date, depends on input_type
+        :return:
+        """
+        if trade_date <= self.last_date:
+            raise ValueError(f"trade_date = {trade_date} is not later than last date = {self.last_date}")
+        i = self.obs
+        if self.return_type == "NAV":
+            if i == 0:
+                self.base_val = self.last_val = value
+            ret, self.last_val = value / self.last_val - 1, value
+            self.nav = value / self.base_val
+        else:
+            ret = value
+            self.nav = self.nav * (1 + value)
+        self.obs, self.last_date = i + 1, trade_date
+
+        delta = ret - self.ret_mean
+        self.ret_mean += delta / self.obs
+        self.ret_m2 += delta * (ret - self.ret_mean)
+        for sketch in self.sketches:
+            sketch.update(ret)
+
+        # the same as cal_drawdown_duration and cal_recover_duration
+        if i == 0:
+            self.prev_high = self.nav
+        elif self.nav > self.prev_high:
+            self.prev_high, self.prev_high_loc, self.prev_drawdown_scale = self.nav, i, 0.0
+        drawdown_scale = 1 - self.nav / self.prev_high
+        if drawdown_scale > self.prev_drawdown_scale:
+            self.prev_drawdown_scale, self.drawdown_loc = drawdown_scale, i
+        if i == 0 or drawdown_scale > self.mdd:
+            self.mdd, self.mdd_date = drawdown_scale, trade_date
+        ldd, lrd = self.drawdown_loc - self.prev_high_loc, i - self.prev_high_loc
+        if i == 0 or ldd > self.ldd:
+            self.ldd, self.ldd_date = ldd, trade_date
+        if i == 0 or lrd > self.lrd:
+            self.lrd, self.lrd_date = lrd, trade_date
+        return 0
+
+    def extend(self, input_srs: pd.Series):
+        """
+
+        :param input_srs: a pd.Series with index = trade dates, values = nav or return
+        :return:
+        """
+        for trade_date, value in input_srs.items():
+            self.append(trade_date, value)
+        return 0
+
+    def to_dict(self, method: str = "linear") -> dict:
+        """
+
+        :param method: "linear" or "compound", method to calculate annual return
+        :return:
+        """
+        ret_std = np.sqrt(self.ret_m2 / (self.obs - 1)) if self.obs > 1 else np.nan
+        if method.lower() == "linear":
+            annual_return = self.ret_mean * self.annual_factor
+        elif method.lower() == "compound":
+            annual_return = np.power(self.nav, self.annual_factor / self.obs) - 1
+        else:
+            raise ValueError(f"method = {method} is not a legal option")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sharpe = (self.ret_mean - self.annual_rf_rate / self.annual_factor) / np.float64(ret_std) * np.sqrt(
+                self.annual_factor)
+            calmar = annual_return / np.float64(self.mdd)
+        d = {
+            "retMean": self.ret_mean,
+            "retStd": ret_std,
+            "hpr": self.nav - 1,
+            "retAnnual": annual_return,
+            "volAnnual": ret_std * np.sqrt(self.annual_factor),
+            "sharpe": sharpe,
+            "calmar": calmar,
+            "score": sharpe + calmar,
+            "mdd": self.mdd,
+            "mddT": self.mdd_date,
+            "lddDur": self.ldd,
+            "lddDurT": self.ldd_date,
+            "lrd": self.lrd,
+            "lrdT": self.lrd_date,
+        }
+        d.update({f"q{q:02d}": sketch.value for q, sketch in zip(self.qs, self.sketches)})
+        return d
+
+    def to_json(self) -> str:
+        """
+
+        :return: a valid JSON string, with non-finite values encoded by encode_non_finite
+        """
+        state = {k: v for k, v in self.__dict__.items() if k != "sketches"}
+        state["sketches"] = [sketch.get_state() for sketch in self.sketches]
+        return json.dumps(encode_non_finite(state), allow_nan=False)
+
+    @staticmethod
+    def from_json(s: str) -> "CNAVStream":
+        state = decode_non_finite(json.loads(s))
+        stream = CNAVStream(state["return_type"], state["annual_factor"], state["annual_rf_rate"], tuple(state["qs"]))
+        stream.__dict__.update({k: v for k, v in state.items() if k not in ("sketches", "qs")})
+        stream.sketches = [CP2Quantile.from_state(_) for _ in state["sketches"]]
+        return stream
+
+    def save(self, save_dir: str, save_id: str):
+        db_struct = gen_nav_stream_db(save_dir, save_id)
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="a",
+        )
+        sqldb.update(update_data=pd.DataFrame([(save_id, self.last_date, self.to_json())]))
+        return 0
+
+    @staticmethod
+    def load(save_dir: str, save_id: str) -> "CNAVStream | None":
+        """
+
+        :param save_dir:
+        :param save_id:
+        :return: None if no state is saved
+        """
+        db_struct = gen_nav_stream_db(save_dir, save_id)
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="a",
+        )
+        data = sqldb.read_by_conditions(conditions=[("save_id", "=", save_id)], value_columns=["state"])
+        return None if data.empty else CNAVStream.from_json(data["state"].iloc[0])
@@ -1,11 +1,45 @@
 import re
+import functools
+import numpy as np
 import pandas as pd
-from typing import Literal
-from dataclasses import dataclass
+from typing import Callable, Literal, Iterator
+from collections.abc import Mapping
+from dataclasses import dataclass, fields
 
+PTN_DIGITS = re.compile(pattern="[0-9]")
+PTN_CONTRACT_FULL_YEAR = re.compile(pattern=r"^[a-zA-Z]{1,2}[\d]{4}$")
 
+TContracts = pd.Series | np.ndarray | list[str]
+
+
+@functools.lru_cache(maxsize=65536)
 def parse_instrument_from_contract(contract: str) -> str:
-    return re.sub(pattern="[0-9]", repl="", string=contract)
+    return PTN_DIGITS.sub(repl="", string=contract)
+
+
+def map_by_uniques(values: TContracts, func: Callable[[str], str]) -> np.ndarray:
+    """
+    Apply func to each unique value only, and broadcast results back. Market data columns
+    usually have millions of rows but only thousands of unique contracts, this is much faster
+    than mapping func to each row.
+
+    :param values: a column of contracts, None or nan is allowed and would be kept as None
+    :param func: function to be applied
+    :return: an object array with the same size as values
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    res = np.empty(len(uniques) + 1, dtype=object)  # the last one is for codes = -1, i.e. None or nan
+    res[:-1] = [func(u) for u in uniques]
+    return res[codes]
+
+
+def parse_instruments_from_contracts(contracts: TContracts) -> np.ndarray:
+    """
+
+    :param contracts: a column of contracts, like ["j2209", "CF209"]
+    :return: an object array, like ["j", "CF"]
+    """
+    return map_by_uniques(contracts, parse_instrument_from_contract)
 
 
 @dataclass(frozen=True)
@@ -25,13 +59,108 @@ class CInstrument:
     tushareId: str
 
 
+TCodeFormat = Literal["VANILLA", "WIND", "TUSHARE"]
+
+
+class CInstruTable(object):
+    def __init__(self, instruments_data: pd.DataFrame):
+        """
+        A struct-of-arrays registry of instruments.
+        0.  each field is saved as a numpy array, one element for each instrument.
+        1.  any of instrumentId, windId or tushareId could be used to find the serial number
+            of an instrument.
+        2.  exchange codes for each code format are precomputed.
+
+        :param instruments_data: a pd.DataFrame with columns defined in CInstrument
+        """
+        self.size = len(instruments_data)
+        self.instrumentId: np.ndarray = instruments_data["instrumentId"].values.astype(object)
+        self.windId: np.ndarray = instruments_data["windId"].values.astype(object)
+        self.tushareId: np.ndarray = instruments_data["tushareId"].values.astype(object)
+        self.multiplier: np.ndarray = instruments_data["multiplier"].values.astype(np.int64)
+        self.minispread: np.ndarray = instruments_data["minispread"].values.astype(np.float64)
+        self.hasNgtSec: np.ndarray = instruments_data["hasNgtSec"].values.astype(np.int64)
+        self.hasDayBrk: np.ndarray = instruments_data["hasDayBrk"].values.astype(np.int64)
+        self.timeTableId: np.ndarray = instruments_data["timeTableId"].values.astype(object)
+        self.ngtSec: np.ndarray = instruments_data["ngtSec"].values.astype(object)
+        self.daySec0: np.ndarray = instruments_data["daySec0"].values.astype(object)
+        self.daySec1: np.ndarray = instruments_data["daySec1"].values.astype(object)
+        self.daySec2: np.ndarray = instruments_data["daySec2"].values.astype(object)
+        self.exchange: dict[str, np.ndarray] = {
+            "VANILLA": instruments_data["exchange"].values.astype(object),
+            "WIND": np.array([z.split(".")[-1] for z in self.windId], dtype=object),
+            "TUSHARE": np.array([z.split(".")[-1] for z in self.tushareId], dtype=object),
+        }
+
+        # python lists for scalar getters, which return python objects rather than numpy scalars
+        self.multiplier_list: list[int] = self.multiplier.tolist()
+        self.minispread_list: list[float] = self.minispread.tolist()
+        self.exchange_list: dict[str, list[str]] = {k: v.tolist() for k, v in self.exchange.items()}
+
+        self.sn: dict[str, int] = {}
+        for ids in (self.instrumentId, self.windId, self.tushareId):
+            for i, instru_id in enumerate(ids):
+                if self.sn.setdefault(instru_id, i) != i:
+                    raise ValueError(f"Instrument id {instru_id} is used by more than one instrument.")
+        self.sn_index: pd.Index = pd.Index(list(self.sn.keys()))
+        self.sn_values: np.ndarray = np.array(list(self.sn.values()), dtype=np.int64)
+
+    def get_sn(self, instru_id: str) -> int:
+        return self.sn[instru_id]
+
+    def get_sns(self, instru_ids: pd.Series | np.ndarray | list[str]) -> np.ndarray:
+        """
+
+        :param instru_ids: instrumentId, windId or tushareId, formats could be mixed
+        :return: an int array, serial numbers of instruments
+        """
+        codes, uniques = pd.factorize(np.asarray(instru_ids, dtype=object))
+        locs = self.sn_index.get_indexer(uniques)
+        if (locs < 0).any() or (codes < 0).any():
+            raise KeyError(f"Unknown instruments: {uniques[locs < 0][:5].tolist() or [None]}")
+        return self.sn_values[locs][codes]
+
+    def get_instrument(self, sn: int) -> CInstrument:
+        d = {}
+        for f in fields(CInstrument):
+            v = self.exchange["VANILLA"][sn] if f.name == "exchange" else getattr(self, f.name)[sn]
+            d[f.name] = v.item() if isinstance(v, np.generic) else v
+        return CInstrument(**d)
+
+
+class CInstruView(Mapping):
+    def __init__(self, table: CInstruTable, key: Literal["instrumentId", "windId", "tushareId"]):
+        """
+        A read-only dict-like view of CInstruTable, with keys = ids in column "key".
+        CInstrument is created from the table when it is accessed, so the table is the only source of data.
+
+        :param table:
+        :param key:
+        """
+        self.table = table
+        self.keys_arr: np.ndarray = getattr(table, key)
+
+    def __getitem__(self, instru_id: str) -> CInstrument:
+        sn = self.table.sn.get(instru_id)
+        if sn is None or self.keys_arr[sn] != instru_id:
+            raise KeyError(instru_id)
+        return self.table.get_instrument(sn)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_arr.tolist())
+
+    def __len__(self) -> int:
+        return self.table.size
+
+
 class CInstruMgr(object):
     def __init__(self, instru_info_path: str, key: Literal["instrumentId", "windId", "tushareId"] = "instrumentId",
                  file_type: Literal["EXCEL", "CSV"] = "CSV", sheet_name: str = "instruments"):
         """
 
         :param instru_info_path: InstrumentInfo file path, could be a txt(csv) or xlsx
-        :param key: "instrumentId"(like "a.dce") or "windCode"(like "A.DCE")
+        :param key: "instrumentId"(like "a.dce") or "windCode"(like "A.DCE"), it is only used as the key of
+                    self.mgr. All getters accept instrumentId, windId and tushareId, no matter which key is used.
         :param file_type: "EXCEL" for xlsx, others for txt(csv)
         :param sheet_name: default = "instruments", only used if file_type = "EXCEL"
         """
@@ -58,9 +187,8 @@ class CInstruMgr(object):
         else:
             raise ValueError(f"Invalid file type = {file_type}.")
 
-        self.mgr: dict[str, CInstrument] = {}
-        for instru_data in self.instruments_data.to_dict(orient="index").values():
-            self.mgr[instru_data[key]] = CInstrument(**instru_data)
+        self.table = CInstruTable(self.instruments_data)
+        self.mgr: CInstruView = CInstruView(self.table, key)
 
     def get_universe(self, cformat: Literal["VANILLA", "WIND", "TUSHARE"] = "VANILLA") -> list[str]:
         """
@@ -69,33 +197,51 @@ class CInstruMgr(object):
         :return:
         """
         if cformat.upper() == "VANILLA":
-            return [v.instrumentId for v in self.mgr.values()]
+            return self.table.instrumentId.tolist()
         elif cformat.upper() == "WIND":
-            return [v.windId for v in self.mgr.values()]
+            return self.table.windId.tolist()
         elif cformat.upper() == "TUSHARE":
-            return [v.tushareId for v in self.mgr.values()]
+            return self.table.tushareId.tolist()
         else:
             raise ValueError(f"Invalid cformat = {cformat}.")
 
     def get_multiplier(self, instrumentId: str) -> int:
-        return self.mgr[instrumentId].multiplier
+        return self.table.multiplier_list[self.table.sn[instrumentId]]
 
     def get_multiplier_from_contract(self, contract: str) -> int:
         instrumentId = parse_instrument_from_contract(contract)
         return self.get_multiplier(instrumentId)
 
     def get_mini_spread(self, instrumentId: str) -> float:
-        return self.mgr[instrumentId].minispread
+        return self.table.minispread_list[self.table.sn[instrumentId]]
 
-    def get_exchange(self, instrumentId: str, cformat: Literal["VANILLA", "WIND", "TUSHARE"] = "VANILLA") -> str:
-        if cformat.upper() == "VANILLA":
-            return self.mgr[instrumentId].exchange
-        elif cformat.upper() == "WIND":
-            return self.mgr[instrumentId].windId.split(".")[-1]
-        elif cformat.upper() == "TUSHARE":
-            return self.mgr[instrumentId].tushareId.split(".")[-1]
-        else:
+    def get_exchange(self, instrumentId: str, cformat: TCodeFormat = "VANILLA") -> str:
+        try:
+            exchanges = self.table.exchange_list[cformat]
+        except KeyError:
+            if (cformat_upper := cformat.upper()) not in self.table.exchange_list:
+                raise ValueError(f"Invalid cformat = {cformat}.")
+            exchanges = self.table.exchange_list[cformat_upper]
+        return exchanges[self.table.sn[instrumentId]]
+
+    def multipliers(self, instru_ids: pd.Series | np.ndarray | list[str]) -> np.ndarray:
+        """
+
+        :param instru_ids: instrumentId, windId or tushareId
+        :return: an int64 array
+        """
+        return self.table.multiplier[self.table.get_sns(instru_ids)]
+
+    def multipliers_from_contracts(self, contracts: TContracts) -> np.ndarray:
+        return self.multipliers(parse_instruments_from_contracts(contracts))
+
+    def mini_spreads(self, instru_ids: pd.Series | np.ndarray | list[str]) -> np.ndarray:
+        return self.table.minispread[self.table.get_sns(instru_ids)]
+
+    def exchanges(self, instru_ids: pd.Series | np.ndarray | list[str], cformat: TCodeFormat = "VANILLA") -> np.ndarray:
+        if (cformat_upper := cformat.upper()) not in self.table.exchange:
             raise ValueError(f"Invalid cformat = {cformat}.")
+        return self.table.exchange[cformat_upper][self.table.get_sns(instru_ids)]
 
     def get_exchange_chs(self, instrumentId: str) -> str:
         exchange_id_full = self.get_exchange(instrumentId, cformat="VANILLA")
@@ -110,16 +256,16 @@ class CInstruMgr(object):
         return exchange_id_chs
 
     def get_windId(self, instrument_id: str) -> str:
-        return self.mgr[instrument_id].windId
+        return self.table.windId[self.table.sn[instrument_id]]
 
     def get_tushareId(self, instrument_id: str) -> str:
-        return self.mgr[instrument_id].tushareId
+        return self.table.tushareId[self.table.sn[instrument_id]]
 
     def has_ngt_sec(self, instrumentId: str) -> bool:
-        return self.mgr[instrumentId].hasNgtSec == 1
+        return bool(self.table.hasNgtSec[self.table.sn[instrumentId]] == 1)
 
     def has_day_brk(self, instrumentId: str) -> bool:
-        return self.mgr[instrumentId].hasDayBrk == 1
+        return bool(self.table.hasDayBrk[self.table.sn[instrumentId]] == 1)
 
     def convert_contract_from_vanilla(self, contract: str, cformat: Literal["WIND", "TUSHARE"]) -> str:
         """
@@ -175,7 +321,7 @@ class CInstruMgr(object):
             # this problem only happens for CZCE
             return contract
 
-        if re.match(pattern=r"^[a-zA-Z]{1,2}[\d]{4}$", string=contract) is not None:
+        if PTN_CONTRACT_FULL_YEAR.match(contract) is not None:
             # some old contract did have format like "MA1105"
             # in this case Nothing should be done
             return contract
@@ -188,3 +334,48 @@ class CInstruMgr(object):
             # if not, decimal year +=1
             td += 1
         return contract[0:len_instru_id] + str(td) + contract[len_instru_id:]
+
+    def convert_contracts_from_vanilla(self, contracts: TContracts, cformat: Literal["WIND", "TUSHARE"]) -> np.ndarray:
+        """
+
+        :param contracts: a column of general contract ids, such as ["j2209", "CF209"]
+        :param cformat: "WIND", "TUSHARE"
+        :return: an object array, like ["J2209.DCE", "CF209.CZC"]
+        """
+        return map_by_uniques(contracts, functools.partial(self.convert_contract_from_vanilla, cformat=cformat))
+
+    def convert_contracts_to_vanilla(self, contract_ids: TContracts, cformat: Literal["WIND", "TUSHARE"]) -> np.ndarray:
+        """
+
+        :param contract_ids: a column of contract ids, such as ["CF2209.ZCE", "J2209.DCE"]
+        :param cformat: "WIND", "TUSHARE"
+        :return: an object array, like ["CF2209", "j2209"]
+        """
+        return map_by_uniques(contract_ids, functools.partial(self.convert_contract_to_vanilla, cformat=cformat))
+
+    def fix_contract_ids(
+            self, contracts: TContracts, trade_dates: TContracts, cformat: Literal["VANILLA", "WIND", "TUSHARE"],
+    ) -> np.ndarray:
+        """
+        vectorized version of self.fix_contract_id, the result only depends on the contract
+        and "XY" in trade date "20XYMMDD", so each unique pair of them is fixed only once.
+
+        :param contracts: a column of contracts, like ["MA105", "MA105.CZC"]
+        :param trade_dates: a column of trade dates with the same size as contracts, format = "YYYYMMDD"
+                            or int YYYYMMDD, see TDateType
+        :param cformat: "wind" or "vanilla"
+        :return: an object array, None if contract or trade date is None or nan, like map_by_uniques
+        """
+        contract_codes, contract_uniques = pd.factorize(np.asarray(contracts, dtype=object))
+        date_codes, date_uniques = pd.factorize(np.asarray(trade_dates, dtype=object))
+        year_of_dates = np.array([int(str(d)[2:4]) for d in date_uniques], dtype=np.int64)
+        valid = (contract_codes >= 0) & (date_codes >= 0)
+        pair_codes = contract_codes[valid].astype(np.int64) * 100 + year_of_dates[date_codes[valid]]
+        pair_uniques, pair_inverse = np.unique(pair_codes, return_inverse=True)
+        fixed = np.array([
+            self.fix_contract_id(contract_uniques[pc // 100], trade_date=f"20{pc % 100:02d}0101", cformat=cformat)
+            for pc in pair_uniques
+        ], dtype=object)
+        res = np.empty(len(contract_codes), dtype=object)
+        res[valid] = fixed[pair_inverse.ravel()]
+        return res
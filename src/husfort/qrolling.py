@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+from typing import Literal
+from dataclasses import dataclass
+from numba import njit
+from husfort.qcalendar import CCalendar
+
+'''
+0.  a rolling-window engine keyed by trade date serials from CCalendar.
+1.  windows are always measured in TRADE DAYS of the calendar, not in observations,
+    so an instrument which is listed or delisted inside a window, or just has some
+    missing days, only uses the observations inside the last N trade days.
+2.  all instruments are calculated in one pass over a dense (date x instrument) panel.
+'''
+
+TRollingMethod = Literal["sum", "mean", "std", "min", "max", "ewm"]
+
+
+@dataclass(frozen=True)
+class CPanel:
+    """
+    serials:     trade date serials in calendar, continuous, ascending, size = T
+    trade_dates: trade dates, "YYYYMMDD", size = T
+    instruments: size = N
+    values:      float64 array with shape = (T, N), np.nan for missing observations
+    """
+
+    serials: np.ndarray
+    trade_dates: list[str]
+    instruments: list[str]
+    values: np.ndarray
+
+    def to_frame(self, data: np.ndarray | None = None) -> pd.DataFrame:
+        """
+
+        :param data: an array with the same shape as self.values, if None self.values is used
+        :return: a pd.DataFrame with index = trade_dates, columns = instruments
+        """
+        return pd.DataFrame(
+            data=self.values if data is None else data,
+            index=pd.Index(self.trade_dates, name="trade_date"),
+            columns=pd.Index(self.instruments, name="instrument"),
+        )
+
+    def to_long(self, data: np.ndarray, name: str, dropna: bool = True) -> pd.DataFrame:
+        """
+
+        :param data: an array with the same shape as self.values
+        :param name: column name of data in output
+        :param dropna: drop rows where data is nan
+        :return: a pd.DataFrame with columns ["trade_date", "instrument", name]
+        """
+        t, n = data.shape
+        res = pd.DataFrame({
+            "trade_date": np.repeat(np.array(self.trade_dates), n),
+            "instrument": np.tile(np.array(self.instruments), t),
+            name: data.ravel(),
+        })
+        return res.dropna(subset=[name], ignore_index=True) if dropna else res
+
+
+@njit(cache=True)
+def rolling_extreme(values: np.ndarray, win: int, min_periods: int, is_max: bool) -> np.ndarray:
+    """
+    monotonic deque for each column, O(T) for each column
+
+    """
+    t_size, n_size = values.shape
+    res = np.full((t_size, n_size), np.nan)
+    deque = np.empty(t_size, dtype=np.int64)
+    for j in range(n_size):
+        head, tail, cnt = 0, 0, 0
+        for i in range(t_size):
+            x = values[i, j]
+            if not np.isnan(x):
+                cnt += 1
+                while tail > head:
+                    y = values[deque[tail - 1], j]
+                    if (is_max and y <= x) or ((not is_max) and y >= x):
+                        tail -= 1
+                    else:
+                        break
+                deque[tail] = i
+                tail += 1
+            if i >= win and not np.isnan(values[i - win, j]):
+                cnt -= 1
+            while tail > head and deque[head] <= i - win:
+                head += 1
+            if cnt >= min_periods and tail > head:
+                res[i, j] = values[deque[head], j]
+    return res
+
+
+@njit(cache=True)
+def rolling_ewm(values: np.ndarray, win: int, min_periods: int, alpha: float) -> np.ndarray:
+    """
+    exponentially weighted mean with adjust = True, only the observations in the last
+    win trade days are weighted, and weights decay with trade days, including missing days.
+    Results are only available when there are at least min_periods observations in the window.
+
+    """
+    t_size, n_size = values.shape
+    res = np.full((t_size, n_size), np.nan)
+    decay = 1 - alpha
+    decay_win = decay ** win  # weight of the observation just leaving the window
+    for j in range(n_size):
+        s, w, cnt = 0.0, 0.0, 0
+        for i in range(t_size):
+            x = values[i, j]
+            s, w = s * decay, w * decay
+            if not np.isnan(x):
+                s += x
+                w += 1
+                cnt += 1
+            if i >= win and not np.isnan(values[i - win, j]):
+                s -= values[i - win, j] * decay_win
+                w -= decay_win
+                cnt -= 1
+            if cnt == 0:
+                s, w = 0.0, 0.0  # reset to clear accumulated rounding errors
+            elif cnt >= min_periods:
+                res[i, j] = s / w
+    return res
+
+
+class CRollingEngine(object):
+    def __init__(self, calendar: CCalendar):
+        self.calendar = calendar
+
+    def to_panel(
+            self, data: pd.DataFrame, value: str,
+            bgn_date: str = None, stp_date: str = None,
+            date_col: str = "trade_date", instru_col: str = "instrument",
+    ) -> CPanel:
+        """
+
+        :param data: a long pd.DataFrame with columns [date_col, instru_col, value],
+                     date_col must be trade dates in calendar, with format "YYYYMMDD"
+        :param value: name of column to calculate
+        :param bgn_date: first date of panel, by default the first date in data
+        :param stp_date: stop date of panel(not included), by default the date next to the last date in data
+        :param date_col:
+        :param instru_col:
+        :return:
+        """
+        serials = self.calendar.get_serials(data[date_col])
+        bgn_sn = self.calendar.get_sn(bgn_date) if bgn_date else int(serials.min())
+        stp_sn = self.calendar.get_sn(stp_date) if stp_date else int(serials.max()) + 1
+        keep = (serials >= bgn_sn) & (serials < stp_sn)
+        codes, instruments = pd.factorize(data[instru_col].values[keep], sort=True)
+        values = np.full((stp_sn - bgn_sn, len(instruments)), np.nan)
+        values[serials[keep] - bgn_sn, codes] = data[value].values[keep]
+        panel_serials = np.arange(bgn_sn, stp_sn, dtype=np.int32)
+        return CPanel(
+            serials=panel_serials,
+            trade_dates=self.calendar.get_dates_from_serials(panel_serials),
+            instruments=list(instruments),
+            values=values,
+        )
+
+    @staticmethod
+    def __window_sum(x: np.ndarray, win: int) -> np.ndarray:
+        cum = np.zeros((x.shape[0] + 1, x.shape[1]))
+        np.cumsum(x, axis=0, out=cum[1:])
+        return cum[1:] - cum[np.maximum(np.arange(1, x.shape[0] + 1) - win, 0)]
+
+    def rolling(
+            self, panel: CPanel, win: int, method: TRollingMethod,
+            min_periods: int = 1, alpha: float = None,
+    ) -> np.ndarray:
+        """
+
+        :param panel: output of self.to_panel
+        :param win: window size in trade days
+        :param method: "sum", "mean", "std", "min", "max", "ewm"
+        :param min_periods: minimum number of observations in the window to get a result
+        :param alpha: smoothing factor for "ewm", by default = 2 / (win + 1)
+        :return: an array with the same shape as panel.values
+        """
+        values = panel.values
+        if method in ("min", "max"):
+            return rolling_extreme(values, win, min_periods, method == "max")
+        elif method == "ewm":
+            return rolling_ewm(values, win, min_periods, alpha or 2 / (win + 1))
+
+        valid = ~np.isnan(values)
+        cnt = self.__window_sum(valid.astype(np.float64), win)
+        # center each column to reduce the loss of precision of cumulative sums
+        center = np.nanmean(values, axis=0) if valid.any() else np.zeros(values.shape[1])
+        center = np.nan_to_num(center)
+        x = np.where(valid, values - center, 0)
+        s = self.__window_sum(x, win)
+        avlb = (cnt >= min_periods) & (cnt > 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if method == "sum":
+                res = s + cnt * center
+            elif method == "mean":
+                res = s / cnt + center
+            elif method == "std":
+                ss = self.__window_sum(x * x, win)
+                res = np.sqrt(np.maximum(ss - s * s / cnt, 0) / (cnt - 1))
+                avlb = avlb & (cnt > 1)
+            else:
+                raise ValueError(f"Invalid method = {method}")
+        return np.where(avlb, res, np.nan)
+
+    def cal(
+            self, data: pd.DataFrame, value: str, wins: list[int], methods: list[TRollingMethod],
+            min_periods: int = 1, date_col: str = "trade_date", instru_col: str = "instrument",
+    ) -> pd.DataFrame:
+        """
+
+        :param data: a long pd.DataFrame with columns [date_col, instru_col, value]
+        :param value:
+        :param wins: window sizes in trade days
+        :param methods:
+        :param min_periods:
+        :param date_col:
+        :param instru_col:
+        :return: data with new columns named like f"{value}_{method}{win}", aligned with rows of data
+        """
+        panel = self.to_panel(data, value, date_col=date_col, instru_col=instru_col)
+        rows = self.calendar.get_serials(data[date_col]) - panel.serials[0]
+        cols = pd.Index(panel.instruments).get_indexer(data[instru_col])
+        new_data = {}
+        for win in wins:
+            for method in methods:
+                res = self.rolling(panel, win=win, method=method, min_periods=min_periods)
+                new_data[f"{value}_{method}{win}"] = res[rows, cols]
+        return data.assign(**new_data)
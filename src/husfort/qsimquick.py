@@ -1,16 +1,22 @@
+import os
+import hashlib
+import numpy as np
 import pandas as pd
-from husfort.qcalendar import CCalendar
-from husfort.qsqlite import CDbStruct, CMgrSqlDb, CSqlVar, CSqlTable
+import scipy.sparse as sp
+from loguru import logger
+from husfort.qcalendar import CCalendar, TDateType
+from husfort.qsqlite import CDbStruct, CMgrSqlDb, CSqlVar, CSqlTable, gen_sql_var_date
 from husfort.qplot import CPlotLines
+from husfort.qutility import check_and_makedirs, SFG, SFY
 
 
-def gen_sims_quick_nav_db(save_dir: str, save_id: str) -> CDbStruct:
+def gen_sims_quick_nav_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
     return CDbStruct(
         db_save_dir=save_dir,
         db_name=f"{save_id}.db",
         table=CSqlTable(
             name="nav",
-            primary_keys=[CSqlVar("trade_date", "TEXT")],
+            primary_keys=[gen_sql_var_date("trade_date", date_type)],
             value_columns=[
                 CSqlVar("raw_ret", "REAL"),
                 CSqlVar("delta_weights_sum", "REAL"),
@@ -22,6 +28,254 @@ def gen_sims_quick_nav_db(save_dir: str, save_id: str) -> CDbStruct:
     )
 
 
+def cal_quick_core(
+        weights: np.ndarray, rets: np.ndarray, cost_rate: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    dates are on axis -2, instruments are on axis -1, so arrays with more leading dimensions
+    (like a batch of signals) are also supported.
+
+    :param weights: shape = (..., T, N), np.nan if the instrument is not available on that date
+    :param rets: shape = (..., T, N), 0 if the instrument is not available on that date
+    :param cost_rate:
+    :return: raw_ret, delta_weights_sum, cost, net_ret, each with shape = (..., T).
+             Delta weights are only counted when the instrument is available on both dates,
+             and are 0 for the first date.
+    """
+    raw_ret = np.einsum("...j,...j->...", np.nan_to_num(weights), rets)
+    delta_weights = np.zeros_like(weights)
+    delta_weights[..., 1:, :] = np.nan_to_num(np.diff(weights, axis=-2))
+    delta_weights_sum = np.abs(delta_weights).sum(axis=-1)
+    cost = delta_weights_sum * cost_rate
+    return raw_ret, delta_weights_sum, cost, raw_ret - cost
+
+
+def cal_quick_core_sparse(
+        weights: sp.csr_array, rets: sp.csr_array, presence: sp.csr_array, cost_rate: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    sparse version of cal_quick_core, results are the same, but (T, N) arrays are never densified.
+
+    :param weights: shape = (T, N), instruments without signals are not stored
+    :param rets: shape = (T, N), returns of available instruments
+    :param presence: shape = (T, N), 1 if the instrument is available on that date, it plays the
+                     role of np.nan in weights of cal_quick_core
+    :param cost_rate:
+    :return: raw_ret, delta_weights_sum, cost, net_ret, each with shape = (T, ).
+    """
+    weights = weights.multiply(presence).tocsr()
+    raw_ret = np.asarray(weights.multiply(rets).sum(axis=1)).ravel()
+    delta_weights = (weights[1:] - weights[:-1]).multiply(presence[1:].multiply(presence[:-1]))
+    delta_weights_sum = np.zeros(weights.shape[0])
+    delta_weights_sum[1:] = np.asarray(abs(delta_weights).sum(axis=1)).ravel()
+    cost = delta_weights_sum * cost_rate
+    return raw_ret, delta_weights_sum, cost, raw_ret - cost
+
+
+def average_duplicates(
+        rows: np.ndarray, cols: np.ndarray, values: np.ndarray, n_cols: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    average values of duplicated (row, col), like CSimQuick.to_dense, because the constructor
+    of sp.csr_array sums them.
+
+    :return: unique rows and cols, averaged values, and number of duplicated (row, col)
+    """
+    keys = rows.astype(np.int64) * n_cols + cols
+    uniques, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    if len(uniques) == len(keys):
+        return rows, cols, values, 0
+    means = np.bincount(inverse.ravel(), weights=values, minlength=len(uniques)) / counts
+    return uniques // n_cols, uniques % n_cols, means, int((counts > 1).sum())
+
+
+def gen_sims_quick_nav_hash_db(save_dir: str, save_id: str) -> CDbStruct:
+    """
+    hash of the nav data used by the last chart, saved in the same db as the nav table,
+    to skip rendering when nav is not changed.
+
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="nav_hash",
+            primary_keys=[CSqlVar("fig_name", "TEXT")],
+            value_columns=[CSqlVar("nav_hash", "TEXT")],
+        )
+    )
+
+
+def gen_render_queue_db(save_dir: str, queue_name: str) -> CDbStruct:
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{queue_name}.db",
+        table=CSqlTable(
+            name="render_queue",
+            primary_keys=[CSqlVar("save_dir", "TEXT"), CSqlVar("save_id", "TEXT")],
+            value_columns=[
+                CSqlVar("date_type", "TEXT"),
+                CSqlVar("plot_bgn_date", "TEXT"),
+                CSqlVar("plot_stp_date", "TEXT"),
+            ],
+        )
+    )
+
+
+def load_quick_nav_range(
+        save_dir: str, save_id: str, date_type: TDateType, bgn_date: str, stp_date: str,
+) -> pd.DataFrame:
+    """
+
+    :return: a pd.DataFrame with index = trade_date("YYYYMMDD") and column "nav"
+    """
+    db_struct = gen_sims_quick_nav_db(save_dir=save_dir, save_id=save_id, date_type=date_type)
+    sqldb = CMgrSqlDb(
+        db_save_dir=save_dir,
+        db_name=db_struct.db_name,
+        table=db_struct.table,
+        mode="r",
+    )
+    nav_data = sqldb.read_by_range(
+        bgn_date=bgn_date, stp_date=stp_date,
+        value_columns=["trade_date", "nav"],
+    )
+    if date_type != TDateType.STR:
+        nav_data["trade_date"] = CCalendar.convert_dates_to_str(nav_data["trade_date"])
+    return nav_data.set_index("trade_date")
+
+
+def plot_quick_nav(nav_data: pd.DataFrame, save_dir: str, save_id: str):
+    artist = CPlotLines(
+        plot_data=nav_data,
+        fig_name=f"{save_id}",
+        fig_save_dir=save_dir,
+    )
+    artist.plot()
+    artist.set_axis_x(xtick_count=12)
+    artist.save_and_close()
+    return 0
+
+
+def render_quick_nav(
+        save_dir: str, save_id: str, date_type: TDateType, plot_bgn_date: str, plot_stp_date: str,
+        force: bool = False,
+) -> bool:
+    """
+    plot nav of CSimQuick, only if nav data in [plot_bgn_date, plot_stp_date) are changed
+    since the last rendering, or the chart is not found.
+
+    :param save_dir: sims_quick_dir of CSimQuick
+    :param save_id: signal_id of CSimQuick
+    :param date_type: date_type of CSimQuick
+    :param plot_bgn_date:
+    :param plot_stp_date:
+    :param force: render even if nav is not changed
+    :return: whether the chart is rendered
+    """
+    nav_data = load_quick_nav_range(save_dir, save_id, date_type, plot_bgn_date, plot_stp_date)
+    nav_hash = hashlib.sha256(pd.util.hash_pandas_object(nav_data, index=True).values.tobytes()).hexdigest()
+    hash_struct = gen_sims_quick_nav_hash_db(save_dir=save_dir, save_id=save_id)
+    sqldb = CMgrSqlDb(
+        db_save_dir=save_dir,
+        db_name=hash_struct.db_name,
+        table=hash_struct.table,
+        mode="a",
+    )
+    last_hash = sqldb.read_by_conditions(conditions=[("fig_name", "=", save_id)], value_columns=["nav_hash"])
+    fig_exists = os.path.exists(os.path.join(save_dir, f"{save_id}.pdf"))
+    if (not force) and fig_exists and (not last_hash.empty) and last_hash["nav_hash"].iloc[0] == nav_hash:
+        return False
+    plot_quick_nav(nav_data, save_dir=save_dir, save_id=save_id)
+    sqldb.update(update_data=pd.DataFrame({"fig_name": [save_id], "nav_hash": [nav_hash]}))
+    return True
+
+
+class CRenderQueue:
+    """
+    A render queue for charts of CSimQuick, saved in a sqlite table, so that rendering could be
+    scheduled separately from simulations, even in another process.
+    0.  put: called by CSimQuick.main, a chart is queued only once, the latest date range is kept.
+    1.  run: render all queued charts whose nav are changed, and remove them from queue.
+    """
+
+    def __init__(self, queue_dir: str, queue_name: str = "render_queue"):
+        self.db_struct = gen_render_queue_db(queue_dir, queue_name)
+
+    def __get_sqldb(self) -> CMgrSqlDb:
+        check_and_makedirs(self.db_struct.db_save_dir)
+        return CMgrSqlDb(
+            db_save_dir=self.db_struct.db_save_dir,
+            db_name=self.db_struct.db_name,
+            table=self.db_struct.table,
+            mode="a",
+        )
+
+    def put(self, save_dir: str, save_id: str, date_type: TDateType, plot_bgn_date: str, plot_stp_date: str):
+        data = pd.DataFrame([(save_dir, save_id, str(date_type), plot_bgn_date, plot_stp_date)])
+        self.__get_sqldb().update(update_data=data)
+        return 0
+
+    def get_tasks(self) -> pd.DataFrame:
+        return self.__get_sqldb().read()
+
+    def run(self, force: bool = False) -> int:
+        """
+
+        :param force: render all charts, even if nav is not changed
+        :return: number of rendered charts
+        """
+        sqldb, rendered = self.__get_sqldb(), 0
+        for task in sqldb.read().itertuples(index=False):
+            rendered += render_quick_nav(
+                save_dir=task.save_dir,
+                save_id=task.save_id,
+                date_type=TDateType(task.date_type),
+                plot_bgn_date=task.plot_bgn_date,
+                plot_stp_date=task.plot_stp_date,
+                force=force,
+            )
+            sqldb.delete_by_conditions(conditions=[("save_dir", "=", task.save_dir), ("save_id", "=", task.save_id)])
+        logger.info(f"{SFG(rendered)} charts are rendered by queue {SFG(self.db_struct.db_name)}")
+        return rendered
+
+
+def gen_sims_quick_batch_nav_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="nav",
+            primary_keys=[gen_sql_var_date("trade_date", date_type), CSqlVar("sid", "TEXT")],
+            value_columns=[
+                CSqlVar("raw_ret", "REAL"),
+                CSqlVar("delta_weights_sum", "REAL"),
+                CSqlVar("cost", "REAL"),
+                CSqlVar("ret", "REAL"),
+                CSqlVar("nav", "REAL"),
+            ],
+        )
+    )
+
+
+def get_quick_sim_dates(bgn_date: str, stp_date: str, calendar: CCalendar, shift: int) -> tuple[list[str], list[str]]:
+    """
+
+    :param bgn_date:
+    :param stp_date:
+    :param calendar:
+    :param shift: shift of test returns, see CTestReturnLoaderBase.shift
+    :return: sig_dates and exe_dates with the same size, with one more date before bgn_date
+             for calculating delta weights
+    """
+    d = shift + 1  # +1 for calculating delta weights
+    buffer_bgn_date = calendar.get_next_date(bgn_date, -d)
+    iter_dates = calendar.get_iter_list(buffer_bgn_date, stp_date)
+    sig_dates = iter_dates[0:-d + 1]
+    exe_dates = iter_dates[(d - 1):]
+    return sig_dates, exe_dates
+
+
 class CSignalsLoaderBase:
     def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
         """
@@ -64,7 +318,13 @@ class CSimQuick:
     1.  the results may be a slightly BETTER than the results in husfort.qsimulation because of:
         1.1 major contract shifting is NOT considered, less cost is calculated.
         1.2 a precise weight number instead of a specific quantity is used.
-    2.  Always plot a nav curve since nav_plot_bgn_date.
+    2.  plot a nav curve since nav_plot_bgn_date, only if nav is changed. Rendering could be skipped
+        with plot = False, or deferred with a CRenderQueue.
+    3.  set date_type = TDateType.INT or TDateType.SERIAL to merge and pivot signals and returns
+        on int32 dates instead of strings, which is faster and uses less memory. In both modes
+        trade_date is saved as INTEGER(YYYYMMDD) in the nav table.
+    4.  set sparse = True for large universes with sparse signals, signals and returns are not merged,
+        but are saved in CSR matrices with rows = calendar serials and columns = instruments.
     """
 
     def __init__(
@@ -73,6 +333,8 @@ class CSimQuick:
             test_return_loader: CTestReturnLoaderBase,
             cost_rate: float,
             sims_quick_dir: str,
+            date_type: TDateType = TDateType.STR,
+            sparse: bool = False,
     ):
         """
 
@@ -82,40 +344,130 @@ class CSimQuick:
                                    and provide details to methods: load, shift and ret_name.
         :param cost_rate:
         :param sims_quick_dir:
+        :param date_type: type of dates used to merge signals and returns, see TDateType
+        :param sparse: use sparse matrices instead of dense arrays to calculate returns and cost
         """
         self.signals_loader = signals_loader
         self.test_return_loader = test_return_loader
         self.cost_rate = cost_rate
         self.quick_sim_save_dir = sims_quick_dir
+        self.date_type = date_type
+        self.sparse = sparse
 
     def get_dates(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> tuple[list[str], list[str]]:
-        d = self.test_return_loader.shift + 1  # +1 for calculating delta weights
-        buffer_bgn_date = calendar.get_next_date(bgn_date, -d)
-        iter_dates = calendar.get_iter_list(buffer_bgn_date, stp_date)
-        sig_dates = iter_dates[0:-d + 1]
-        exe_dates = iter_dates[(d - 1):]
-        return sig_dates, exe_dates
-
-    def get_sigs_and_rets(self, base_bgn_date: str, base_stp_date: str) -> pd.DataFrame:
+        return get_quick_sim_dates(bgn_date, stp_date, calendar, shift=self.test_return_loader.shift)
+
+    def get_sigs_and_rets(self, base_bgn_date: str, base_stp_date: str, calendar: CCalendar = None) -> pd.DataFrame:
+        """
+
+        :param base_bgn_date:
+        :param base_stp_date:
+        :param calendar: required if date_type is not TDateType.STR, to encode dates
+        :return:
+        """
+        if self.date_type != TDateType.STR and calendar is None:
+            raise ValueError(f"calendar must be provided with date_type = {self.date_type}")
         sigs = self.signals_loader.load(base_bgn_date, base_stp_date)
         rets = self.test_return_loader.load(base_bgn_date, base_stp_date)
+        if self.date_type != TDateType.STR:
+            sigs = sigs.assign(trade_date=calendar.encode_dates(sigs["trade_date"], self.date_type))
+            rets = rets.assign(trade_date=calendar.encode_dates(rets["trade_date"], self.date_type))
         data = pd.merge(left=sigs, right=rets, how="right", on=["trade_date", "instrument"]).fillna(0)
         return data
 
+    def to_dense(self, data: pd.DataFrame) -> tuple[pd.Index, pd.Index, np.ndarray, np.ndarray]:
+        """
+
+        :param data: output of self.get_sigs_and_rets. If a (trade_date, instrument) appears more than
+                     once, its weights and returns are averaged, like pd.pivot_table, with a warning.
+        :return: dates(size = T), instruments(size = N), weights and returns with shape = (T, N).
+                 weights are np.nan and returns are 0 where the instrument is not in data.
+        """
+        date_codes, dates = pd.factorize(data["trade_date"], sort=True)
+        instru_codes, instruments = pd.factorize(data["instrument"], sort=True)
+        shape = (len(dates), len(instruments))
+        flat_codes = date_codes * shape[1] + instru_codes
+        counts = np.bincount(flat_codes, minlength=shape[0] * shape[1])
+        if (dup_size := int((counts > 1).sum())) > 0:
+            logger.warning(
+                f"{dup_size} (trade_date, instrument) pairs of {SFY(self.signals_loader.signal_id)} "
+                f"appear more than once, their weights and returns are averaged"
+            )
+        present = counts > 0
+        weight_sum = np.bincount(flat_codes, weights=data["weight"].values, minlength=counts.size)
+        ret_sum = np.bincount(flat_codes, weights=data[self.test_return_loader.ret_name].values, minlength=counts.size)
+        weights = np.full(counts.size, np.nan)
+        rets = np.zeros(counts.size)
+        weights[present] = weight_sum[present] / counts[present]
+        rets[present] = ret_sum[present] / counts[present]
+        return pd.Index(dates, name="trade_date"), pd.Index(instruments), weights.reshape(shape), rets.reshape(shape)
+
     def cal_core(self, data: pd.DataFrame, exe_dates: list[str]) -> pd.DataFrame:
-        raw_ret = data.groupby(by="trade_date").apply(lambda z: z["weight"] @ z[self.test_return_loader.ret_name])
-        daily_weights = pd.pivot_table(data=data, index="trade_date", columns="instrument", values="weight")
-        delta_weights = daily_weights.diff().fillna(0)
-        delta_weights_sum = delta_weights.abs().sum(axis=1)
-        cost = delta_weights_sum * self.cost_rate
-        net_ret = raw_ret - cost
+        dates, _, weights, rets = self.to_dense(data)
+        raw_ret, delta_weights_sum, cost, net_ret = cal_quick_core(weights, rets, self.cost_rate)
         result = pd.DataFrame({
             "raw_ret": raw_ret,
             "delta_weights_sum": delta_weights_sum,
             "cost": cost,
             "ret": net_ret,
             "exe_date": exe_dates,
-        })
+        }, index=dates)
+        return result
+
+    def get_sparse_sigs_and_rets(
+            self, base_bgn_date: str, base_stp_date: str, calendar: CCalendar,
+    ) -> tuple[np.ndarray, pd.Index, sp.csr_array, sp.csr_array, sp.csr_array]:
+        """
+        sparse counterpart of self.get_sigs_and_rets and self.to_dense
+
+        :param base_bgn_date:
+        :param base_stp_date:
+        :param calendar:
+        :return: serials(size = T) of dates with returns, instruments(size = N) with returns,
+                 weights, returns and presence with shape = (T, N). Signals without returns are dropped.
+        """
+        def get_serials(dates: pd.Series) -> np.ndarray:
+            # only unique dates are converted, which is much faster for long data
+            codes, uniques = pd.factorize(dates)
+            return calendar.get_serials(uniques)[codes]
+
+        sigs = self.signals_loader.load(base_bgn_date, base_stp_date)
+        rets = self.test_return_loader.load(base_bgn_date, base_stp_date)
+        serials, rows = np.unique(get_serials(rets["trade_date"]), return_inverse=True)
+        cols, instruments = pd.factorize(rets["instrument"], sort=True)
+        shape = (len(serials), len(instruments))
+        ret_values = np.nan_to_num(rets[self.test_return_loader.ret_name].values.astype(np.float64))
+        rows, cols, ret_values, ret_dup_size = average_duplicates(rows, cols, ret_values, shape[1])
+        presence = sp.csr_array((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=shape)
+        ret_mat = sp.csr_array((ret_values, (rows, cols)), shape=shape)
+
+        sig_serials = get_serials(sigs["trade_date"])
+        sig_rows = np.minimum(np.searchsorted(serials, sig_serials), max(len(serials) - 1, 0))
+        sig_cols = pd.Index(instruments).get_indexer(sigs["instrument"])
+        keep = (sig_cols >= 0) & (serials[sig_rows] == sig_serials)
+        weight_values = np.nan_to_num(sigs["weight"].values[keep].astype(np.float64))
+        sig_rows, sig_cols, weight_values, sig_dup_size = average_duplicates(
+            sig_rows[keep], sig_cols[keep], weight_values, shape[1])
+        if ret_dup_size + sig_dup_size > 0:
+            logger.warning(
+                f"{ret_dup_size} (trade_date, instrument) pairs of returns and {sig_dup_size} pairs of "
+                f"{SFY(self.signals_loader.signal_id)} appear more than once, their values are averaged"
+            )
+        weights = sp.csr_array((weight_values, (sig_rows, sig_cols)), shape=shape)
+        return serials, pd.Index(instruments), weights, ret_mat, presence
+
+    def cal_core_sparse(
+            self, base_bgn_date: str, base_stp_date: str, exe_dates: list[str], calendar: CCalendar,
+    ) -> pd.DataFrame:
+        serials, _, weights, rets, presence = self.get_sparse_sigs_and_rets(base_bgn_date, base_stp_date, calendar)
+        raw_ret, delta_weights_sum, cost, net_ret = cal_quick_core_sparse(weights, rets, presence, self.cost_rate)
+        result = pd.DataFrame({
+            "raw_ret": raw_ret,
+            "delta_weights_sum": delta_weights_sum,
+            "cost": cost,
+            "ret": net_ret,
+            "exe_date": exe_dates,
+        }, index=pd.Index(calendar.get_dates_from_serials(serials), name="trade_date"))
         return result
 
     @staticmethod
@@ -130,7 +482,11 @@ class CSimQuick:
         return 0
 
     def load_nav_at_date(self, trade_date: str) -> float:
-        db_struct = gen_sims_quick_nav_db(save_dir=self.quick_sim_save_dir, save_id=self.signals_loader.signal_id)
+        db_struct = gen_sims_quick_nav_db(
+            save_dir=self.quick_sim_save_dir,
+            save_id=self.signals_loader.signal_id,
+            date_type=self.date_type,
+        )
         sqldb = CMgrSqlDb(
             db_save_dir=self.quick_sim_save_dir,
             db_name=db_struct.db_name,
@@ -148,54 +504,254 @@ class CSimQuick:
         return last_nav
 
     def load_nav_range(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
-        db_struct = gen_sims_quick_nav_db(save_dir=self.quick_sim_save_dir, save_id=self.signals_loader.signal_id)
-        sqldb = CMgrSqlDb(
-            db_save_dir=self.quick_sim_save_dir,
-            db_name=db_struct.db_name,
-            table=db_struct.table,
-            mode="r",
+        return load_quick_nav_range(
+            save_dir=self.quick_sim_save_dir,
+            save_id=self.signals_loader.signal_id,
+            date_type=self.date_type,
+            bgn_date=bgn_date,
+            stp_date=stp_date,
         )
-        nav_data = sqldb.read_by_range(
-            bgn_date=bgn_date, stp_date=stp_date,
-            value_columns=["trade_date", "nav"],
-        )
-        return nav_data.set_index("trade_date")
 
     def save_nav(self, net_result: pd.DataFrame, calendar: CCalendar):
-        db_struct = gen_sims_quick_nav_db(save_dir=self.quick_sim_save_dir, save_id=self.signals_loader.signal_id)
+        db_struct = gen_sims_quick_nav_db(
+            save_dir=self.quick_sim_save_dir,
+            save_id=self.signals_loader.signal_id,
+            date_type=self.date_type,
+        )
         sqldb = CMgrSqlDb(
             db_save_dir=self.quick_sim_save_dir,
             db_name=db_struct.db_name,
             table=db_struct.table,
             mode="a",
         )
+        if self.date_type != TDateType.STR:
+            net_result = net_result.set_index(
+                pd.Index(CCalendar.convert_dates_to_int(net_result.index), name="trade_date")
+            )
         if sqldb.check_continuity(net_result.index[0], calendar) == 0:
             sqldb.update(update_data=net_result, using_index=True)
         return 0
 
     def plot(self, nav_data: pd.DataFrame):
-        artist = CPlotLines(
-            plot_data=nav_data,
-            fig_name=f"{self.signals_loader.signal_id}",
-            fig_save_dir=self.quick_sim_save_dir,
+        return plot_quick_nav(nav_data, save_dir=self.quick_sim_save_dir, save_id=self.signals_loader.signal_id)
+
+    def render(self, plot_bgn_date: str, plot_stp_date: str, force: bool = False) -> bool:
+        return render_quick_nav(
+            save_dir=self.quick_sim_save_dir,
+            save_id=self.signals_loader.signal_id,
+            date_type=self.date_type,
+            plot_bgn_date=plot_bgn_date,
+            plot_stp_date=plot_stp_date,
+            force=force,
         )
-        artist.plot()
-        artist.set_axis_x(xtick_count=12)
-        artist.save_and_close()
-        return 0
 
-    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar, nav_plot_bgn_date: str = "20120104"):
+    def main(
+            self, bgn_date: str, stp_date: str, calendar: CCalendar, nav_plot_bgn_date: str = "20120104",
+            plot: bool = True, render_queue: CRenderQueue = None,
+    ):
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param nav_plot_bgn_date:
+        :param plot: whether to plot nav, charts are rendered only if nav data are changed
+        :param render_queue: if provided, the chart is put into this queue instead of being
+                             rendered now, and will be rendered by render_queue.run
+        :return:
+        """
         sig_dates, exe_dates = self.get_dates(bgn_date, stp_date, calendar)
         base_bgn_date, base_stp_date = sig_dates[0], calendar.get_next_date(sig_dates[-1], shift=1)
         last_date = calendar.get_next_date(bgn_date, shift=-1)
-        data = self.get_sigs_and_rets(base_bgn_date, base_stp_date)
-        raw_result = self.cal_core(data, exe_dates)
+        if self.sparse:
+            raw_result = self.cal_core_sparse(base_bgn_date, base_stp_date, exe_dates, calendar)
+        else:
+            data = self.get_sigs_and_rets(base_bgn_date, base_stp_date, calendar)
+            raw_result = self.cal_core(data, exe_dates)
         net_result = self.recalibrate_dates(raw_result, bgn_date)
         last_nav = self.load_nav_at_date(trade_date=last_date)
         self.update_nav(net_result, last_nav)
         self.save_nav(net_result, calendar)
-        nav_data = self.load_nav_range(bgn_date=nav_plot_bgn_date, stp_date=stp_date)
-        self.plot(nav_data=nav_data)
+        if render_queue is not None:
+            render_queue.put(
+                save_dir=self.quick_sim_save_dir,
+                save_id=self.signals_loader.signal_id,
+                date_type=self.date_type,
+                plot_bgn_date=nav_plot_bgn_date,
+                plot_stp_date=stp_date,
+            )
+        elif plot:
+            self.render(plot_bgn_date=nav_plot_bgn_date, plot_stp_date=stp_date)
+        return 0
+
+
+class CSimQuickBatch:
+    """
+    A batched version of CSimQuick, to test many signals against the same test returns.
+    0.  test returns are loaded once, signals are stacked into a (K x date x instrument)
+        weight tensor, and navs of all K signals are calculated in one vectorized pass,
+        batch_size signals at a time to limit memory.
+    1.  results are the same as CSimQuick. All navs are saved with a single bulk write
+        into one table keyed by (trade_date, sid), see gen_sims_quick_batch_nav_db.
+    2.  increment test is supported, all signals must be updated together.
+    3.  nothing is plotted.
+    """
+
+    def __init__(
+            self,
+            signals_loaders: list[CSignalsLoaderBase],
+            test_return_loader: CTestReturnLoaderBase,
+            cost_rate: float,
+            sims_quick_dir: str,
+            save_id: str,
+            date_type: TDateType = TDateType.STR,
+            batch_size: int = 64,
+    ):
+        """
+
+        :param signals_loaders: signal_id of each loader must be unique
+        :param test_return_loader:
+        :param cost_rate:
+        :param sims_quick_dir:
+        :param save_id: name of db file
+        :param date_type: type of trade_date in nav table, see TDateType
+        :param batch_size: number of signals calculated in one pass
+        """
+        self.signals_loaders = signals_loaders
+        self.test_return_loader = test_return_loader
+        self.cost_rate = cost_rate
+        self.quick_sim_save_dir = sims_quick_dir
+        self.save_id = save_id
+        self.date_type = date_type
+        self.batch_size = batch_size
+        self.sids: list[str] = [loader.signal_id for loader in signals_loaders]
+        if len(set(self.sids)) < len(self.sids):
+            raise ValueError("signal_id of signals_loaders must be unique")
+
+    @property
+    def db_struct(self) -> CDbStruct:
+        return gen_sims_quick_batch_nav_db(self.quick_sim_save_dir, save_id=self.save_id, date_type=self.date_type)
+
+    def get_dates(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> tuple[list[str], list[str]]:
+        return get_quick_sim_dates(bgn_date, stp_date, calendar, shift=self.test_return_loader.shift)
+
+    def load_rets(self, sig_dates: list[str], base_bgn_date: str, base_stp_date: str):
+        """
+
+        :return: instruments(size = N), returns with shape = (T, N), T = len(sig_dates),
+                 and a bool mask with shape = (T, N), True if return of (date, instrument) is available
+        """
+        data = self.test_return_loader.load(base_bgn_date, base_stp_date)
+        t_idx = pd.Index(sig_dates).get_indexer(data["trade_date"])
+        data, t_idx = data[t_idx >= 0], t_idx[t_idx >= 0]
+        instru_codes, instruments = pd.factorize(data["instrument"], sort=True)
+        rets = np.zeros((len(sig_dates), len(instruments)))
+        available = np.zeros((len(sig_dates), len(instruments)), dtype=np.bool_)
+        rets[t_idx, instru_codes] = data[self.test_return_loader.ret_name].fillna(0).values
+        available[t_idx, instru_codes] = True
+        return pd.Index(instruments), rets, available
+
+    def load_weights(
+            self, loaders: list[CSignalsLoaderBase], sig_dates: list[str], instruments: pd.Index,
+            available: np.ndarray, base_bgn_date: str, base_stp_date: str,
+    ) -> np.ndarray:
+        """
+
+        :return: weights with shape = (K, T, N), K = len(loaders), weights are 0 if there is no
+                 signal but the return is available, np.nan if the return is not available,
+                 the same as the right merge in CSimQuick.get_sigs_and_rets.
+        """
+        weights = np.zeros((len(loaders),) + available.shape)
+        dates_idx = pd.Index(sig_dates)
+        for k, loader in enumerate(loaders):
+            sigs = loader.load(base_bgn_date, base_stp_date)
+            t_idx, i_idx = dates_idx.get_indexer(sigs["trade_date"]), instruments.get_indexer(sigs["instrument"])
+            keep = (t_idx >= 0) & (i_idx >= 0)
+            weights[k, t_idx[keep], i_idx[keep]] = sigs["weight"].fillna(0).values[keep]
+        weights[:, ~available] = np.nan
+        return weights
+
+    def load_last_navs(self, trade_date: str) -> np.ndarray:
+        """
+
+        :return: nav of each signal at trade_date, 1.0 if not found
+        """
+        db_struct = self.db_struct
+        last_navs = np.ones(len(self.sids))
+        if not os.path.exists(os.path.join(db_struct.db_save_dir, db_struct.db_name)):
+            return last_navs
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="r",
+        )
+        if not sqldb.has_table(db_struct.table):
+            return last_navs
+        date = trade_date if self.date_type == TDateType.STR else int(trade_date)
+        nav_data = sqldb.read_by_conditions(conditions=[("trade_date", "=", date)], value_columns=["sid", "nav"])
+        return nav_data.set_index("sid")["nav"].reindex(self.sids).fillna(1.0).values
+
+    def cal(self, bgn_date: str, stp_date: str, calendar: CCalendar) -> pd.DataFrame:
+        """
+
+        :return: a long pd.DataFrame with the same columns as the nav table
+        """
+        sig_dates, exe_dates = self.get_dates(bgn_date, stp_date, calendar)
+        base_bgn_date, base_stp_date = sig_dates[0], calendar.get_next_date(sig_dates[-1], shift=1)
+        instruments, rets, available = self.load_rets(sig_dates, base_bgn_date, base_stp_date)
+        keep = np.array(exe_dates) >= bgn_date
+        last_navs = self.load_last_navs(trade_date=calendar.get_next_date(bgn_date, shift=-1))
+        res: dict[str, list[np.ndarray]] = {"raw_ret": [], "delta_weights_sum": [], "cost": [], "ret": []}
+        for bi in range(0, len(self.signals_loaders), self.batch_size):
+            loaders = self.signals_loaders[bi:bi + self.batch_size]
+            weights = self.load_weights(loaders, sig_dates, instruments, available, base_bgn_date, base_stp_date)
+            for name, values in zip(res, cal_quick_core(weights, rets, self.cost_rate)):
+                res[name].append(values[:, keep])
+        data = {name: np.concatenate(values, axis=0) for name, values in res.items()}  # shape = (K, T')
+        data["nav"] = np.cumprod(data["ret"] + 1, axis=1) * last_navs[:, None]
+        trade_dates = np.array(exe_dates)[keep]
+        if self.date_type != TDateType.STR:
+            trade_dates = CCalendar.convert_dates_to_int(trade_dates)
+        return pd.DataFrame({
+            "trade_date": np.tile(trade_dates, len(self.sids)),
+            "sid": np.repeat(self.sids, len(trade_dates)),
+            **{name: values.ravel() for name, values in data.items()},
+        }).sort_values(by=["trade_date", "sid"], kind="stable", ignore_index=True)
+
+    def save_nav(self, nav_data: pd.DataFrame, calendar: CCalendar):
+        db_struct = self.db_struct
+        check_and_makedirs(db_struct.db_save_dir)
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="a",
+        )
+        if sqldb.check_continuity(nav_data["trade_date"].iloc[0], calendar) == 0:
+            sqldb.update(update_data=nav_data)
+        return 0
+
+    def load_nav_range(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+
+        :return: a pd.DataFrame with index = trade_date("YYYYMMDD"), columns = sids
+        """
+        db_struct = self.db_struct
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="r",
+        )
+        nav_data = sqldb.read_by_range(bgn_date=bgn_date, stp_date=stp_date, value_columns=["trade_date", "sid", "nav"])
+        if self.date_type != TDateType.STR:
+            nav_data["trade_date"] = CCalendar.convert_dates_to_str(nav_data["trade_date"])
+        return nav_data.pivot(index="trade_date", columns="sid", values="nav")[self.sids]
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+        nav_data = self.cal(bgn_date, stp_date, calendar)
+        self.save_nav(nav_data, calendar)
         return 0
 
 
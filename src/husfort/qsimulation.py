@@ -1,21 +1,32 @@
+import os
+import bisect
+import threading
+import traceback
+import datetime as dt
 import numpy as np
 import pandas as pd
+from typing import Any, Callable, Literal
+from concurrent.futures import Future
+from collections.abc import MutableMapping
+from queue import Empty
+from multiprocessing import Queue, get_context, get_all_start_methods
 from dataclasses import dataclass
 from enum import IntEnum, StrEnum
+from numba import njit
 from loguru import logger
-from husfort.qcalendar import CCalendar
+from husfort.qcalendar import CCalendar, CCalendarSection, CSection, TDateType
 from husfort.qutility import check_and_makedirs, SFG, SFY
 from husfort.qinstruments import CInstruMgr
-from husfort.qsqlite import CMgrSqlDb, CDbStruct, CSqlTable, CSqlVar
+from husfort.qsqlite import CMgrSqlDb, CDbStruct, CSqlTable, CSqlVar, gen_sql_var_date, update_in_transaction
 
 
-def gen_nav_db(save_dir: str, save_id: str) -> CDbStruct:
+def gen_nav_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
     return CDbStruct(
         db_save_dir=save_dir,
         db_name=f"{save_id}.db",
         table=CSqlTable(
             name="nav",
-            primary_keys=[CSqlVar("trade_date", "TEXT")],
+            primary_keys=[gen_sql_var_date("trade_date", date_type)],
             value_columns=[
                 CSqlVar("init_cash", "REAL"),
                 CSqlVar("tot_realized_pnl", "REAL"),
@@ -31,6 +42,147 @@ def gen_nav_db(save_dir: str, save_id: str) -> CDbStruct:
     )
 
 
+def gen_nav_section_db(save_dir: str, save_id: str) -> CDbStruct:
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="nav_section",
+            primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("section", "TEXT")],
+            value_columns=[
+                CSqlVar("init_cash", "REAL"),
+                CSqlVar("tot_realized_pnl", "REAL"),
+                CSqlVar("this_day_realized_pnl", "REAL"),
+                CSqlVar("this_day_cost", "REAL"),
+                CSqlVar("tot_unrealized_pnl", "REAL"),
+                CSqlVar("last_nav", "REAL"),
+                CSqlVar("nav", "REAL"),
+                CSqlVar("navps", "REAL"),
+                CSqlVar("ret", "REAL"),
+            ]
+        )
+    )
+
+
+def gen_rolls_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
+    """
+    costs of major contract rolls, saved in the same db as the nav table. These costs are
+    already included in this_day_cost of the nav table, they are reported here separately.
+
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="rolls",
+            primary_keys=[gen_sql_var_date("trade_date", date_type), CSqlVar("instrument", "TEXT")],
+            value_columns=[
+                CSqlVar("old_contract", "TEXT"),
+                CSqlVar("new_contract", "TEXT"),
+                CSqlVar("qty", "INTEGER"),
+                CSqlVar("roll_cost", "REAL"),
+            ]
+        )
+    )
+
+
+def gen_ledger_trades_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
+    """
+    seq is the sequence number of a trade in its trade date, because there may be more than
+    one trade with the same contract, direction and offset in a day.
+
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="trades",
+            primary_keys=[
+                gen_sql_var_date("trade_date", date_type),
+                CSqlVar("seq", "INTEGER"),
+            ],
+            value_columns=[
+                CSqlVar("contract", "TEXT"),
+                CSqlVar("direction", "INTEGER"),
+                CSqlVar("offset", "INTEGER"),
+                CSqlVar("qty", "INTEGER"),
+                CSqlVar("multiplier", "REAL"),
+                CSqlVar("exe_price", "REAL"),
+                CSqlVar("cost", "REAL"),
+            ]
+        )
+    )
+
+
+def gen_ledger_positions_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="positions",
+            primary_keys=[
+                gen_sql_var_date("trade_date", date_type),
+                CSqlVar("contract", "TEXT"),
+                CSqlVar("direction", "INTEGER"),
+            ],
+            value_columns=[
+                CSqlVar("qty", "INTEGER"),
+                CSqlVar("multiplier", "REAL"),
+                CSqlVar("cost_price", "REAL"),
+                CSqlVar("last_price", "REAL"),
+            ]
+        )
+    )
+
+
+def gen_ckpt_account_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
+    """
+    account state after the last saved date, saved in the same db as the nav table.
+    There is only 1 row in this table, it is rewritten after each run.
+
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="ckpt_account",
+            primary_keys=[gen_sql_var_date("trade_date", date_type)],
+            value_columns=[
+                CSqlVar("init_cash", "REAL"),
+                CSqlVar("tot_realized_pnl", "REAL"),
+                CSqlVar("tot_unrealized_pnl", "REAL"),
+                CSqlVar("last_nav", "REAL"),
+            ]
+        )
+    )
+
+
+def gen_ckpt_positions_db(save_dir: str, save_id: str, date_type: TDateType = TDateType.STR) -> CDbStruct:
+    """
+    positions after the last saved date, saved in the same db as the nav table,
+    rewritten after each run.
+
+    """
+    return CDbStruct(
+        db_save_dir=save_dir,
+        db_name=f"{save_id}.db",
+        table=CSqlTable(
+            name="ckpt_positions",
+            primary_keys=[
+                gen_sql_var_date("trade_date", date_type),
+                CSqlVar("contract", "TEXT"),
+                CSqlVar("direction", "INTEGER"),
+            ],
+            value_columns=[
+                CSqlVar("qty", "INTEGER"),
+                CSqlVar("multiplier", "REAL"),
+                CSqlVar("cost_price", "REAL"),
+                CSqlVar("last_price", "REAL"),
+            ]
+        )
+    )
+
+
 class TExePriceType(StrEnum):
     OPEN = "open"
     CLOSE = "close"
@@ -69,7 +221,47 @@ class CTrade:
         return self.exe_price * self.multiplier * self.qty * cost_rate
 
 
-def print_trades(trades: list[CTrade], color: bool = True):
+@dataclass
+class CTrades:
+    """
+    Trades of a day in columnar layout, all arrays have the same size as keys.
+    """
+    keys: list[CPosKey]
+    offsets: np.ndarray  # TPosOffset, int64
+    qtys: np.ndarray  # int64
+    multipliers: np.ndarray  # float64
+    exe_prices: np.ndarray  # float64
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def costs(self, cost_rate: float) -> np.ndarray:
+        return self.exe_prices * self.multipliers * self.qtys * cost_rate
+
+    def to_list(self) -> list[CTrade]:
+        return [
+            CTrade(key=key, offset=TPosOffset(offset), qty=qty, multiplier=multiplier, exe_price=exe_price)
+            for key, offset, qty, multiplier, exe_price in zip(
+                self.keys, self.offsets.tolist(), self.qtys.tolist(),
+                self.multipliers.tolist(), self.exe_prices.tolist(),
+            )
+        ]
+
+    @staticmethod
+    def from_list(trades: list[CTrade]) -> "CTrades":
+        return CTrades(
+            keys=[trade.key for trade in trades],
+            offsets=np.array([trade.offset for trade in trades], dtype=np.int64),
+            qtys=np.array([trade.qty for trade in trades], dtype=np.int64),
+            multipliers=np.array([trade.multiplier for trade in trades], dtype=np.float64),
+            exe_prices=np.array([trade.exe_price for trade in trades], dtype=np.float64),
+        )
+
+
+def print_trades(trades: list[CTrade] | CTrades, color: bool = True):
     for ti, trade in enumerate(trades):
         if color:
             print(f"| {ti:>04d} | {SFG(trade)} |")
@@ -133,8 +325,234 @@ class CPosition:
 
 TPositions = dict[CPosKey, CPosition]
 
+"""
+------ position book ------
+"""
+
+POS_DTYPE = np.dtype([
+    ("qty", np.int64),
+    ("cost_price", np.float64),
+    ("last_price", np.float64),
+    ("multiplier", np.float64),
+    ("direction", np.int64),
+])
+
+
+@njit(cache=True)
+def apply_trades_to_book(
+        book: np.ndarray, slots: np.ndarray, offsets: np.ndarray, qtys: np.ndarray,
+        exe_prices: np.ndarray, multipliers: np.ndarray, cost_rate: float,
+) -> tuple[float, float, int]:
+    """
+    apply trades in order, the same arithmetic as CPosition.update_from_trade
+
+    :param book: structured array with dtype = POS_DTYPE, updated in place
+    :param slots: row of book for each trade
+    :param offsets: TPosOffset.OPN = 1, TPosOffset.CLS = -1
+    :param qtys:
+    :param exe_prices:
+    :param multipliers: multiplier of each trade, used to calculate cost
+    :param cost_rate:
+    :return: realized_pnl, cost, index of the first illegal trade(-1 if all trades are legal)
+    """
+    realized_pnl, cost = 0.0, 0.0
+    for k in range(slots.size):
+        pos = book[slots[k]]
+        qty, exe_price = qtys[k], exe_prices[k]
+        cost += exe_price * multipliers[k] * qty * cost_rate
+        if offsets[k] == 1:
+            sum_qty = pos["qty"] + qty
+            pos["cost_price"] = (pos["cost_price"] * pos["qty"] + exe_price * qty) / sum_qty
+            pos["qty"] = sum_qty
+        else:
+            if qty > pos["qty"]:
+                return realized_pnl, cost, k
+            pos["qty"] -= qty
+            realized_pnl += (exe_price - pos["cost_price"]) * pos["multiplier"] * qty * pos["direction"]
+    return realized_pnl, cost, -1
+
+
+@njit(cache=True)
+def mark_book_to_market(book: np.ndarray, slots: np.ndarray, last_prices: np.ndarray) -> float:
+    """
+
+    :param book: structured array with dtype = POS_DTYPE, updated in place
+    :param slots: rows to be updated
+    :param last_prices: last price for each row
+    :return: unrealized pnl of these rows
+    """
+    unrealized_pnl = 0.0
+    for k in range(slots.size):
+        pos = book[slots[k]]
+        pos["last_price"] = last_prices[k]
+        unrealized_pnl += (pos["last_price"] - pos["cost_price"]) * pos["multiplier"] * pos["qty"] * pos["direction"]
+    return unrealized_pnl
+
+
+class CPositionView:
+    """
+    A view of one row in CPositionBook, with the same attributes and methods as CPosition.
+    Reading or writing its attributes reads or writes the book directly.
+    """
+
+    def __init__(self, book: "CPositionBook", slot: int):
+        self._book = book
+        self._slot = slot
+
+    def __repr__(self) -> str:
+        return repr(self.to_position())
+
+    def to_position(self) -> CPosition:
+        """
+
+        :return: a copy of this position, not linked to the book
+        """
+        return CPosition(
+            key=self.key, qty=self.qty, multiplier=self.multiplier,
+            cost_price=self.cost_price, last_price=self.last_price,
+        )
+
+    @property
+    def key(self) -> CPosKey:
+        return self._book.slot_keys[self._slot]
+
+    @property
+    def qty(self) -> int:
+        return int(self._book.data[self._slot]["qty"])
+
+    @qty.setter
+    def qty(self, val: int):
+        self._book.data[self._slot]["qty"] = val
 
-def print_positions(positions: TPositions, color: bool = True):
+    @property
+    def multiplier(self) -> float:
+        return float(self._book.data[self._slot]["multiplier"])
+
+    @multiplier.setter
+    def multiplier(self, val: int | float):
+        self._book.data[self._slot]["multiplier"] = val
+
+    @property
+    def cost_price(self) -> float:
+        return float(self._book.data[self._slot]["cost_price"])
+
+    @cost_price.setter
+    def cost_price(self, val: float):
+        self._book.data[self._slot]["cost_price"] = val
+
+    @property
+    def last_price(self) -> float:
+        return float(self._book.data[self._slot]["last_price"])
+
+    @last_price.setter
+    def last_price(self, val: float):
+        self._book.data[self._slot]["last_price"] = val
+
+    # methods of CPosition only use the attributes above, so they are shared
+    unrealized_pnl = property(CPosition.unrealized_pnl.fget)
+    cal_trade_from_target = CPosition.cal_trade_from_target
+    convert_as_trade = CPosition.convert_as_trade
+    update_from_trade = CPosition.update_from_trade
+    update_from_market = CPosition.update_from_market
+
+
+class CPositionBook(MutableMapping):
+    """
+    Positions of an account, saved as a structured array with dtype = POS_DTYPE, one row for each
+    position key. It behaves like TPositions, i.e. dict[CPosKey, CPosition], values are CPositionView.
+    Trades of a whole day are applied in one call by apply_trades.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.data: np.ndarray = np.zeros(capacity, dtype=POS_DTYPE)
+        self.slot_keys: list[CPosKey | None] = [None] * capacity
+        self.slots: dict[CPosKey, int] = {}
+        self.free_slots: list[int] = list(range(capacity - 1, -1, -1))
+
+    def __alloc(self, key: CPosKey, multiplier: int | float) -> int:
+        if not self.free_slots:
+            capacity = len(self.data)
+            self.data = np.concatenate([self.data, np.zeros(capacity, dtype=POS_DTYPE)])
+            self.slot_keys.extend([None] * capacity)
+            self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+        slot = self.free_slots.pop()
+        self.data[slot] = (0, 0.0, 0.0, multiplier, int(key.direction))
+        self.slot_keys[slot] = key
+        self.slots[key] = slot
+        return slot
+
+    def __getitem__(self, key: CPosKey) -> CPositionView:
+        return CPositionView(self, self.slots[key])
+
+    def __setitem__(self, key: CPosKey, pos: CPosition):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.__alloc(key, pos.multiplier)
+        self.data[slot] = (pos.qty, pos.cost_price, pos.last_price, pos.multiplier, int(key.direction))
+
+    def __delitem__(self, key: CPosKey):
+        slot = self.slots.pop(key)
+        self.slot_keys[slot] = None
+        self.free_slots.append(slot)
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, key) -> bool:
+        return key in self.slots
+
+    def apply_trades(self, trades: CTrades, cost_rate: float) -> tuple[float, float]:
+        """
+
+        :param trades: trades of a day, use CTrades.from_list to convert a list of CTrade
+        :param cost_rate:
+        :return: realized_pnl, cost
+        """
+        if len(trades) == 0:
+            return 0.0, 0.0
+        slots = [self.slots.get(key, -1) for key in trades.keys]
+        for k in [k for k, slot in enumerate(slots) if slot < 0]:
+            key = trades.keys[k]
+            if (slot := self.slots.get(key)) is None:  # key may be allocated by a previous trade of this batch
+                if trades.offsets[k] == TPosOffset.CLS:
+                    raise ValueError(f"Try to close a position not in account: {key}")
+                slot = self.__alloc(key, trades.multipliers[k])
+            slots[k] = slot
+        slots = np.array(slots, dtype=np.int64)
+        realized_pnl, cost, err_k = apply_trades_to_book(
+            self.data, slots,
+            offsets=trades.offsets,
+            qtys=trades.qtys,
+            exe_prices=trades.exe_prices,
+            multipliers=trades.multipliers,
+            cost_rate=cost_rate,
+        )
+        if err_k >= 0:
+            raise ValueError(f"trade qty {trades.qtys[err_k]} > pos qty {self.data[slots[err_k]]['qty']}")
+        return realized_pnl, cost
+
+    def mark_to_market(self, keys: list[CPosKey], last_prices: np.ndarray | list[float]) -> float:
+        """
+
+        :param keys: positions to be updated
+        :param last_prices: last price for each position
+        :return: unrealized pnl of these positions
+        """
+        slots = np.array([self.slots[key] for key in keys], dtype=np.int64)
+        return mark_book_to_market(self.data, slots, np.asarray(last_prices, dtype=np.float64))
+
+    def remove_empty(self) -> list[CPosKey]:
+        qtys = self.data["qty"][np.fromiter(self.slots.values(), dtype=np.int64, count=len(self.slots))]
+        rm_keys = [key for key, is_empty in zip(self.slots, (qtys <= 0).tolist()) if is_empty]
+        for key in rm_keys:
+            del self[key]
+        return rm_keys
+
+
+def print_positions(positions: TPositions | CPositionBook, color: bool = True):
     for key, pos in positions.items():
         if color:
             print(f"| {SFY(key)} : {SFG(pos)} |")
@@ -152,6 +570,25 @@ class CMgrMajContractBase:
     def get_contract(self, trade_date: str, instrument: str) -> str:
         raise NotImplementedError
 
+    def get_contracts(self, trade_date: str, instruments: list[str]) -> list[str]:
+        return [self.get_contract(trade_date, instrument) for instrument in instruments]
+
+    def get_contracts_matrix(self, trade_dates: list[str], instruments: list[str]) -> np.ndarray:
+        """
+
+        :param trade_dates: size = T
+        :param instruments: size = N
+        :return: an object array with shape = (T, N), "" if major contract is not found
+        """
+        res = np.full((len(trade_dates), len(instruments)), "", dtype=object)
+        for t, trade_date in enumerate(trade_dates):
+            for i, instrument in enumerate(instruments):
+                try:
+                    res[t, i] = self.get_contract(trade_date, instrument)
+                except KeyError:
+                    pass
+        return res
+
 
 """
 ------ manger market data ------ 
@@ -162,6 +599,36 @@ class CMgrMktDataBase:
     def get_md(self, trade_date: str, contract: str, md: str) -> int | float:
         raise NotImplementedError
 
+    def get_md_many(self, trade_date: str, contracts: list[str], md: str) -> np.ndarray:
+        """
+
+        :param trade_date:
+        :param contracts:
+        :param md:
+        :return: a float array with the same size as contracts, np.nan for missing data
+        """
+        res = np.full(len(contracts), np.nan)
+        for i, contract in enumerate(contracts):
+            try:
+                res[i] = self.get_md(trade_date, contract, md)
+            except KeyError:
+                pass
+        return res
+
+    def get_md_matrix(self, trade_dates: list[str], contracts: np.ndarray, md: str) -> np.ndarray:
+        """
+
+        :param trade_dates: size = T
+        :param contracts: an object array with shape = (T, N), "" for no contract
+        :param md:
+        :return: a float array with shape = (T, N), np.nan for missing data
+        """
+        res = np.full(contracts.shape, np.nan)
+        for t, trade_date in enumerate(trade_dates):
+            if (idx := np.flatnonzero(contracts[t] != "")).size > 0:
+                res[t, idx] = self.get_md_many(trade_date, contracts[t, idx].tolist(), md)
+        return res
+
 
 """
 ------ signal reader ------
@@ -188,7 +655,7 @@ class CAccount:
         self.cost_rate = cost_rate
         self.tot_realized_pnl: float = 0
         self.tot_unrealized_pnl: float = 0
-        self.positions: TPositions = {}
+        self.positions: CPositionBook = CPositionBook()
         self.snapshots: list[dict] = []
         self.last_nav: float = init_cash
 
@@ -233,6 +700,101 @@ class CAccount:
         return pd.DataFrame(self.snapshots)
 
 
+"""
+------ ledger ------
+"""
+
+TLedgerFormat = Literal["sqlite", "parquet"]
+SQL_TO_PD_DTYPE = {"TEXT": object, "INTEGER": np.int64, "REAL": np.float64}
+
+
+class CLedgerWriter:
+    """
+    Rows are kept in a bounded buffer, and written to disk in bulk when the buffer is full,
+    so the history of a long simulation is never kept in memory.
+    """
+
+    def __init__(self, db_struct: CDbStruct, buffer_size: int):
+        """
+
+        :param db_struct: columns and dtypes of ledger
+        :param buffer_size: max number of rows in buffer
+        """
+        self.db_struct = db_struct
+        self.buffer_size = buffer_size
+        self.buffer: list[tuple] = []
+
+    def write(self, data: pd.DataFrame):
+        raise NotImplementedError
+
+    def append(self, rows: list[tuple]):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return 0
+
+    def flush(self):
+        if self.buffer:
+            sql_vars = self.db_struct.table.vars.primary_keys + self.db_struct.table.vars.value_columns
+            data = pd.DataFrame(self.buffer, columns=[v.name for v in sql_vars])
+            self.write(data.astype({v.name: SQL_TO_PD_DTYPE[v.dtype] for v in sql_vars}))
+            self.buffer.clear()
+        return 0
+
+    def close(self):
+        return self.flush()
+
+
+class CLedgerSqlite(CLedgerWriter):
+    def __init__(self, db_struct: CDbStruct, buffer_size: int, mode: str):
+        """
+
+        :param db_struct:
+        :param buffer_size:
+        :param mode: "w" to remove old table, "a" to append
+        """
+        super().__init__(db_struct, buffer_size)
+        self.sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode=mode,
+        )
+
+    def write(self, data: pd.DataFrame):
+        self.sqldb.update(update_data=data)
+        return 0
+
+
+class CLedgerParquet(CLedgerWriter):
+    """
+    Each flush is written as a row group of a parquet file. pyarrow is required, and
+    imported only when this class is used.
+    """
+
+    def __init__(self, db_struct: CDbStruct, buffer_size: int, path: str):
+        super().__init__(db_struct, buffer_size)
+        self.path = path
+        self.writer = None
+
+    def write(self, data: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        return 0
+
+    def close(self):
+        super().close()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return 0
+
+
 """
 ------ simulation ------
 """
@@ -241,8 +803,10 @@ class CAccount:
 class CSimulation:
     """
     This class provides a complex method to test signals using market data.
-    0.  this class DOES NOT support increment test. In other words, user CAN NOT use this class to do
-        daily increment to get a quick result.
+    0.  increment test is supported by main. After each run, account state and positions are
+        checkpointed to companion tables in the same db as the nav table, in the same transaction as navs,
+        and the next call of main resumes from the date next to the last saved date, so daily updates
+        only simulate new dates. If navs are saved without a matching checkpoint, they are rebuilt by a full run.
     1.  the results may be a slightly WORSE than the results in husfort.qsimquick because of:
         1.1 major contract shifting is considered.
         1.2 a specific quantity instead of a precise weight number is used.
@@ -252,6 +816,18 @@ class CSimulation:
         2.1 EITHER import CMgrMajContract, CMgrMktData, CSignal from husfort.qsimulation
         2.2 OR Write their own version of these 3 classes by inheriting from CMgrMajContractBase, CMgrMktDataBase, CSignalBase
             and realize corresponding virtual methods.
+    3.  set date_type = TDateType.INT to save trade_date as INTEGER(YYYYMMDD) in the nav table.
+    4.  set ledger = "sqlite" or "parquet" to stream trades and end-of-day positions of each day
+        to ledger tables by main, with bounded buffers of ledger_buffer rows.
+        4.1 "sqlite": tables "trades" and "positions" in the same db as the nav table.
+        4.2 "parquet": files {sim_id}-ledger/trades-{bgn_date}.parquet and positions-{bgn_date}.parquet,
+            one file for each run, read them by pd.read_parquet with the directory. pyarrow is required.
+        Ledgers are rewritten by a full run and appended by an increment run.
+    5.  when the major contract of an instrument changes, the old position is closed and the new one
+        is opened by trades of the day, so costs of major contract rolls are charged in this_day_cost.
+        They are also reported separately in self.rolls after each run, see cal_rolls, and saved by main
+        in table "rolls", see gen_rolls_db. CRollCalendar could be used as mgr_maj_contract to
+        precompute major contracts and their roll dates.
 
     """
 
@@ -264,8 +840,19 @@ class CSimulation:
             mgr_instru: CInstruMgr,
             mgr_maj_contract: CMgrMajContractBase,
             mgr_mkt_data: CMgrMktDataBase,
-            sim_save_dir: str
+            sim_save_dir: str,
+            date_type: TDateType = TDateType.STR,
+            sim_id: str = None,
+            ledger: TLedgerFormat | None = None,
+            ledger_buffer: int = 100_000,
     ):
+        """
+
+        :param sim_id: id used to save results, by default signal.sid. Use different ids for simulations
+                       with the same signal but different parameters.
+        :param ledger: None, "sqlite" or "parquet"
+        :param ledger_buffer: max number of rows kept in memory for each ledger
+        """
         self.signal: CSignalBase = signal
         self.account: CAccount = CAccount(init_cash, cost_rate)
         self.exe_price_type: TExePriceType = exe_price_type
@@ -273,18 +860,172 @@ class CSimulation:
         self.mgr_maj_contract: CMgrMajContractBase = mgr_maj_contract
         self.mgr_mkt_data: CMgrMktDataBase = mgr_mkt_data
         self.sim_save_dir = sim_save_dir
+        self.date_type = date_type
+        self.sim_id = sim_id or signal.sid
+        self.ledger = ledger
+        self.ledger_buffer = ledger_buffer
+        self.ledgers: dict[str, CLedgerWriter] = {}
+        self.rolls: pd.DataFrame | None = None
+        self.contract_instruments: dict[str, str] = {}
+
+    def save_nav(self, nav_data: pd.DataFrame, calendar: CCalendar, rebuild: bool = False):
+        """
+        navs are appended to the nav table, and the checkpoint of account is rewritten, in one transaction,
+        so the checkpoint always matches the last date of the nav table.
 
-    def save_nav(self, nav_data: pd.DataFrame, calendar: CCalendar):
+        :param nav_data:
+        :param calendar:
+        :param rebuild: if True, old navs are removed instead of checking continuity
+        :return: result of check_continuity, 0 if saved
+        """
         check_and_makedirs(self.sim_save_dir)
-        db_struct = gen_nav_db(self.sim_save_dir, save_id=self.signal.sid)
-        sqldb = CMgrSqlDb(
+        db_struct = gen_nav_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        if self.date_type != TDateType.STR:
+            nav_data = nav_data.assign(trade_date=CCalendar.convert_dates_to_int(nav_data["trade_date"]))
+        if not rebuild:
+            sqldb = CMgrSqlDb(
+                db_save_dir=db_struct.db_save_dir,
+                db_name=db_struct.db_name,
+                table=db_struct.table,
+                mode="a",
+            )
+            if (res := sqldb.check_continuity(incoming_date=nav_data["trade_date"].iloc[0], calendar=calendar)) != 0:
+                return res
+        update_in_transaction(
             db_save_dir=db_struct.db_save_dir,
             db_name=db_struct.db_name,
-            table=db_struct.table,
-            mode="a",
+            updates=[(db_struct.table, nav_data, rebuild)] + [
+                (ckpt_struct.table, ckpt_data, True)
+                for ckpt_struct, ckpt_data in self.gen_checkpoint(trade_date=nav_data["trade_date"].iloc[-1])
+            ],
         )
-        if sqldb.check_continuity(incoming_date=nav_data["trade_date"].iloc[0], calendar=calendar) == 0:
-            sqldb.update(update_data=nav_data)
+        return 0
+
+    def gen_checkpoint(self, trade_date: str | int) -> list[tuple[CDbStruct, pd.DataFrame]]:
+        """
+
+        :param trade_date: last date of account state
+        :return: data of checkpoint tables, account state and positions
+        """
+        ckpt_date = int(trade_date) if self.date_type != TDateType.STR else trade_date
+        acc_struct = gen_ckpt_account_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        pos_struct = gen_ckpt_positions_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        acc_data = pd.DataFrame([{
+            "trade_date": ckpt_date,
+            "init_cash": self.account.init_cash,
+            "tot_realized_pnl": self.account.tot_realized_pnl,
+            "tot_unrealized_pnl": self.account.tot_unrealized_pnl,
+            "last_nav": self.account.last_nav,
+        }])
+        pos_data = pd.DataFrame([{
+            "trade_date": ckpt_date,
+            "contract": key.contract,
+            "direction": int(key.direction),
+            "qty": pos.qty,
+            "multiplier": pos.multiplier,
+            "cost_price": pos.cost_price,
+            "last_price": pos.last_price,
+        } for key, pos in self.account.positions.items() if pos.qty > 0], columns=pos_struct.table.vars.names)
+        return [(acc_struct, acc_data), (pos_struct, pos_data)]
+
+    def get_last_saved_date(self) -> str | None:
+        """
+
+        :return: last date of the nav table, None if there is no nav
+        """
+        nav_struct = gen_nav_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        if not os.path.exists(os.path.join(nav_struct.db_save_dir, nav_struct.db_name)):
+            return None
+        nav_db = CMgrSqlDb(nav_struct.db_save_dir, nav_struct.db_name, nav_struct.table, mode="r")
+        if not nav_db.has_table(nav_struct.table):
+            return None
+        last_date = nav_db.last_val("trade_date", val_if_none=None)
+        return None if last_date is None else str(last_date)
+
+    def load_checkpoint(self) -> str | None:
+        """
+        restore account state and positions from checkpoint, only if the checkpoint
+        matches the last date of the nav table.
+
+        :return: date of checkpoint, None if there is no valid checkpoint
+        """
+        if (last_date := self.get_last_saved_date()) is None:
+            return None
+        acc_struct = gen_ckpt_account_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        pos_struct = gen_ckpt_positions_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        acc_db, pos_db = [
+            CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="r")
+            for db_struct in (acc_struct, pos_struct)
+        ]
+        if not (acc_db.has_table(acc_struct.table) and pos_db.has_table(pos_struct.table)):
+            return None
+        acc_data = acc_db.read()
+        if acc_data.empty or str(acc_data["trade_date"].iloc[-1]) != last_date:
+            return None
+        acc = acc_data.iloc[-1]
+        if acc["init_cash"] != self.account.init_cash:
+            raise ValueError(
+                f"init_cash = {self.account.init_cash} is different from init_cash = {acc['init_cash']} "
+                f"in checkpoint of {self.sim_id}"
+            )
+        self.account.tot_realized_pnl = acc["tot_realized_pnl"]
+        self.account.tot_unrealized_pnl = acc["tot_unrealized_pnl"]
+        self.account.last_nav = acc["last_nav"]
+        self.account.positions.clear()
+        for pos in pos_db.read().itertuples(index=False):
+            key = CPosKey(pos.contract, direction=TPosDirection(pos.direction))
+            self.account.positions[key] = CPosition(
+                key=key, qty=int(pos.qty), multiplier=pos.multiplier,
+                cost_price=pos.cost_price, last_price=pos.last_price,
+            )
+        return last_date
+
+    def open_ledgers(self, resume: bool, part_id: str):
+        """
+
+        :param resume: if True, append to ledgers, else remove old ledgers
+        :param part_id: id of parquet files of this run
+        :return:
+        """
+        if self.ledger is None:
+            return 0
+        check_and_makedirs(self.sim_save_dir)
+        for name, gen_db in (("trades", gen_ledger_trades_db), ("positions", gen_ledger_positions_db)):
+            db_struct = gen_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+            if self.ledger == "sqlite":
+                self.ledgers[name] = CLedgerSqlite(db_struct, self.ledger_buffer, mode="a" if resume else "w")
+            elif self.ledger == "parquet":
+                ledger_dir = os.path.join(self.sim_save_dir, f"{self.sim_id}-ledger")
+                check_and_makedirs(ledger_dir)
+                if not resume:
+                    for file in os.listdir(ledger_dir):
+                        if file.startswith(f"{name}-") and file.endswith(".parquet"):
+                            os.remove(os.path.join(ledger_dir, file))
+                path = os.path.join(ledger_dir, f"{name}-{part_id}.parquet")
+                self.ledgers[name] = CLedgerParquet(db_struct, self.ledger_buffer, path=path)
+            else:
+                raise ValueError(f"Invalid ledger = {self.ledger}")
+        return 0
+
+    def close_ledgers(self):
+        for ledger in self.ledgers.values():
+            ledger.close()
+        self.ledgers.clear()
+        return 0
+
+    def write_ledgers(self, trade_date: str, trades: CTrades):
+        date = int(trade_date) if self.date_type != TDateType.STR else trade_date
+        self.ledgers["trades"].append([
+            (date, seq, key.contract, int(key.direction), offset, qty, multiplier, exe_price, cost)
+            for seq, (key, offset, qty, multiplier, exe_price, cost) in enumerate(zip(
+                trades.keys, trades.offsets.tolist(), trades.qtys.tolist(), trades.multipliers.tolist(),
+                trades.exe_prices.tolist(), trades.costs(self.account.cost_rate).tolist(),
+            ))
+        ])
+        self.ledgers["positions"].append([
+            (date, k.contract, int(k.direction), p.qty, p.multiplier, p.cost_price, p.last_price)
+            for k, p in self.account.positions.items()
+        ])
         return 0
 
     @staticmethod
@@ -294,12 +1035,19 @@ class CSimulation:
         sig_dates, exe_dates = iter_dates[0:-1], iter_dates[1:]
         return sig_dates, exe_dates
 
-    def covert_sig_to_target_pos(self, sig_date: str) -> TPositions:
+    def covert_sig_to_target_pos(self, sig_date: str, maj_date: str = None) -> TPositions:
+        """
+
+        :param sig_date: date to get signal and market data
+        :param maj_date: date to get major contract, sig_date if None
+        :return:
+        """
         sigs = self.signal.get_signal(sig_date)
         target_pos: TPositions = {}
         for instru, weight in sigs.items():
             multiplier = self.mgr_instru.get_multiplier(instru)
-            contract = self.mgr_maj_contract.get_contract(sig_date, instru)
+            contract = self.mgr_maj_contract.get_contract(maj_date or sig_date, instru)
+            self.contract_instruments[contract] = instru
             sig_price = self.mgr_mkt_data.get_md(sig_date, contract, md="close")  # use 'close' to estimate qty
             qty = int(np.round(self.account.last_nav * abs(weight) / multiplier / sig_price))
             key = CPosKey(contract, direction=TPosDirection.LNG if weight > 0 else TPosDirection.SRT)
@@ -309,45 +1057,75 @@ class CSimulation:
             )
         return target_pos
 
-    def cal_trades(self, target_pos: TPositions, trade_date: str) -> list[CTrade]:
-        trades: list[CTrade] = []
+    def cal_trades(self, target_pos: TPositions, trade_date: str) -> CTrades:
+        keys: list[CPosKey] = []
+        offsets, qtys, multipliers, exe_prices = [], [], [], []
+
+        def add_trade(key: CPosKey, offset: TPosOffset, qty: int, multiplier: int | float, exe_price: float):
+            if qty > 0:
+                keys.append(key)
+                offsets.append(offset)
+                qtys.append(qty)
+                multipliers.append(multiplier)
+                exe_prices.append(exe_price)
+            return 0
+
         for pos_key, tgt_pos in target_pos.items():
             exe_price = self.mgr_mkt_data.get_md(trade_date, pos_key.contract, md=self.exe_price_type)
-            act_pos = self.account.positions.get(pos_key, None)
-            if act_pos is None:
-                trade = tgt_pos.convert_as_trade(exe_price=exe_price, operation=TPosOffset.OPN)
+            if (act_pos := self.account.positions.get(pos_key, None)) is None:
+                add_trade(pos_key, TPosOffset.OPN, tgt_pos.qty, tgt_pos.multiplier, exe_price)
             else:
-                trade = act_pos.cal_trade_from_target(target=tgt_pos, exe_price=exe_price)
-            trades.append(trade) if trade.qty > 0 else None
+                act_qty = act_pos.qty
+                offset = TPosOffset.OPN if act_qty <= tgt_pos.qty else TPosOffset.CLS
+                add_trade(pos_key, offset, abs(tgt_pos.qty - act_qty), act_pos.multiplier, exe_price)
 
         for pos_key, act_pos in self.account.positions.items():
             if pos_key not in target_pos:
                 exe_price = self.mgr_mkt_data.get_md(trade_date, pos_key.contract, md=self.exe_price_type)
-                trade = act_pos.convert_as_trade(exe_price, operation=TPosOffset.CLS)
-                trades.append(trade) if trade.qty > 0 else None
-        return trades
+                add_trade(pos_key, TPosOffset.CLS, act_pos.qty, act_pos.multiplier, exe_price)
+        return CTrades(
+            keys=keys,
+            offsets=np.array(offsets, dtype=np.int64),
+            qtys=np.array(qtys, dtype=np.int64),
+            multipliers=np.array(multipliers, dtype=np.float64),
+            exe_prices=np.array(exe_prices, dtype=np.float64),
+        )
 
-    def update_from_trades(self, trades: list[CTrade]) -> tuple[float, float]:
+    def cal_rolls(self, target_pos: TPositions, trades: CTrades, trade_date: str) -> list[tuple]:
+        """
+        A roll is counted when the position of an instrument is closed, and a new position of the same
+        instrument and direction but another contract is opened on the same day,
+        roll_qty = min(old qty, new qty). Call it before trades are applied to account.
+
+        :param target_pos:
+        :param trades:
+        :param trade_date:
+        :return: rows of rolls table
+        """
+        closed, opened = {}, {}
+        for k, (key, offset) in enumerate(zip(trades.keys, trades.offsets.tolist())):
+            if (instrument := self.contract_instruments.get(key.contract)) is None:
+                continue
+            if offset == TPosOffset.CLS and key not in target_pos:
+                closed[(instrument, key.direction)] = k
+            elif offset == TPosOffset.OPN and key not in self.account.positions:
+                opened[(instrument, key.direction)] = k
+        rows = []
+        for (instrument, direction), k0 in closed.items():
+            if (k1 := opened.get((instrument, direction))) is not None:
+                qty = int(min(trades.qtys[k0], trades.qtys[k1]))
+                exe_prices = trades.exe_prices[k0] + trades.exe_prices[k1]
+                roll_cost = exe_prices * trades.multipliers[k1] * qty * self.account.cost_rate
+                rows.append((trade_date, instrument, trades.keys[k0].contract, trades.keys[k1].contract, qty, roll_cost))
+        return rows
+
+    def update_from_trades(self, trades: CTrades) -> tuple[float, float]:
         """
 
         :param trades:
         :return: realized_pnl, cost
         """
-        realized_pnl, cost = 0.0, 0.0
-        for trade in trades:
-            if trade.key not in self.account.positions:
-                if trade.offset == TPosOffset.CLS:
-                    raise ValueError(f"Try to close a position not in account: {trade.key}")
-                else:  # trade.operation == TPosOperation.OPN
-                    self.account.positions[trade.key] = CPosition(
-                        key=trade.key, qty=0, multiplier=trade.multiplier,
-                        cost_price=0, last_price=0,
-                    )
-            trade_rpnl, trade_cost = self.account.positions[trade.key].update_from_trade(
-                trade, cost_rate=self.account.cost_rate)
-            realized_pnl += trade_rpnl
-            cost += trade_cost
-        return realized_pnl, cost
+        return self.account.positions.apply_trades(trades, cost_rate=self.account.cost_rate)
 
     def update_from_market(self, trade_date: str) -> float:
         """
@@ -356,25 +1134,31 @@ class CSimulation:
         :return: unrealized_pnl
         """
 
-        unrealized_pnl = 0
-        rm_keys: list[CPosKey] = []
-        for pos_key, pos in self.account.positions.items():
-            if pos.qty > 0:
-                contract = pos_key.contract
-                last_price = self.mgr_mkt_data.get_md(trade_date, contract=contract, md="close")
-                pos.update_from_market(last_price=last_price)
-                unrealized_pnl += pos.unrealized_pnl
-            else:
-                rm_keys.append(pos_key)
-        for pos_key in rm_keys:
-            del self.account.positions[pos_key]
-        return unrealized_pnl
+        self.account.positions.remove_empty()
+        pos_keys = list(self.account.positions)
+        last_prices = [self.mgr_mkt_data.get_md(trade_date, contract=k.contract, md="close") for k in pos_keys]
+        return self.account.positions.mark_to_market(pos_keys, last_prices)
 
-    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar, verbose: bool = False):
+    def run(self, bgn_date: str, stp_date: str, calendar: CCalendar, verbose: bool = False) -> pd.DataFrame:
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param verbose:
+        :return: a pd.DataFrame with the same columns as the nav table
+        """
         sig_dates, exe_dates = self.gen_sig_exe_dates(bgn_date, stp_date, calendar)
+        if len(self.account.positions) > 0:
+            # account is restored from checkpoint, find instruments of positions from the previous sig date
+            prev_sig_date = calendar.get_next_date(sig_dates[0], shift=-1)
+            for instru in self.signal.get_signal(prev_sig_date):
+                self.contract_instruments[self.mgr_maj_contract.get_contract(prev_sig_date, instru)] = instru
+        rolls: list[tuple] = []
         for sig_date, exe_date in zip(sig_dates, exe_dates):
             target_pos = self.covert_sig_to_target_pos(sig_date=sig_date)
             trades = self.cal_trades(target_pos, trade_date=exe_date)
+            rolls.extend(self.cal_rolls(target_pos, trades, trade_date=exe_date))
             this_day_realized_pnl, this_day_cost = self.update_from_trades(trades=trades)
             this_day_unrealized_pnl = self.update_from_market(trade_date=exe_date)
             self.account.update_pnl(
@@ -384,14 +1168,686 @@ class CSimulation:
             )
             self.account.take_snapshot(exe_date, this_day_realized_pnl, this_day_cost)
             self.account.update_last_nav()
+            if self.ledgers:
+                self.write_ledgers(exe_date, trades)
             if verbose:
                 print(f"----------{exe_date}----------")
                 print_positions(self.account.positions)
+        self.rolls = pd.DataFrame(
+            rolls, columns=["trade_date", "instrument", "old_contract", "new_contract", "qty", "roll_cost"],
+        )
+        return self.account.export_snapshots()
+
+    def main(self, bgn_date: str, stp_date: str, calendar: CCalendar, verbose: bool = False, resume: bool = True):
+        """
+
+        :param bgn_date: used when there is no valid checkpoint or resume is False, otherwise
+                         simulation resumes from the date next to the last saved date.
+        :param stp_date:
+        :param calendar:
+        :param verbose:
+        :param resume: if False, checkpoint is ignored, and old results are replaced by a full run from bgn_date.
+                       This is the only case that old navs are removed. If True but navs are saved without
+                       a matching checkpoint(like navs saved by an old version), simulation runs from bgn_date
+                       with init_cash, and navs are appended only if bgn_date is next to the last saved date.
+        :return:
+        """
+        ckpt_date = self.load_checkpoint() if resume else None
+        last_date = None
+        if ckpt_date is not None:
+            resume_date = calendar.get_next_date(ckpt_date, shift=1)
+            if resume_date >= stp_date:
+                logger.info(f"Nav of {SFG(self.sim_id)} is up to date @ {SFG(ckpt_date)}")
+                return 0
+            if bgn_date != resume_date:
+                logger.warning(
+                    f"bgn_date = {SFY(bgn_date)} is ignored, simulation of {SFY(self.sim_id)} resumes "
+                    f"from {SFY(resume_date)}, set resume = False to rerun from bgn_date."
+                )
+            else:
+                logger.info(f"Simulation of {SFG(self.sim_id)} resumes from {SFG(resume_date)}")
+            bgn_date = resume_date
+        elif resume and (last_date := self.get_last_saved_date()) is not None:
+            # navs saved without a valid checkpoint, like navs saved by an old version
+            if bgn_date != calendar.get_next_date(last_date, shift=1):
+                logger.warning(
+                    f"Navs of {SFY(self.sim_id)} till {SFY(last_date)} are saved without a matching checkpoint, "
+                    f"and bgn_date = {SFY(bgn_date)} is not the next date, nothing is saved. "
+                    f"Set resume = False to replace them by a full run from bgn_date."
+                )
+                return 0
+            logger.warning(
+                f"Navs of {SFY(self.sim_id)} till {SFY(last_date)} are saved without a matching checkpoint, "
+                f"simulation runs from {SFY(bgn_date)} with init_cash, and new navs are appended."
+            )
+        rebuild = not resume
+        self.open_ledgers(resume=ckpt_date is not None or last_date is not None, part_id=bgn_date)
+        try:
+            snapshots = self.run(bgn_date, stp_date, calendar, verbose)
+        finally:
+            self.close_ledgers()
+        if self.save_nav(snapshots, calendar, rebuild=rebuild) == 0:
+            self.on_nav_saved(snapshots, rebuild=rebuild)
+        return 0
+
+    def save_rolls(self, rebuild: bool = False):
+        """
+
+        :param rebuild: if True, old rolls are removed
+        :return:
+        """
+        if self.rolls is None or (self.rolls.empty and not rebuild):
+            return 0
+        db_struct = gen_rolls_db(self.sim_save_dir, save_id=self.sim_id, date_type=self.date_type)
+        rolls = self.rolls
+        if self.date_type != TDateType.STR:
+            rolls = rolls.assign(trade_date=CCalendar.convert_dates_to_int(rolls["trade_date"]))
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="w" if rebuild else "a",
+        )
+        sqldb.update(update_data=rolls)
+        return 0
+
+    def on_nav_saved(self, snapshots: pd.DataFrame, rebuild: bool):
+        """
+        called by main after navs and checkpoint are saved successfully, to save other results of this run
+
+        :param snapshots:
+        :param rebuild: whether old results are replaced
+        """
+        self.save_rolls(rebuild)
+        return 0
+
+
+"""
+------ vectorized simulation ------
+"""
+
+
+# price arrays of cal_vec_sim, to report missing market data
+VEC_SIM_PRICES = ("sig_price", "exe_price_new", "exe_price_old", "close_price")
+
+# records of cal_vec_sim for each (t, i), new contract is contract at (t, i), old contract is contract at (t-1, i)
+VEC_SIM_RECORDS = (
+    "trd_qty",  # quantity of trade on new contract with direction pos_dir, > 0 to open, < 0 to close
+    "trd_price",
+    "cls_qty",  # quantity of closing the previous position
+    "cls_price",
+    "cls_dir",
+    "cls_old",  # 1 if the previous position is of old contract, else new contract
+    "pos_qty",  # end-of-day position of new contract
+    "pos_dir",  # direction of new contract, for both trade and position
+    "pos_cost_price",
+)
+
+
+@njit(cache=True)
+def cal_vec_sim(
+        weights: np.ndarray, in_sig: np.ndarray, same_contract: np.ndarray,
+        sig_price: np.ndarray, exe_price_new: np.ndarray, exe_price_old: np.ndarray, close_price: np.ndarray,
+        multipliers: np.ndarray, init_cash: float, cost_rate: float, last_nav: float, tot_realized_pnl: float,
+        qty: np.ndarray, direction: np.ndarray, cost_price: np.ndarray,
+        roll_qty: np.ndarray, roll_cost: np.ndarray, records: np.ndarray,
+) -> tuple[np.ndarray, int, int, int]:
+    """
+    All arrays with 2 dimensions have shape = (T, N), T = number of exe dates, N = number of instruments.
+    On each exe date, there is at most 1 position for each instrument, and it always holds the contract
+    of the target position of the previous day, i.e., contract at (t-1, i).
+
+    :param weights: signal weights
+    :param in_sig: whether the instrument is in the signal
+    :param same_contract: whether contract at (t, i) is the same as the contract at (t-1, i)
+    :param sig_price: close price of contract at (t, i) on sig date, to estimate quantity
+    :param exe_price_new: execution price of contract at (t, i) on exe date
+    :param exe_price_old: execution price of contract at (t-1, i) on exe date, to close old positions
+    :param close_price: close price of contract at (t, i) on exe date
+    :param multipliers: size = N
+    :param init_cash:
+    :param cost_rate:
+    :param last_nav: nav before the first exe date
+    :param tot_realized_pnl: tot_realized_pnl before the first exe date
+    :param qty: size = N, positions before the first exe date, updated in place
+    :param direction: size = N, 1 or -1, updated in place
+    :param cost_price: size = N, updated in place
+    :param roll_qty: shape = (T, N), quantity rolled from contract at (t-1, i) to contract at (t, i), filled in place
+    :param roll_cost: shape = (T, N), cost of closing and opening roll_qty, included in this_day_cost, filled in place
+    :param records: shape = (T, N, len(VEC_SIM_RECORDS)), trades and end-of-day positions for ledgers,
+                    filled in place, see VEC_SIM_RECORDS. Use shape = (0, 0, len(VEC_SIM_RECORDS)) to skip them.
+    :return: an array with shape = (T, 5), columns are
+             [this_day_realized_pnl, this_day_cost, tot_realized_pnl, tot_unrealized_pnl, last_nav],
+             and (t, i, k) of the first missing price, k is the index of the price array in VEC_SIM_PRICES,
+             (-1, -1, -1) if all prices used are available. Calculation stops at the first missing price.
+    """
+    t_size, n_size = weights.shape
+    res = np.zeros((t_size, 5))
+    keep = records.shape[0] > 0
+    for t in range(t_size):
+        realized_pnl, cost = 0.0, 0.0
+        for i in range(n_size):
+            mul = multipliers[i]
+            if in_sig[t, i]:
+                if np.isnan(sig_price[t, i]):
+                    return res, t, i, 0
+                if np.isnan(exe_price_new[t, i]):
+                    return res, t, i, 1
+                w = weights[t, i]
+                tgt_qty = int(np.round(last_nav * abs(w) / mul / sig_price[t, i]))
+                tgt_dir = 1 if w > 0 else -1
+                if qty[i] > 0 and same_contract[t, i] and direction[i] == tgt_dir:
+                    p = exe_price_new[t, i]
+                    if tgt_qty >= qty[i]:
+                        d_qty = tgt_qty - qty[i]
+                        cost_price[i] = (cost_price[i] * qty[i] + p * d_qty) / tgt_qty
+                    else:
+                        d_qty = qty[i] - tgt_qty
+                        realized_pnl += (p - cost_price[i]) * mul * d_qty * direction[i]
+                    cost += p * mul * d_qty * cost_rate
+                    if keep:
+                        records[t, i, 0], records[t, i, 1], records[t, i, 7] = tgt_qty - qty[i], p, direction[i]
+                    qty[i] = tgt_qty
+                else:
+                    if qty[i] > 0:
+                        p = exe_price_new[t, i] if same_contract[t, i] else exe_price_old[t, i]
+                        if np.isnan(p):
+                            return res, t, i, 2
+                        realized_pnl += (p - cost_price[i]) * mul * qty[i] * direction[i]
+                        cost += p * mul * qty[i] * cost_rate
+                        if keep:
+                            records[t, i, 2], records[t, i, 3], records[t, i, 4] = qty[i], p, direction[i]
+                            records[t, i, 5] = 0 if same_contract[t, i] else 1
+                        if (not same_contract[t, i]) and direction[i] == tgt_dir:
+                            # major contract rolls, position is held with the same direction
+                            roll_qty[t, i] = min(qty[i], tgt_qty)
+                            roll_cost[t, i] = (p + exe_price_new[t, i]) * mul * roll_qty[t, i] * cost_rate
+                    if tgt_qty > 0:
+                        p = exe_price_new[t, i]
+                        cost += p * mul * tgt_qty * cost_rate
+                        cost_price[i] = p
+                        if keep:
+                            records[t, i, 0], records[t, i, 1], records[t, i, 7] = tgt_qty, p, tgt_dir
+                    qty[i] = tgt_qty
+                    direction[i] = tgt_dir
+            elif qty[i] > 0:
+                p = exe_price_old[t, i]
+                if np.isnan(p):
+                    return res, t, i, 2
+                realized_pnl += (p - cost_price[i]) * mul * qty[i] * direction[i]
+                cost += p * mul * qty[i] * cost_rate
+                if keep:
+                    records[t, i, 2], records[t, i, 3], records[t, i, 4], records[t, i, 5] = qty[i], p, direction[i], 1
+                qty[i] = 0
+
+        unrealized_pnl = 0.0
+        for i in range(n_size):
+            if qty[i] > 0:
+                if np.isnan(close_price[t, i]):
+                    return res, t, i, 3
+                unrealized_pnl += (close_price[t, i] - cost_price[i]) * multipliers[i] * qty[i] * direction[i]
+                if keep:
+                    records[t, i, 6], records[t, i, 7], records[t, i, 8] = qty[i], direction[i], cost_price[i]
+        tot_realized_pnl += realized_pnl - cost
+        res[t, 0] = realized_pnl
+        res[t, 1] = cost
+        res[t, 2] = tot_realized_pnl
+        res[t, 3] = unrealized_pnl
+        res[t, 4] = last_nav
+        last_nav = init_cash + tot_realized_pnl + unrealized_pnl
+    return res, -1, -1, -1
+
+
+class CSimulationVec(CSimulation):
+    """
+    A vectorized version of CSimulation, with the same arguments and the same nav table.
+    0.  signals, major contracts and market data are preloaded into aligned (date x instrument)
+        numpy arrays once, then all trades, costs and pnl are calculated by a numba-compiled kernel.
+    1.  results are the same as CSimulation, except the tiny differences from the order of
+        float summation. Like CSimulation, KeyError is raised if market data used by a trade or
+        a position is missing, or is np.nan.
+    2.  verbose mode is not supported, positions are not printed.
+    3.  ledgers are rebuilt from the records of the kernel, with the same rows as CSimulation,
+        except the order of trades(seq) in a day.
+    4.  costs of major contract rolls are charged and reported in the same way as CSimulation.
+    """
+
+    def preload(self, sig_dates: list[str], exe_dates: list[str]) -> tuple[list[str], dict[str, np.ndarray]]:
+        signals = pd.DataFrame([self.signal.get_signal(sig_date) for sig_date in sig_dates])
+        universe = sorted(signals.columns)
+        signals = signals.reindex(columns=universe)
+        t_size, n_size = len(sig_dates), len(universe)
+        weights, in_sig = signals.fillna(0).to_numpy(dtype=np.float64), signals.notna().to_numpy()
+        contracts = self.mgr_maj_contract.get_contracts_matrix(sig_dates, universe)
+        contracts[~in_sig] = ""
+        if (missing := np.argwhere(in_sig & (contracts == ""))).size > 0:
+            t, i = missing[0]
+            raise KeyError(f"Major contract of {universe[i]} @ {sig_dates[t]} is not found")
+
+        # contracts of the previous day to be closed, if major contract changes or instrument leaves signal
+        old_contracts = np.full((t_size, n_size), "", dtype=object)
+        old_contracts[1:] = np.where(contracts[:-1] != contracts[1:], contracts[:-1], "")
+        sig_price = self.mgr_mkt_data.get_md_matrix(sig_dates, contracts, md="close")
+        exe_price_new = self.mgr_mkt_data.get_md_matrix(exe_dates, contracts, md=self.exe_price_type)
+        exe_price_old = self.mgr_mkt_data.get_md_matrix(exe_dates, old_contracts, md=self.exe_price_type)
+        close_price = self.mgr_mkt_data.get_md_matrix(exe_dates, contracts, md="close")
+        same_contract = np.zeros((t_size, n_size), dtype=np.bool_)
+        same_contract[1:] = in_sig[1:] & in_sig[:-1] & (contracts[1:] == contracts[:-1])
+        arrays = {
+            "weights": weights,
+            "in_sig": in_sig,
+            "same_contract": same_contract,
+            "contracts": contracts,
+            "sig_price": sig_price,
+            "exe_price_new": exe_price_new,
+            "exe_price_old": exe_price_old,
+            "close_price": close_price,
+            "multipliers": self.mgr_instru.multipliers(universe).astype(np.float64),
+        }
+        return universe, arrays
+
+    def write_vec_ledgers(
+            self, exe_dates: list[str], contracts: np.ndarray, multipliers: np.ndarray,
+            close_price: np.ndarray, records: np.ndarray,
+    ):
+        """
+
+        :param exe_dates: size = T
+        :param contracts: shape = (T + 1, N), contracts[t] and contracts[t + 1] are old and new contracts of exe_dates[t]
+        :param multipliers: size = N
+        :param close_price: shape = (T, N)
+        :param records: shape = (T, N, len(VEC_SIM_RECORDS)), from cal_vec_sim
+        :return:
+        """
+        dates = np.array([int(d) for d in exe_dates] if self.date_type != TDateType.STR else exe_dates, dtype=object)
+        cost_rate = self.account.cost_rate
+        trd_qty, trd_price, cls_qty, cls_price, cls_dir, cls_old, pos_qty, pos_dir, pos_cost_price = [
+            records[:, :, j] for j in range(len(VEC_SIM_RECORDS))
+        ]
+
+        # closing previous positions
+        ct, ci = np.nonzero(cls_qty > 0)
+        cls_contracts = np.where(cls_old[ct, ci] > 0, contracts[ct, ci], contracts[ct + 1, ci])
+        cls_trades = pd.DataFrame({
+            "trade_date": dates[ct],
+            "contract": cls_contracts,
+            "direction": cls_dir[ct, ci].astype(np.int64),
+            "offset": int(TPosOffset.CLS),
+            "qty": cls_qty[ct, ci].astype(np.int64),
+            "multiplier": multipliers[ci],
+            "exe_price": cls_price[ct, ci],
+            "t": ct,
+        })
+
+        # trades of new contracts
+        nt, ni = np.nonzero(trd_qty != 0)
+        new_trades = pd.DataFrame({
+            "trade_date": dates[nt],
+            "contract": contracts[nt + 1, ni],
+            "direction": pos_dir[nt, ni].astype(np.int64),
+            "offset": np.where(trd_qty[nt, ni] > 0, int(TPosOffset.OPN), int(TPosOffset.CLS)),
+            "qty": np.abs(trd_qty[nt, ni]).astype(np.int64),
+            "multiplier": multipliers[ni],
+            "exe_price": trd_price[nt, ni],
+            "t": nt,
+        })
+        trades = pd.concat([cls_trades, new_trades], ignore_index=True).sort_values("t", kind="stable")
+        trades["cost"] = trades["exe_price"] * trades["multiplier"] * trades["qty"] * cost_rate
+        trades.insert(1, "seq", trades.groupby("t").cumcount())
+        self.ledgers["trades"].append(list(trades.drop(columns="t").itertuples(index=False, name=None)))
+
+        pt, pi = np.nonzero(pos_qty > 0)
+        positions = pd.DataFrame({
+            "trade_date": dates[pt],
+            "contract": contracts[pt + 1, pi],
+            "direction": pos_dir[pt, pi].astype(np.int64),
+            "qty": pos_qty[pt, pi].astype(np.int64),
+            "multiplier": multipliers[pi],
+            "cost_price": pos_cost_price[pt, pi],
+            "last_price": close_price[pt, pi],
+        })
+        self.ledgers["positions"].append(list(positions.itertuples(index=False, name=None)))
+        return 0
+
+    def run(self, bgn_date: str, stp_date: str, calendar: CCalendar, verbose: bool = False) -> pd.DataFrame:
+        sig_dates, exe_dates = self.gen_sig_exe_dates(bgn_date, stp_date, calendar)
+
+        # if account is restored from checkpoint, positions are targets of the previous sig date,
+        # so the previous day is preloaded as the first row to locate the instrument of each position.
+        k = 1 if len(self.account.positions) > 0 else 0
+        if k > 0:
+            sig_dates, exe_dates = [calendar.get_next_date(sig_dates[0], shift=-1)] + sig_dates, sig_dates[0:1] + exe_dates
+        universe, arrays = self.preload(sig_dates, exe_dates)
+        n_size = len(universe)
+        qty, direction, cost_price = np.zeros(n_size, dtype=np.int64), np.ones(n_size, dtype=np.int64), np.zeros(n_size)
+        if k > 0:
+            contract_idx = {arrays["contracts"][0, i]: i for i in np.flatnonzero(arrays["in_sig"][0])}
+            for key, pos in self.account.positions.items():
+                if (i := contract_idx.get(key.contract)) is None:
+                    raise ValueError(f"Position of {key.contract} is not found in signal @ {sig_dates[0]}")
+                qty[i], direction[i], cost_price[i] = pos.qty, int(key.direction), pos.cost_price
+        res, err_t, err_i, err_k = cal_vec_sim(
+            weights=arrays["weights"][k:],
+            in_sig=arrays["in_sig"][k:],
+            same_contract=arrays["same_contract"][k:],
+            sig_price=arrays["sig_price"][k:],
+            exe_price_new=arrays["exe_price_new"][k:],
+            exe_price_old=arrays["exe_price_old"][k:],
+            close_price=arrays["close_price"][k:],
+            multipliers=arrays["multipliers"],
+            init_cash=self.account.init_cash,
+            cost_rate=self.account.cost_rate,
+            last_nav=self.account.last_nav,
+            tot_realized_pnl=self.account.tot_realized_pnl,
+            qty=qty, direction=direction, cost_price=cost_price,
+            roll_qty=(roll_qty := np.zeros((len(exe_dates) - k, n_size), dtype=np.int64)),
+            roll_cost=(roll_cost := np.zeros((len(exe_dates) - k, n_size))),
+            records=(records := np.zeros(
+                (len(exe_dates) - k, n_size, len(VEC_SIM_RECORDS)) if self.ledgers else (0, 0, len(VEC_SIM_RECORDS))
+            )),
+        )
+        if err_t >= 0:
+            md_date = sig_dates[err_t + k] if err_k == 0 else exe_dates[err_t + k]
+            contract = arrays["contracts"][err_t + k - (err_k == 2), err_i]
+            raise KeyError(f"{VEC_SIM_PRICES[err_k]} of {contract} @ {md_date} is not found in market data")
+        rt, ri = np.nonzero(roll_qty)
+        self.rolls = pd.DataFrame({
+            "trade_date": np.array(exe_dates[k:], dtype=object)[rt],
+            "instrument": np.array(universe, dtype=object)[ri],
+            "old_contract": arrays["contracts"][rt + k - 1, ri],
+            "new_contract": arrays["contracts"][rt + k, ri],
+            "qty": roll_qty[rt, ri],
+            "roll_cost": roll_cost[rt, ri],
+        })
+        if self.ledgers:
+            self.write_vec_ledgers(
+                exe_dates=exe_dates[k:],
+                contracts=arrays["contracts"] if k > 0 else np.vstack([arrays["contracts"][0:1], arrays["contracts"]]),
+                multipliers=arrays["multipliers"],
+                close_price=arrays["close_price"][k:],
+                records=records,
+            )
+
+        # sync final state to account
+        self.account.tot_realized_pnl, self.account.tot_unrealized_pnl = res[-1, 2], res[-1, 3]
+        self.account.positions.clear()
+        for i in np.flatnonzero(qty > 0):
+            key = CPosKey(arrays["contracts"][-1, i], direction=TPosDirection(direction[i]))
+            self.account.positions[key] = CPosition(
+                key=key, qty=int(qty[i]), multiplier=arrays["multipliers"][i],
+                cost_price=cost_price[i], last_price=arrays["close_price"][-1, i],
+            )
+
+        init_cash = self.account.init_cash
+        tot_realized_pnl, tot_unrealized_pnl, last_nav = res[:, 2], res[:, 3], res[:, 4]
+        nav = init_cash + tot_realized_pnl + tot_unrealized_pnl
+        self.account.last_nav = nav[-1]
+        snapshots = pd.DataFrame({
+            "trade_date": exe_dates[k:],
+            "init_cash": init_cash,
+            "tot_realized_pnl": tot_realized_pnl,
+            "this_day_realized_pnl": res[:, 0],
+            "this_day_cost": res[:, 1],
+            "tot_unrealized_pnl": tot_unrealized_pnl,
+            "last_nav": last_nav,
+            "nav": nav,
+            "navps": nav / init_cash,
+            "ret": nav / last_nav - 1,
+        })
+        return snapshots
+
+
+"""
+------ section simulation ------
+"""
+
+
+class CSimulationSection(CSimulation):
+    """
+    A section-level version of CSimulation, with the same account model. Sections(TS1 for night
+    and TS2 for day) from CCalendarSection are used instead of trade dates, signals generated
+    at the end of a section are executed in the next section.
+    0.  signal.get_signal is called with secId, like "20240102-TS2".
+    1.  major contract of a section is the major contract of its trade date.
+    2.  mgr_mkt_data.get_md is called with secId, see CSectionBarStore.
+    3.  navs are saved by section in table "nav_section", increment test is not supported.
+    """
+
+    def run(
+            self, bgn_sec: CSection, stp_sec: CSection, calendar: CCalendarSection, verbose: bool = False,
+    ) -> pd.DataFrame:
+        """
+
+        :param bgn_sec: first section to execute, signal of its previous section is used
+        :param stp_sec: stop section, not included
+        :param calendar:
+        :param verbose:
+        :return: a pd.DataFrame with the same columns as the nav_section table
+        """
+        if (sig_bgn_sec := calendar.get_next_sec(bgn_sec, shift=-1)) is None:
+            logger.warning(
+                f"{SFY(bgn_sec.secId)} is the first section in calendar, there is no signal before it, "
+                f"simulation begins from the next section."
+            )
+            sig_bgn_sec = bgn_sec
+        iter_secs = calendar.get_iter_list(sig_bgn_sec, stp_sec)
+        for sig_sec, exe_sec in zip(iter_secs[:-1], iter_secs[1:]):
+            target_pos = self.covert_sig_to_target_pos(sig_date=sig_sec.secId, maj_date=sig_sec.trade_date)
+            trades = self.cal_trades(target_pos, trade_date=exe_sec.secId)
+            this_day_realized_pnl, this_day_cost = self.update_from_trades(trades=trades)
+            this_day_unrealized_pnl = self.update_from_market(trade_date=exe_sec.secId)
+            self.account.update_pnl(
+                this_day_unrealized_pnl=this_day_unrealized_pnl,
+                this_day_realized_pnl=this_day_realized_pnl,
+                this_day_cost=this_day_cost,
+            )
+            self.account.take_snapshot(exe_sec.secId, this_day_realized_pnl, this_day_cost)
+            self.account.update_last_nav()
+            if verbose:
+                print(f"----------{exe_sec.secId}----------")
+                print_positions(self.account.positions)
         snapshots = self.account.export_snapshots()
+        sec_ids = snapshots.pop("trade_date").str.split("-", expand=True)
+        snapshots.insert(0, "section", sec_ids[1])
+        snapshots.insert(0, "trade_date", sec_ids[0])
+        return snapshots
+
+    def save_nav(self, nav_data: pd.DataFrame, calendar: CCalendarSection):
+        check_and_makedirs(self.sim_save_dir)
+        db_struct = gen_nav_section_db(self.sim_save_dir, save_id=self.sim_id)
+        sqldb = CMgrSqlDb(
+            db_save_dir=db_struct.db_save_dir,
+            db_name=db_struct.db_name,
+            table=db_struct.table,
+            mode="a",
+        )
+        _, append_sec = calendar.match_id(f"{nav_data['trade_date'].iloc[0]}-{nav_data['section'].iloc[0]}")
+        if (res := sqldb.check_section_continuity(append_sec=append_sec, calendar=calendar)) == 0:
+            sqldb.update(update_data=nav_data)
+        return res
+
+    def main(
+            self, bgn_sec: CSection, stp_sec: CSection, calendar: CCalendarSection, verbose: bool = False,
+    ):
+        snapshots = self.run(bgn_sec, stp_sec, calendar, verbose)
         self.save_nav(snapshots, calendar)
         return 0
 
 
+"""
+------ parameter sweep ------
+"""
+
+
+@dataclass(frozen=True)
+class CSimCfg:
+    signal: CSignalBase
+    init_cash: float
+    cost_rate: float
+    exe_price_type: TExePriceType
+    sim_id: str = None
+
+    @property
+    def save_id(self) -> str:
+        return self.sim_id or self.signal.sid
+
+
+def run_sweep_task(sweep: "CSimSweep", cfg: CSimCfg, method: Literal["run", "main"], args: tuple) -> Any:
+    return getattr(sweep.create_simulation(cfg), method)(*args)
+
+
+def run_sweep_worker(
+        sweep: "CSimSweep", cfgs: list[CSimCfg], method: Literal["run", "main"], args: tuple,
+        tasks: Queue, results: Queue,
+):
+    """
+    get index of cfg from tasks until None, and put (index, result, error) to results
+
+    """
+    while (k := tasks.get()) is not None:
+        try:
+            results.put((k, run_sweep_task(sweep, cfgs[k], method, args), None))
+        except Exception:
+            results.put((k, None, traceback.format_exc()))
+    return 0
+
+
+class CSimSweep:
+    """
+    Run a batch of simulations with different signals and parameters, sharing the same
+    market data, major contract and instrument managers, which are loaded only once.
+    0.  with processes > 1 and the "fork" start method(Linux/macOS), workers are forked
+        after the managers are loaded. The sweep is passed to workers as an argument of Process,
+        which is inherited by fork instead of being pickled, so market data is shared by
+        copy-on-write. Otherwise simulations run one by one.
+    1.  main calls CSimulation.main of each cfg in workers, so navs, checkpoints and other results
+        are saved by each simulation in the same way as a single simulation, not in one bulk write,
+        and increment test is supported.
+    2.  errors in workers, or workers which crashed, are raised as RuntimeError in the main process.
+    """
+
+    def __init__(
+            self,
+            mgr_instru: CInstruMgr,
+            mgr_maj_contract: CMgrMajContractBase,
+            mgr_mkt_data: CMgrMktDataBase,
+            sim_save_dir: str,
+            engine: type[CSimulation] = None,
+            date_type: TDateType = TDateType.STR,
+    ):
+        """
+
+        :param engine: CSimulation or CSimulationVec(default)
+        """
+        self.mgr_instru = mgr_instru
+        self.mgr_maj_contract = mgr_maj_contract
+        self.mgr_mkt_data = mgr_mkt_data
+        self.sim_save_dir = sim_save_dir
+        self.engine = engine or CSimulationVec
+        self.date_type = date_type
+
+    def create_simulation(self, cfg: CSimCfg) -> CSimulation:
+        return self.engine(
+            signal=cfg.signal,
+            init_cash=cfg.init_cash,
+            cost_rate=cfg.cost_rate,
+            exe_price_type=cfg.exe_price_type,
+            mgr_instru=self.mgr_instru,
+            mgr_maj_contract=self.mgr_maj_contract,
+            mgr_mkt_data=self.mgr_mkt_data,
+            sim_save_dir=self.sim_save_dir,
+            date_type=self.date_type,
+            sim_id=cfg.save_id,
+        )
+
+    def map(
+            self, cfgs: list[CSimCfg], method: Literal["run", "main"], args: tuple, processes: int = None,
+            poll_interval: float = 1.0,
+    ) -> list:
+        """
+
+        :param cfgs:
+        :param method: method of CSimulation to be called for each cfg
+        :param args: arguments of method
+        :param processes: number of processes, None for os.cpu_count(), 1 to run in the main process
+        :param poll_interval: seconds to wait for a result before checking whether workers are alive,
+                              RuntimeError is raised if a worker crashed(exitcode != 0), or if all
+                              workers exited before all results are received.
+        :return: results for each cfg, in the same order as cfgs
+        """
+        if len(set(cfg.save_id for cfg in cfgs)) < len(cfgs):
+            raise ValueError("save_id of each cfg must be unique, please set sim_id for cfgs")
+
+        if processes == 1 or "fork" not in get_all_start_methods():
+            if processes != 1:
+                logger.warning(f"Start method {SFY('fork')} is not available, simulations will run one by one")
+            return [run_sweep_task(self, cfg, method, args) for cfg in cfgs]
+
+        ctx = get_context("fork")
+        tasks, results = ctx.Queue(), ctx.Queue()
+        workers = [
+            ctx.Process(target=run_sweep_worker, args=(self, cfgs, method, args, tasks, results))
+            for _ in range(min(processes or os.cpu_count(), len(cfgs)))
+        ]
+        for worker in workers:
+            worker.start()
+        for k in range(len(cfgs)):
+            tasks.put(k)
+        for _ in workers:
+            tasks.put(None)
+        def get_result() -> tuple[int, Any, str | None]:
+            while True:
+                try:
+                    return results.get(timeout=poll_interval)
+                except Empty:
+                    for w in workers:
+                        if w.exitcode not in (None, 0):
+                            raise RuntimeError(f"Worker {w.pid} of sweep exited with code {w.exitcode}")
+                    if not any(w.is_alive() for w in workers):
+                        # results put just before workers exited
+                        try:
+                            return results.get(timeout=poll_interval)
+                        except Empty:
+                            raise RuntimeError("All workers of sweep exited before all results are received")
+
+        res: list = [None] * len(cfgs)
+        try:
+            for _ in cfgs:
+                k, result, error = get_result()
+                if error is not None:
+                    raise RuntimeError(f"Simulation of {cfgs[k].save_id} failed in worker:\n{error}")
+                res[k] = result
+        except BaseException:
+            for worker in workers:
+                worker.terminate()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+        return res
+
+    def run(
+            self, cfgs: list[CSimCfg], bgn_date: str, stp_date: str, calendar: CCalendar, processes: int = None,
+    ) -> list[pd.DataFrame]:
+        """
+
+        :param cfgs:
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param processes: number of processes, None for os.cpu_count(), 1 to run in the main process
+        :return: snapshots for each cfg, in the same order as cfgs, nothing is saved
+        """
+        return self.map(cfgs, "run", (bgn_date, stp_date, calendar), processes=processes)
+
+    def main(
+            self, cfgs: list[CSimCfg], bgn_date: str, stp_date: str, calendar: CCalendar, processes: int = None,
+    ):
+        self.map(cfgs, "main", (bgn_date, stp_date, calendar), processes=processes)
+        logger.info(f"Results of {SFG(len(cfgs))} simulations are saved to {SFG(self.sim_save_dir)}")
+        return 0
+
+
 """
 ------ classes for CTA V4 ------
 Not necessary for all users
@@ -401,9 +1857,28 @@ by inherit from base class
 """
 
 
-class CMgrMajContract(CMgrMajContractBase):
-    def __init__(self, universe: list[str], preprocess: CDbStruct):
-        self.major_data: dict[str, dict[str, str]] = {}
+class CRollCalendar(CMgrMajContractBase):
+    """
+    A precomputed roll calendar, built from the same major contract tables as CMgrMajContract,
+    all instruments in one pass.
+    0.  self.contracts: an object array with shape = (T, N), major contract of each (trade date, instrument),
+        "" if not available. T is the union of trade dates of all instruments.
+    1.  self.rolls: a bool array with shape = (T, N), True if major contract is different from
+        the major contract of the previous trade date.
+    2.  get_contracts_matrix is vectorized, used by CSimulationVec.preload.
+    3.  it could be used as mgr_maj_contract of CSimulation and CSimulationVec. Rolls of held positions
+        are a subset of self.rolls: a roll on trade date T is executed on the next trade date of T.
+    """
+
+    def __init__(self, universe: list[str], preprocess: CDbStruct, bgn_date: str = None, stp_date: str = None):
+        """
+
+        :param universe:
+        :param preprocess:
+        :param bgn_date: if bgn_date and stp_date are provided, only data in [bgn_date, stp_date) are loaded
+        :param stp_date:
+        """
+        dfs: list[pd.DataFrame] = []
         for instrument in universe:
             db_struct = preprocess.copy_to_another(another_db_name=f"{instrument}.db")
             sqldb = CMgrSqlDb(
@@ -412,10 +1887,199 @@ class CMgrMajContract(CMgrMajContractBase):
                 table=db_struct.table,
                 mode="r",
             )
-            data = sqldb.read(value_columns=["trade_date", "ticker_major"])
-            self.major_data[instrument] = data.set_index("trade_date")["ticker_major"].to_dict()
+            value_columns = ["trade_date", "ticker_major"]
+            if bgn_date and stp_date:
+                data = sqldb.read_by_range(bgn_date, stp_date, value_columns=value_columns)
+            else:
+                data = sqldb.read(value_columns=value_columns)
+            dfs.append(data.assign(instrument=instrument))
+        data = pd.concat(dfs, ignore_index=True)
+        date_codes, trade_dates = pd.factorize(data["trade_date"].astype(str), sort=True)
+        self.trade_dates: list[str] = trade_dates.tolist()
+        self.instruments: list[str] = list(universe)
+        self.date_sn: dict[str, int] = {d: t for t, d in enumerate(self.trade_dates)}
+        self.instru_sn: dict[str, int] = {instrument: i for i, instrument in enumerate(self.instruments)}
+        self.contracts: np.ndarray = np.full((len(self.trade_dates), len(self.instruments)), "", dtype=object)
+        self.contracts[date_codes, pd.Index(self.instruments).get_indexer(data["instrument"])] = data["ticker_major"].values
+        self.rolls: np.ndarray = np.zeros(self.contracts.shape, dtype=np.bool_)
+        prev, this = self.contracts[:-1], self.contracts[1:]
+        self.rolls[1:] = (this != prev) & (this != "") & (prev != "")
+        logger.info(f"Roll calendar loaded")
+
+    def get_contract(self, trade_date: str, instrument: str) -> str:
+        """
+
+        :param trade_date: like "20250407"
+        :param instrument: "CU.SHF"
+        :return: "CU2506.SHF"
+        """
+        if contract := self.contracts[self.date_sn[trade_date], self.instru_sn[instrument]]:
+            return contract
+        raise KeyError((trade_date, instrument))
+
+    def get_contracts_matrix(self, trade_dates: list[str], instruments: list[str]) -> np.ndarray:
+        rows = pd.Index(self.trade_dates).get_indexer(trade_dates)
+        cols = pd.Index(self.instruments).get_indexer(instruments)
+        res = self.contracts[rows[:, None], cols[None, :]]
+        res[(rows < 0)[:, None] | (cols < 0)[None, :]] = ""
+        return res
+
+    def is_roll(self, trade_date: str, instrument: str) -> bool:
+        return bool(self.rolls[self.date_sn[trade_date], self.instru_sn[instrument]])
+
+    def get_rolls(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :return: a pd.DataFrame with columns ["trade_date", "instrument", "old_contract", "new_contract"]
+        """
+        bgn_sn = bisect.bisect_left(self.trade_dates, bgn_date)
+        stp_sn = bisect.bisect_left(self.trade_dates, stp_date)
+        rt, ri = np.nonzero(self.rolls[bgn_sn:stp_sn])
+        rt += bgn_sn
+        return pd.DataFrame({
+            "trade_date": np.array(self.trade_dates, dtype=object)[rt],
+            "instrument": np.array(self.instruments, dtype=object)[ri],
+            "old_contract": self.contracts[rt - 1, ri],
+            "new_contract": self.contracts[rt, ri],
+        })
+
+
+class CWindowLoader:
+    """
+    Load data window by window, instead of reading the whole table.
+    0.  [bgn_date, stp_date) is split into windows of win_days(default 365) natural days, only the data
+        of current window are kept in memory. If win_days is None, [bgn_date, stp_date) is
+        loaded as one window.
+    1.  when a window is switched to, the next window is prefetched by a background thread,
+        so sequential access, like in simulations, seldom waits for IO.
+    2.  dates out of [bgn_date, stp_date) are still available, the windows containing them
+        are loaded on demand.
+    3.  nothing is loaded until the first call of get, so it is safe to fork before that.
+    """
+
+    def __init__(
+            self,
+            load: Callable[[str, str], dict[str, Any]],
+            bgn_date: str,
+            stp_date: str,
+            win_days: int | None = 365,
+            prefetch: bool = True,
+    ):
+        """
+
+        :param load: a function with arguments (bgn_date, stp_date), returns a dict with trade dates
+                     in [bgn_date, stp_date) as keys
+        :param bgn_date:
+        :param stp_date:
+        :param win_days: size of each window in natural days, None to load [bgn_date, stp_date) as one window
+        :param prefetch: whether to prefetch the next window
+        """
+        self.load = load
+        self.bgn = dt.datetime.strptime(bgn_date, "%Y%m%d")
+        tot_days = max((dt.datetime.strptime(stp_date, "%Y%m%d") - self.bgn).days, 1)
+        self.win_days = win_days or tot_days
+        self.n_wins = -(-tot_days // self.win_days)
+        self.prefetch = prefetch
+        self.__lo, self.__hi, self.__data = "", "", {}
+        self.__next: tuple[int, int, Future] | None = None  # (window, pid, future)
+
+    def get_window(self, k: int) -> tuple[str, str]:
+        """
+
+        :param k: index of window
+        :return: bgn_date and stp_date of window k
+        """
+        lo = self.bgn + dt.timedelta(days=k * self.win_days)
+        hi = lo + dt.timedelta(days=self.win_days)
+        return lo.strftime("%Y%m%d"), hi.strftime("%Y%m%d")
+
+    def __load_async(self, k: int) -> Future:
+        future = Future()
+
+        def task():
+            try:
+                future.set_result(self.load(*self.get_window(k)))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=task, daemon=True).start()
+        return future
+
+    def __switch(self, trade_date: str):
+        k = (dt.datetime.strptime(trade_date, "%Y%m%d") - self.bgn).days // self.win_days
+        if self.__next is not None and self.__next[0:2] == (k, os.getpid()):
+            data = self.__next[2].result()
+        else:
+            data = self.load(*self.get_window(k))
+        (self.__lo, self.__hi), self.__data = self.get_window(k), data
+        if self.prefetch and 0 <= k + 1 < self.n_wins:
+            self.__next = (k + 1, os.getpid(), self.__load_async(k + 1))
+        else:
+            self.__next = None
+        return 0
+
+    def get(self, trade_date: str) -> Any:
+        if (res := self.__data.get(trade_date)) is not None:
+            return res
+        if not (self.__lo <= trade_date < self.__hi):
+            self.__switch(trade_date)
+        return self.__data[trade_date]
+
+
+class CMgrMajContract(CMgrMajContractBase):
+    def __init__(
+            self,
+            universe: list[str],
+            preprocess: CDbStruct,
+            bgn_date: str = None,
+            stp_date: str = None,
+            win_days: int | None = 365,
+    ):
+        """
+
+        :param universe:
+        :param preprocess:
+        :param bgn_date: if bgn_date and stp_date are provided, only data in [bgn_date, stp_date)
+                         are loaded, window by window, see CWindowLoader. Otherwise, all data are loaded.
+        :param stp_date:
+        :param win_days: size of each window in natural days, None to load [bgn_date, stp_date) as one window
+        """
+        self.universe = universe
+        self.sqldbs: dict[str, CMgrSqlDb] = {}
+        for instrument in universe:
+            db_struct = preprocess.copy_to_another(another_db_name=f"{instrument}.db")
+            self.sqldbs[instrument] = CMgrSqlDb(
+                db_save_dir=db_struct.db_save_dir,
+                db_name=db_struct.db_name,
+                table=db_struct.table,
+                mode="r",
+            )
+        self.major_data: dict[str, dict[str, str]] = {}
+        self.loader: CWindowLoader | None = None
+        if bgn_date and stp_date:
+            self.loader = CWindowLoader(self.load, bgn_date, stp_date, win_days=win_days)
+        else:
+            for instrument, sqldb in self.sqldbs.items():
+                data = sqldb.read(value_columns=["trade_date", "ticker_major"])
+                self.major_data[instrument] = dict(zip(data["trade_date"], data["ticker_major"]))
         logger.info(f"Major contract loaded")
 
+    def load(self, bgn_date: str, stp_date: str) -> dict[str, dict[str, str]]:
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :return: major contracts with structure {trade_date: {instrument: contract}}
+        """
+        res: dict[str, dict[str, str]] = {}
+        for instrument, sqldb in self.sqldbs.items():
+            data = sqldb.read_by_range(bgn_date, stp_date, value_columns=["trade_date", "ticker_major"])
+            for trade_date, contract in zip(data["trade_date"], data["ticker_major"]):
+                res.setdefault(trade_date, {})[instrument] = contract
+        return res
+
     def get_contract(self, trade_date: str, instrument: str) -> str:
         """
 
@@ -423,10 +2087,38 @@ class CMgrMajContract(CMgrMajContractBase):
         :param instrument: "CU.SHF"
         :return: "CU2506.SHF"
         """
+        if self.loader is not None:
+            return self.loader.get(trade_date)[instrument]
         return self.major_data[instrument][trade_date]
 
+    def get_contracts_matrix(self, trade_dates: list[str], instruments: list[str]) -> np.ndarray:
+        if self.loader is not None:
+            rows: list[dict[str, str]] = []
+            for trade_date in trade_dates:
+                try:
+                    rows.append(self.loader.get(trade_date))
+                except KeyError:
+                    rows.append({})
+            data = pd.DataFrame(rows, columns=instruments)
+        else:
+            data = pd.DataFrame({
+                instrument: pd.Series(self.major_data.get(instrument, {}), dtype=object).reindex(trade_dates).values
+                for instrument in instruments
+            }, columns=instruments)
+        return data.fillna("").to_numpy(dtype=object)
+
 
 class CMgrMktData(CMgrMktDataBase):
+    """
+    Market data are saved in a compact columnar store instead of dict-of-dicts:
+    0.  each field is a 1-d numpy array, rows of the same contract are contiguous and
+        sorted by trade date, so the row of (trade_date, contract) is
+        offsets[contract] + sn(trade_date) - first_sns[contract].
+    1.  trade dates between the first and last date of a contract but not in the table
+        are padded with np.nan, and marked by self.present.
+    2.  numeric fields are saved as float64, others as object arrays.
+    """
+
     def __init__(self, fmd: CDbStruct):
         sqldb = CMgrSqlDb(
             db_save_dir=fmd.db_save_dir,
@@ -436,8 +2128,44 @@ class CMgrMktData(CMgrMktDataBase):
         )
         data = sqldb.read()
         data[["open", "close", "settle"]] = data[["open", "close", "settle"]].bfill(axis=1)
-        keys = ["trade_date", "ts_code"]
-        self.md: dict[tuple[str, str], dict] = data.set_index(keys).to_dict(orient="index")
+        date_codes, dates = pd.factorize(data["trade_date"], sort=True)
+        contract_codes, contracts = pd.factorize(data["ts_code"], sort=True)
+
+        # --- trade dates and contracts to integer indexes
+        self.date_sn: dict[str, int] = {d: i for i, d in enumerate(dates)}
+        self.contract_sn: dict[str, int] = {c: i for i, c in enumerate(contracts)}
+        self.dates: pd.Index = dates
+        self.contracts: pd.Index = contracts
+
+        # --- contract-major layout
+        first_sns = np.full(len(contracts), len(dates), dtype=np.int64)
+        last_sns = np.full(len(contracts), -1, dtype=np.int64)
+        np.minimum.at(first_sns, contract_codes, date_codes)
+        np.maximum.at(last_sns, contract_codes, date_codes)
+        self.first_sns: np.ndarray = first_sns
+        self.spans: np.ndarray = last_sns - first_sns + 1
+        self.offsets: np.ndarray = np.concatenate(([0], np.cumsum(self.spans)[:-1])).astype(np.int64)
+        rows = self.offsets[contract_codes] + date_codes - first_sns[contract_codes]
+        size = int(self.spans.sum())
+        self.present: np.ndarray = np.zeros(size, dtype=bool)
+        self.present[rows] = True
+
+        # --- columnar fields
+        self.fields: dict[str, np.ndarray] = {}
+        for md in data.columns.drop(["trade_date", "ts_code"]):
+            if data[md].dtype.kind in "biuf":
+                values = np.full(size, np.nan)
+                values[rows] = data[md].to_numpy(dtype=np.float64)
+            else:
+                values = np.full(size, None, dtype=object)
+                values[rows] = data[md].to_numpy(dtype=object)
+            self.fields[md] = values
+
+        # --- python list twins for scalar access in get_md, much faster than indexing numpy arrays
+        self.__first_sns: list[int] = self.first_sns.tolist()
+        self.__spans: list[int] = self.spans.tolist()
+        self.__offsets: list[int] = self.offsets.tolist()
+        self.__present: list[bool] = self.present.tolist()
         logger.info(f"Market data loaded")
 
     def get_md(self, trade_date: str, contract: str, md: str) -> int | float:
@@ -450,30 +2178,173 @@ class CMgrMktData(CMgrMktDataBase):
                      "vol", "amount", "oi"]
         :return:
         """
-        # return self.md[instrument][(trade_date, contract)][md]
-        return self.md[(trade_date, contract)][md]
+        c = self.contract_sn[contract]
+        i = self.date_sn[trade_date] - self.__first_sns[c]
+        if 0 <= i < self.__spans[c] and self.__present[row := self.__offsets[c] + i]:
+            return self.fields[md][row]
+        raise KeyError((trade_date, contract))
+
+    def get_md_many(self, trade_date: str, contracts: list[str], md: str) -> np.ndarray:
+        values, res = self.fields[md], np.full(len(contracts), np.nan)
+        if (d := self.date_sn.get(trade_date)) is None:
+            return res
+        c = np.array([self.contract_sn.get(contract, -1) for contract in contracts], dtype=np.int64)
+        found = c >= 0
+        i = np.where(found, d - self.first_sns[c], -1)
+        found &= (i >= 0) & (i < self.spans[c])
+        rows = np.where(found, self.offsets[c] + i, 0)
+        found &= self.present[rows]
+        res[found] = values[rows[found]]
+        return res
+
+    def get_md_matrix(self, trade_dates: list[str], contracts: np.ndarray, md: str) -> np.ndarray:
+        values = self.fields[md]
+        d = self.dates.get_indexer(trade_dates)
+        c = self.contracts.get_indexer(contracts.ravel()).reshape(contracts.shape)
+        found = (c >= 0) & (d >= 0)[:, None]
+        i = np.where(found, d[:, None] - self.first_sns[c], -1)
+        found &= (i >= 0) & (i < self.spans[c])
+        rows = np.where(found, self.offsets[c] + i, 0)
+        found &= self.present[rows]
+        res = np.full(contracts.shape, np.nan)
+        res[found] = values[rows[found]]
+        return res
+
+
+BAR_FIELDS = ("open", "high", "low", "close", "vol", "amount", "oi")
+BAR_DTYPE = np.dtype([("sn", np.int64)] + [(f, np.float64) for f in BAR_FIELDS])
+
+
+class CSectionBarStore(CMgrMktDataBase):
+    """
+    Section bars of each contract are saved in a .npy file with dtype = BAR_DTYPE, and
+    opened as a read-only memory-map, so only pages touched by a simulation are read from disk.
+    0.  rows are keyed by section index(sn) in CCalendarSection: row = sn - first sn of contract.
+        Sections without bars are padded with sn = -1.
+    1.  get_md is called with secId instead of trade date, like "20240102-TS2".
+    """
+
+    def __init__(self, save_dir: str, calendar: CCalendarSection):
+        self.save_dir = save_dir
+        self.calendar = calendar
+        self.bars: dict[str, np.ndarray] = {}
+        self.first_sns: dict[str, int] = {}
+
+    def get_path(self, contract: str) -> str:
+        return os.path.join(self.save_dir, f"{contract}.npy")
+
+    def save(self, contract: str, data: pd.DataFrame):
+        """
+
+        :param contract:
+        :param data: a pd.DataFrame with columns ["trade_date", "section"] + some of BAR_FIELDS,
+                     missing fields are saved as np.nan
+        :return:
+        """
+        sns = np.array([
+            self.calendar.get_sn_from_id(f"{trade_date}-{section}")
+            for trade_date, section in zip(data["trade_date"], data["section"])
+        ], dtype=np.int64)
+        first_sn, last_sn = int(sns.min()), int(sns.max())
+        rows = sns - first_sn
+        check_and_makedirs(self.save_dir)
+        self.bars.pop(contract, None)
+        self.first_sns.pop(contract, None)
+        bars = np.lib.format.open_memmap(
+            self.get_path(contract), mode="w+", dtype=BAR_DTYPE, shape=(last_sn - first_sn + 1,),
+        )
+        bars["sn"] = -1
+        bars["sn"][rows] = sns
+        for f in BAR_FIELDS:
+            bars[f] = np.nan
+            if f in data.columns:
+                bars[f][rows] = data[f].to_numpy(dtype=np.float64)
+        bars.flush()
+        del bars
+        return 0
+
+    def load(self, contract: str) -> np.ndarray:
+        if (bars := self.bars.get(contract)) is None:
+            try:
+                bars = np.load(self.get_path(contract), mmap_mode="r")
+            except FileNotFoundError:
+                raise KeyError(f"Bars of {contract} are not found in {self.save_dir}")
+            self.bars[contract], self.first_sns[contract] = bars, int(bars["sn"][0])
+        return bars
+
+    def get_md(self, trade_date: str, contract: str, md: str) -> int | float:
+        """
+
+        :param trade_date: secId, like "20240102-TS2"
+        :param contract:
+        :param md: one of BAR_FIELDS
+        :return:
+        """
+        bars = self.load(contract)
+        try:
+            sn = self.calendar.get_sn_from_id(trade_date)
+        except ValueError:
+            raise KeyError((trade_date, contract))
+        i = sn - self.first_sns[contract]
+        if 0 <= i < len(bars) and bars[i]["sn"] == sn:
+            return float(bars[i][md])
+        raise KeyError((trade_date, contract))
 
 
 class CSignal(CSignalBase):
-    def __init__(self, sid: str, signal_db_struct: CDbStruct):
+    def __init__(
+            self,
+            sid: str,
+            signal_db_struct: CDbStruct,
+            bgn_date: str = None,
+            stp_date: str = None,
+            win_days: int | None = 365,
+    ):
+        """
+
+        :param sid:
+        :param signal_db_struct:
+        :param bgn_date: if bgn_date and stp_date are provided, only data in [bgn_date, stp_date)
+                         are loaded, window by window, see CWindowLoader. Otherwise, all data are loaded.
+        :param stp_date:
+        :param win_days: size of each window in natural days, None to load [bgn_date, stp_date) as one window
+        """
         self._sid = sid
-        sqldb = CMgrSqlDb(
+        self.sqldb = CMgrSqlDb(
             db_save_dir=signal_db_struct.db_save_dir,
             db_name=signal_db_struct.db_name,
             table=signal_db_struct.table,
             mode="r",
         )
-        data = sqldb.read()
         self.signal: dict[str, dict[str, float]] = {}
-        for trade_date, trade_date_data in data.groupby("trade_date"):
-            trade_date: str
-            trade_date_data: pd.DataFrame
-            d: pd.DataFrame = trade_date_data[["instrument", "weight"]].set_index("instrument")
-            self.signal[trade_date] = d["weight"].to_dict()
+        self.loader: CWindowLoader | None = None
+        if bgn_date and stp_date:
+            self.loader = CWindowLoader(self.load, bgn_date, stp_date, win_days=win_days)
+        else:
+            self.signal = self.load()
+
+    def load(self, bgn_date: str = None, stp_date: str = None) -> dict[str, dict[str, float]]:
+        """
+
+        :param bgn_date: if None, all data are loaded
+        :param stp_date:
+        :return: signals with structure {trade_date: {instrument: weight}}
+        """
+        value_columns = ["trade_date", "instrument", "weight"]
+        if bgn_date and stp_date:
+            data = self.sqldb.read_by_range(bgn_date, stp_date, value_columns=value_columns)
+        else:
+            data = self.sqldb.read(value_columns=value_columns)
+        res: dict[str, dict[str, float]] = {}
+        for trade_date, instrument, weight in zip(data["trade_date"], data["instrument"], data["weight"]):
+            res.setdefault(trade_date, {})[instrument] = weight
+        return dict(sorted(res.items()))
 
     @property
     def sid(self) -> str:
         return self._sid
 
     def get_signal(self, trade_date: str) -> dict[str, float]:
+        if self.loader is not None:
+            return self.loader.get(trade_date)
         return self.signal[trade_date]
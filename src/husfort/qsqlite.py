@@ -3,7 +3,7 @@ import dataclasses
 import pandas as pd
 import sqlite3 as sql3
 from loguru import logger
-from husfort.qcalendar import CCalendar, CSection, CCalendarSection
+from husfort.qcalendar import CCalendar, CSection, CCalendarSection, TDateType
 from husfort.qutility import SFR, SFY, SFG
 
 
@@ -13,6 +13,18 @@ class CSqlVar:
     dtype: str  # ("TEXT", "INTEGER", "REAL")
 
 
+def gen_sql_var_date(name: str = "trade_date", date_type: TDateType = TDateType.STR) -> CSqlVar:
+    """
+
+    :param name: name of the date column
+    :param date_type: TDateType.STR for "YYYYMMDD" as TEXT, others for YYYYMMDD as INTEGER.
+                      Serials are never saved, because they are only meaningful with a
+                      specific calendar file.
+    :return:
+    """
+    return CSqlVar(name, "TEXT" if date_type == TDateType.STR else "INTEGER")
+
+
 @dataclasses.dataclass(frozen=True)
 class CSqlVars:
     primary_keys: list[CSqlVar]
@@ -280,12 +292,20 @@ class CMgrSqlDb(object):
             value_columns=value_columns,
         )
 
-    def check_continuity(self, incoming_date: str, calendar: CCalendar, check_var: str = "trade_date") -> int:
+    def check_continuity(self, incoming_date: str | int, calendar: CCalendar, check_var: str = "trade_date") -> int:
+        """
+
+        :param incoming_date: "YYYYMMDD" or YYYYMMDD, both TEXT and INTEGER date columns are supported
+        :param calendar:
+        :param check_var:
+        :return:
+        """
         tail_data = self.tail(n=1, value_columns=[check_var])
         if tail_data.empty:
             return 0
 
-        expected_next_date = calendar.get_next_date(last_date := tail_data[check_var].iloc[-1], shift=1)
+        incoming_date = str(incoming_date)
+        expected_next_date = calendar.get_next_date(last_date := str(tail_data[check_var].iloc[-1]), shift=1)
         if expected_next_date == incoming_date:
             return 0
         elif expected_next_date < incoming_date:
@@ -344,8 +364,8 @@ class CMgrSqlDb(object):
             cmd_upd = self.table.cmd_sql_upd
             with sql3.connect(self.db_path) as connection:
                 cursor = connection.cursor()
-                for data_cell in update_data.itertuples(index=using_index):  # itertuples is much faster than iterrows
-                    cursor.execute(cmd_upd, data_cell)
+                # itertuples is much faster than iterrows, executemany inserts all rows in one call
+                cursor.executemany(cmd_upd, update_data.itertuples(index=using_index, name=None))
                 connection.commit()
         return 0
 
@@ -377,3 +397,26 @@ class CMgrSqlDb(object):
                 ("section", "=", section.section)],
         )
         return 0
+
+
+def update_in_transaction(db_save_dir: str, db_name: str, updates: list[tuple[CSqlTable, pd.DataFrame, bool]]):
+    """
+    update some tables of the same db in one transaction, i.e., all of them or none of them are updated.
+    Tables are created if they do not exist.
+
+    :param db_save_dir:
+    :param db_name:
+    :param updates: a list of (table, update_data, clear), if clear is True, all rows of table
+                    are deleted before update_data is inserted
+    :return:
+    """
+    with sql3.connect(os.path.join(db_save_dir, db_name)) as connection:
+        cursor = connection.cursor()
+        for table, _, _ in updates:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table.name}({table.cmd_sql_vars}, {table.cmd_sql_primary})")
+        for table, update_data, clear in updates:
+            if clear:
+                cursor.execute(f"DELETE FROM {table.name}")
+            cursor.executemany(table.cmd_sql_upd, update_data.itertuples(index=False, name=None))
+        connection.commit()
+    return 0
@@ -1,8 +1,12 @@
 if __name__ == "__main__":
     import argparse
+    import json
+    import numpy as np
     import pandas as pd
     import scipy.stats as sps
-    from husfort.qevaluation import CNAV
+    from multiprocessing import Pool
+    from husfort.qutility import qtimer
+    from husfort.qevaluation import CNAV, CNAVMatrix, CNAVStream
 
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument(
@@ -12,6 +16,9 @@ if __name__ == "__main__":
     arg_parser.add_argument(
         "--size", type=int, default=2000, help="size of samples"
     )
+    arg_parser.add_argument(
+        "--slices", type=int, default=10000, help="number of short series for benchmark"
+    )
     args = arg_parser.parse_args()
 
     mu, sd = args.mu, args.sigma
@@ -32,3 +39,125 @@ if __name__ == "__main__":
     res_display = nav.reformat_to_display()
     print(pd.Series(res_display))
     print("-" * 24)
+
+    rolling = pd.DataFrame({
+        f"{ind}": nav.cal_rolling(indicator=ind, win=250) for ind in ("mean", "std", "sharpe", "calmar", "mdd")
+    })
+    print(rolling.dropna())
+    print("-" * 24)
+
+    expanding = pd.DataFrame({
+        f"{ind}": nav.cal_expanding(indicator=ind) for ind in ("mean", "std", "sharpe", "calmar", "mdd")
+    })
+    print(expanding)
+    print("-" * 24)
+
+    # --- nan values are skipped, like pandas
+    ret_nan = ret_data.copy()
+    ret_nan.iloc[10] = np.nan
+    nav = CNAV(input_srs=ret_nan, input_type="RET")
+    nav.cal_all_indicators(qs=(1, 99))
+    res_nan = nav.to_dict()
+    assert np.isclose(res_nan["sharpe"], ret_nan.mean() / ret_nan.std() * np.sqrt(250), rtol=1e-12)
+    assert np.isclose(res_nan["hpr"], (ret_nan + 1).prod() - 1, rtol=1e-12)
+    assert isinstance(res_nan["lddDur"], np.int64) and isinstance(res_nan["lrd"], np.int64)
+    assert nav.nav_srs is nav.nav_srs and nav.obs == n - 1
+    print("-" * 24)
+
+    # --- evaluate many strategies at once
+    k = 200
+    ret_df = pd.DataFrame(
+        data=sps.norm.rvs(loc=mu, scale=sd, size=(n, k)),
+        index=dates,
+        columns=[f"S{_:03d}" for _ in range(k)],
+    )
+    nav_matrix = CNAVMatrix(input_df=ret_df, input_type="RET")
+    nav_matrix.cal_all_indicators(qs=(1, 99))
+    res_matrix = nav_matrix.to_frame()
+    print(res_matrix)
+    print("-" * 24)
+
+    res_loop = {}
+    for col in ret_df.columns:
+        nav = CNAV(input_srs=ret_df[col], input_type="RET")
+        nav.cal_all_indicators(qs=(1, 99))
+        res_loop[col] = nav.to_dict()
+    res_loop = pd.DataFrame.from_dict(res_loop, orient="index")
+    pd.testing.assert_frame_equal(res_matrix, res_loop, check_dtype=False)
+
+    # --- significance of indicators
+    nav = CNAV(input_srs=ret_data, input_type="RET")
+    res_boot = nav.bootstrap(n_samples=2000, block_size=20, method="stationary", qs=(1, 99))
+    print(res_boot)
+    print(f"deflated Sharpe = {nav.cal_deflated_sharpe(trials_sharpe=res_matrix['sharpe']):.4f}")
+    pd.testing.assert_frame_equal(
+        res_boot, nav.bootstrap(n_samples=2000, block_size=20, method="stationary", qs=(1, 99), processes=2))
+
+
+    def bootstrap_in_worker(srs: pd.Series) -> pd.DataFrame:
+        # workers of a Pool are daemonic, they could not create another Pool
+        return CNAV(input_srs=srs, input_type="RET").bootstrap(n_samples=200, qs=(1, 99))
+
+
+    with Pool(processes=2) as pool:
+        res_workers = pool.map(bootstrap_in_worker, [ret_data, ret_data])
+    pd.testing.assert_frame_equal(res_workers[0], res_workers[1])
+
+    # two-valued returns at the boundary of 1 - skew * sr + (kurt - 1) / 4 * sr ** 2 >= 0
+    two_valued = np.zeros(n)
+    two_valued[::5] = 0.01
+    rf = (two_valued.mean() - 2 / sps.skew(two_valued) * two_valued.std(ddof=1)) * 250
+    nav = CNAV(input_srs=pd.Series(two_valued, index=dates), input_type="RET", annual_rf_rate=rf)
+    assert 0 <= nav.cal_deflated_sharpe(trials_sharpe=[0.0]) <= 1
+    print("-" * 24)
+
+    # --- append returns day by day
+    nav_stream = CNAVStream(input_type="RET", qs=(1, 99))
+    for trade_date, ret in ret_data.items():
+        nav_stream.append(trade_date, ret)
+    nav = CNAV(input_srs=ret_data, input_type="RET")
+    nav.cal_all_indicators(qs=(1, 99))
+    print(pd.DataFrame({"stream": nav_stream.to_dict(), "full": nav.to_dict()}))
+    print(f"size of state = {len(nav_stream.to_json())}")
+
+    # states are valid JSON, with nan(like base_val of a new "NAV" stream) restored on load
+    def reject_constant(name: str):
+        raise ValueError(f"{name} is not valid JSON")
+
+
+    nav_input = (ret_data + 1).cumprod()
+    for nav_stream in (CNAVStream(input_type="NAV", qs=(1, 99)), CNAVStream(input_type="RET", qs=(1, 99))):
+        srs = nav_input if nav_stream.return_type == "NAV" else ret_data
+        for k in (0, 3, n // 2):
+            nav_stream.extend(srs.iloc[nav_stream.obs:k])
+            state = nav_stream.to_json()
+            json.loads(state, parse_constant=reject_constant)
+            restored = CNAVStream.from_json(state)
+            assert restored.to_json() == state
+            restored.extend(srs.iloc[k:])
+            nav_stream_full = CNAVStream(input_type=nav_stream.return_type, qs=(1, 99))
+            nav_stream_full.extend(srs)
+            pd.testing.assert_series_equal(pd.Series(restored.to_dict()), pd.Series(nav_stream_full.to_dict()))
+    print("-" * 24)
+
+    # --- construction and evaluation of many short series
+    short_srs = [ret_data.iloc[k % (n - 60):k % (n - 60) + 60] for k in range(args.slices)]
+
+
+    @qtimer
+    def construct_short_series() -> list[CNAV]:
+        return [CNAV(input_srs=srs, input_type="RET") for srs in short_srs]
+
+
+    @qtimer
+    def evaluate_short_series() -> list[dict]:
+        res = []
+        for srs in short_srs:
+            nav = CNAV(input_srs=srs, input_type="RET")
+            nav.cal_all_indicators(qs=(1, 99))
+            res.append(nav.to_dict())
+        return res
+
+
+    construct_short_series()
+    print(pd.DataFrame(evaluate_short_series()).describe().T)
@@ -1,9 +1,12 @@
 if __name__ == "__main__":
     import argparse
-    from husfort.qinstruments import CInstruMgr
+    import numpy as np
+    from husfort.qutility import qtimer
+    from husfort.qinstruments import CInstruMgr, CInstrument
 
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("-p", "--path", required=True, help="instruments file path")
+    arg_parser.add_argument("--size", type=int, default=10_000_000, help="rows of contract column for benchmark")
     args = arg_parser.parse_args()
 
     instru_mgr = CInstruMgr(instru_info_path=args.path)
@@ -39,3 +42,80 @@ if __name__ == "__main__":
     contract, trade_date = "m2005", "20191201"
     new = instru_mgr.fix_contract_id(contract, trade_date=trade_date, cformat="VANILLA")
     print(f"@{trade_date} {contract} => {new}")
+
+    # --- benchmark: vectorized versions on a realistic contract column
+    rng = np.random.default_rng(0)
+    universe = instru_mgr.get_universe()
+    instruments = np.array(universe)[rng.integers(0, len(universe), size=args.size)]
+    year_digits, months = rng.integers(0, 10, size=args.size), rng.integers(1, 13, size=args.size)
+    contract_col = np.array([
+        f"{i}{y}{m:02d}" if instru_mgr.get_exchange(i) == "CZCE" else f"{i}2{y}{m:02d}"
+        for i, y, m in zip(instruments, year_digits, months)
+    ], dtype=object)
+    trade_date_col = np.array([f"20{y + 18}0105" for y in rng.integers(0, 10, size=args.size)], dtype=object)
+
+
+    @qtimer
+    def fix_by_map() -> list[str]:
+        return [instru_mgr.fix_contract_id(c, d, cformat="VANILLA") for c, d in zip(contract_col, trade_date_col)]
+
+
+    @qtimer
+    def fix_by_vectorized() -> np.ndarray:
+        return instru_mgr.fix_contract_ids(contract_col, trade_date_col, cformat="VANILLA")
+
+
+    @qtimer
+    def convert_by_map() -> list[str]:
+        return [instru_mgr.convert_contract_from_vanilla(c, cformat="WIND") for c in contract_col]
+
+
+    @qtimer
+    def convert_by_vectorized() -> np.ndarray:
+        return instru_mgr.convert_contracts_from_vanilla(contract_col, cformat="WIND")
+
+
+    @qtimer
+    def multipliers_by_loop() -> list[int]:
+        return [instru_mgr.get_multiplier(i) for i in instruments]
+
+
+    @qtimer
+    def multipliers_by_bulk() -> np.ndarray:
+        return instru_mgr.multipliers(instruments)
+
+
+    @qtimer
+    def exchanges_by_loop() -> list[str]:
+        return [instru_mgr.get_exchange(i, cformat="WIND") for i in instruments]
+
+
+    @qtimer
+    def exchanges_by_bulk() -> np.ndarray:
+        return instru_mgr.exchanges(instruments, cformat="WIND")
+
+
+    assert fix_by_map() == fix_by_vectorized().tolist()
+    assert convert_by_map() == convert_by_vectorized().tolist()
+    assert multipliers_by_loop() == multipliers_by_bulk().tolist()
+    assert exchanges_by_loop() == exchanges_by_bulk().tolist()
+    for get_exchanges in (lambda: instru_mgr.get_exchange(instruments[0], cformat="BLOOMBERG"),
+                          lambda: instru_mgr.exchanges(instruments, cformat="BLOOMBERG")):
+        try:
+            get_exchanges()
+        except ValueError as e:
+            print(e)
+        else:
+            raise AssertionError("ValueError should be raised for invalid cformat")
+
+    # --- instruments in mgr are created from the table
+    instruments_data = instru_mgr.instruments_data.to_dict(orient="index").values()
+    assert dict(instru_mgr.mgr) == {d["instrumentId"]: CInstrument(**d) for d in instruments_data}
+
+    # --- missing contracts or trade dates are kept as None
+    fixed = instru_mgr.fix_contract_ids(["ZC005", None, "ZC005", np.nan], ["20191201", "20191201", None, np.nan], "VANILLA")
+    assert fixed.tolist() == ["ZC2005", None, None, None], fixed
+
+    # --- trade dates could be int, see TDateType.INT
+    fixed_int = instru_mgr.fix_contract_ids(contract_col, trade_date_col.astype(np.int64), cformat="VANILLA")
+    assert fixed_int.tolist() == fix_by_vectorized().tolist()
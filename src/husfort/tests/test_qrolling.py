@@ -0,0 +1,73 @@
+if __name__ == "__main__":
+    import argparse
+    import numpy as np
+    import pandas as pd
+    from husfort.qutility import qtimer
+    from husfort.qcalendar import CCalendar
+    from husfort.qrolling import CRollingEngine
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--calendar", type=str, required=True, help="path for calendar")
+    arg_parser.add_argument("--bgn", type=str, default="20120101", help="begin date, format: YYYYMMDD")
+    arg_parser.add_argument("--stp", type=str, default="20250101", help="stop  date, format: YYYYMMDD")
+    arg_parser.add_argument("--instruments", type=int, default=80, help="number of instruments")
+    args = arg_parser.parse_args()
+
+    calendar = CCalendar(args.calendar)
+    h_dates = calendar.get_iter_list(bgn_date=args.bgn, stp_date=args.stp)
+
+    # --- instruments are listed and delisted at random dates
+    rng = np.random.default_rng(0)
+    dfs = []
+    for k in range(args.instruments):
+        bgn_idx, end_idx = sorted(rng.integers(0, len(h_dates), size=2))
+        dates = [d for d in h_dates[bgn_idx:end_idx] if rng.random() > 0.05]
+        dfs.append(pd.DataFrame({
+            "trade_date": dates,
+            "instrument": f"I{k:03d}",
+            "ret": rng.normal(0, 0.01, size=len(dates)),
+        }))
+    data = pd.concat(dfs, ignore_index=True)
+    engine = CRollingEngine(calendar)
+
+
+    @qtimer
+    def cal_by_engine() -> pd.DataFrame:
+        return engine.cal(data, value="ret", wins=[5, 20, 60], methods=["mean", "std", "min", "max", "ewm"])
+
+
+    @qtimer
+    def cal_by_pandas() -> pd.DataFrame:
+        # the "last N trade days" has to be rebuilt by reindexing every instrument on the calendar
+        res = []
+        for instrument, instru_data in data.groupby("instrument"):
+            srs = instru_data.set_index("trade_date")["ret"]
+            srs = srs.reindex(calendar.get_iter_list(srs.index[0], calendar.get_next_date(srs.index[-1])))
+            res.append(srs.rolling(window=20, min_periods=1).std().reindex(instru_data["trade_date"]))
+        return pd.concat(res)
+
+
+    def ewm_in_window(x: np.ndarray, alpha: float = 2 / 21) -> float:
+        # weights of observations before the window are 0
+        weights = (1 - alpha) ** np.arange(len(x))[::-1]
+        valid = ~np.isnan(x)
+        return (weights[valid] @ x[valid]) / weights[valid].sum()
+
+
+    @qtimer
+    def cal_ewm_by_pandas() -> pd.DataFrame:
+        res = []
+        for instrument, instru_data in data.groupby("instrument"):
+            srs = instru_data.set_index("trade_date")["ret"]
+            srs = srs.reindex(calendar.get_iter_list(srs.index[0], calendar.get_next_date(srs.index[-1])))
+            res.append(srs.rolling(window=20, min_periods=1).apply(ewm_in_window, raw=True)
+                       .reindex(instru_data["trade_date"]))
+        return pd.concat(res)
+
+
+    by_engine = cal_by_engine()
+    by_pandas = cal_by_pandas()
+    print(by_engine.head(10))
+    print(f"max diff of std20 = {np.nanmax(np.abs(by_engine['ret_std20'].values - by_pandas.values)):.4e}")
+    by_pandas_ewm = cal_ewm_by_pandas()
+    print(f"max diff of ewm20 = {np.nanmax(np.abs(by_engine['ret_ewm20'].values - by_pandas_ewm.values)):.4e}")
@@ -0,0 +1,218 @@
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+    import numpy as np
+    import pandas as pd
+    from husfort.qutility import qtimer
+    from husfort.qcalendar import CCalendar
+    from husfort.qsimquick import CSimQuick, CSimQuickBatch, CSignalsLoaderBase, CTestReturnLoaderBase
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--dates", type=int, default=3000, help="number of dates")
+    arg_parser.add_argument("--instruments", type=int, default=100, help="number of instruments")
+    arg_parser.add_argument("--universe", type=int, default=5000, help="number of instruments for sparse test")
+    arg_parser.add_argument("--listed", type=int, default=500, help="average number of listed days for sparse test")
+    args = arg_parser.parse_args()
+
+    # --- about 10% of (date, instrument) are missing in returns, and 40% of them have no signal
+    rng = np.random.default_rng(0)
+    h_dates = pd.bdate_range("20100101", periods=args.dates).strftime("%Y%m%d").tolist()
+    instruments = [f"I{k:03d}" for k in range(args.instruments)]
+    rets = pd.DataFrame(
+        [(d, i) for d in h_dates for i in instruments if rng.random() > 0.1],
+        columns=["trade_date", "instrument"],
+    )
+    rets["ret"] = rng.normal(0, 0.01, size=len(rets))
+    sigs = rets[["trade_date", "instrument"]].sample(frac=0.6, random_state=0).sort_index()
+    sigs["weight"] = rng.normal(0, 0.1, size=len(sigs))
+
+
+    class CSignalsLoaderTest(CSignalsLoaderBase):
+        def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+            return sigs
+
+        @property
+        def signal_id(self) -> str:
+            return "test"
+
+
+    class CTestReturnLoaderTest(CTestReturnLoaderBase):
+        def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+            return rets
+
+        @property
+        def shift(self) -> int:
+            return 1
+
+        @property
+        def ret_name(self) -> str:
+            return "ret"
+
+
+    sim_quick = CSimQuick(
+        signals_loader=CSignalsLoaderTest(),
+        test_return_loader=CTestReturnLoaderTest(),
+        cost_rate=3e-4,
+        sims_quick_dir=".",
+    )
+    data = sim_quick.get_sigs_and_rets(h_dates[0], h_dates[-1])
+    exe_dates = h_dates
+
+
+    @qtimer
+    def cal_core_by_groupby() -> pd.DataFrame:
+        # the implementation before vectorization
+        raw_ret = data.groupby(by="trade_date").apply(lambda z: z["weight"] @ z["ret"])
+        daily_weights = pd.pivot_table(data=data, index="trade_date", columns="instrument", values="weight")
+        delta_weights_sum = daily_weights.diff().fillna(0).abs().sum(axis=1)
+        cost = delta_weights_sum * sim_quick.cost_rate
+        return pd.DataFrame({
+            "raw_ret": raw_ret,
+            "delta_weights_sum": delta_weights_sum,
+            "cost": cost,
+            "ret": raw_ret - cost,
+            "exe_date": exe_dates,
+        })
+
+
+    @qtimer
+    def cal_core_by_dense() -> pd.DataFrame:
+        return sim_quick.cal_core(data, exe_dates)
+
+
+    res_groupby, res_dense = cal_core_by_groupby(), cal_core_by_dense()
+    pd.testing.assert_frame_equal(res_groupby, res_dense, check_names=False)
+    print(res_dense.tail())
+
+    # --- duplicated (date, instrument) are averaged, like pd.pivot_table
+    dup_data = pd.concat([data, data.sample(frac=0.05, random_state=1).assign(weight=lambda z: z["weight"] * 3)])
+    dup_dates, dup_instruments, dup_weights, dup_rets = sim_quick.to_dense(dup_data)
+    for values, dense in (("weight", dup_weights), ("ret", dup_rets)):
+        pivot = pd.pivot_table(data=dup_data, index="trade_date", columns="instrument", values=values)
+        pivot = pivot.reindex(index=dup_dates, columns=dup_instruments)
+        np.testing.assert_allclose(dense, pivot.values if values == "weight" else pivot.fillna(0).values, rtol=1e-12)
+    print(f"{len(dup_data) - len(data)} duplicated rows are averaged")
+
+    # --- sparse path: an equity-style universe, each instrument is listed for a short span
+    # --- and only 10% of listed (date, instrument) have signals
+    bgn_idx = rng.integers(0, len(h_dates), size=args.universe)
+    spans = rng.integers(1, 2 * args.listed, size=args.universe)
+    date_idx = np.concatenate([np.arange(b, min(b + n, len(h_dates))) for b, n in zip(bgn_idx, spans)])
+    instru_idx = np.repeat(np.arange(args.universe), np.minimum(bgn_idx + spans, len(h_dates)) - bgn_idx)
+    eq_rets = pd.DataFrame({
+        "trade_date": np.array(h_dates)[date_idx],
+        "instrument": np.array([f"S{k:05d}" for k in range(args.universe)])[instru_idx],
+        "ret": rng.normal(0, 0.02, size=len(date_idx)),
+    }).sort_values(["trade_date", "instrument"], ignore_index=True)
+    eq_sigs = eq_rets[["trade_date", "instrument"]].sample(frac=0.1, random_state=0).sort_index()
+    eq_sigs["weight"] = rng.normal(0, 0.01, size=len(eq_sigs))
+    eq_dates = eq_rets["trade_date"].unique().tolist()
+    print(f"sparse test: {len(eq_rets)} returns, {len(eq_sigs)} signals, "
+          f"{len(eq_dates)} dates x {args.universe} instruments")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        calendar_path = os.path.join(tmp_dir, "calendar.csv")
+        pd.DataFrame({"trade_date": h_dates}).to_csv(calendar_path, index=False)
+        calendar = CCalendar(calendar_path)
+
+
+    class CSignalsLoaderEq(CSignalsLoaderTest):
+        def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+            return eq_sigs
+
+
+    class CTestReturnLoaderEq(CTestReturnLoaderTest):
+        def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+            return eq_rets
+
+
+    sim_quick_eq = CSimQuick(
+        signals_loader=CSignalsLoaderEq(),
+        test_return_loader=CTestReturnLoaderEq(),
+        cost_rate=3e-4,
+        sims_quick_dir=".",
+    )
+
+
+    def cal_with_memory(sparse: bool) -> pd.DataFrame:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        if sparse:
+            res = sim_quick_eq.cal_core_sparse(eq_dates[0], h_dates[-1], eq_dates, calendar)
+        else:
+            res = sim_quick_eq.cal_core(sim_quick_eq.get_sigs_and_rets(eq_dates[0], h_dates[-1]), eq_dates)
+        t1 = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{'sparse' if sparse else 'dense':<6s}: cal = {t1 - t0:.2f}s, peak memory = {peak / 2 ** 20:.1f}MB")
+        return res
+
+
+    res_dense, res_sparse = cal_with_memory(sparse=False), cal_with_memory(sparse=True)
+    pd.testing.assert_frame_equal(res_dense, res_sparse, check_names=False)
+    print(res_sparse.tail())
+
+    # duplicated (date, instrument) of signals and returns are averaged by both paths
+    eq_sigs = pd.concat([eq_sigs, eq_sigs.sample(frac=0.05, random_state=2).assign(weight=lambda z: z["weight"] * 3)])
+    eq_rets = pd.concat([eq_rets, eq_rets.sample(frac=0.05, random_state=3).assign(ret=lambda z: z["ret"] * 2)])
+    res_dense, res_sparse = cal_with_memory(sparse=False), cal_with_memory(sparse=True)
+    pd.testing.assert_frame_equal(res_dense, res_sparse, check_names=False)
+
+    # --- navs of CSimQuickBatch are the same as navs of CSimQuick for each signal, in 2 increments
+    class CSignalsLoaderSeed(CSignalsLoaderTest):
+        def __init__(self, seed: int):
+            self.seed = seed
+            self.sigs = rets[["trade_date", "instrument"]].sample(frac=0.6, random_state=seed).sort_index()
+            self.sigs["weight"] = np.random.default_rng(seed).normal(0, 0.1, size=len(self.sigs))
+
+        def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+            return self.sigs[(self.sigs["trade_date"] >= bgn_date) & (self.sigs["trade_date"] < stp_date)]
+
+        @property
+        def signal_id(self) -> str:
+            return f"seed{self.seed}"
+
+
+    class CTestReturnLoaderRange(CTestReturnLoaderTest):
+        def load(self, bgn_date: str, stp_date: str) -> pd.DataFrame:
+            return rets[(rets["trade_date"] >= bgn_date) & (rets["trade_date"] < stp_date)]
+
+
+    seed_loaders = [CSignalsLoaderSeed(seed) for seed in range(5)]
+    mid_date = h_dates[len(h_dates) // 2]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sim_batch = CSimQuickBatch(
+            signals_loaders=seed_loaders,
+            test_return_loader=CTestReturnLoaderRange(),
+            cost_rate=3e-4,
+            sims_quick_dir=tmp_dir,
+            save_id="batch",
+            batch_size=2,
+        )
+        # reading navs before the first run creates nothing
+        assert (sim_batch.load_last_navs(h_dates[4]) == 1).all() and not os.listdir(tmp_dir)
+        for bgn_date, stp_date in ((h_dates[5], mid_date), (mid_date, h_dates[-1])):
+            sim_batch.main(bgn_date, stp_date, calendar)
+            for loader in seed_loaders:
+                CSimQuick(
+                    signals_loader=loader,
+                    test_return_loader=CTestReturnLoaderRange(),
+                    cost_rate=3e-4,
+                    sims_quick_dir=tmp_dir,
+                ).main(bgn_date, stp_date, calendar, plot=False)
+        batch_navs = sim_batch.load_nav_range(h_dates[0], h_dates[-1])
+        loop_navs = pd.DataFrame({
+            loader.signal_id: CSimQuick(
+                signals_loader=loader,
+                test_return_loader=CTestReturnLoaderRange(),
+                cost_rate=3e-4,
+                sims_quick_dir=tmp_dir,
+            ).load_nav_range(h_dates[0], h_dates[-1])["nav"]
+            for loader in seed_loaders
+        })
+    pd.testing.assert_frame_equal(batch_navs, loop_navs, check_names=False, rtol=1e-12)
+    print(f"navs of CSimQuickBatch for {len(seed_loaders)} signals and {len(batch_navs)} dates "
+          f"are the same as CSimQuick")
@@ -0,0 +1,592 @@
+if __name__ == "__main__":
+    import argparse
+    import os
+    import shutil
+    import time
+    import tracemalloc
+    import numpy as np
+    import pandas as pd
+    from husfort.qutility import qtimer, check_and_makedirs
+    from husfort.qcalendar import CCalendar, CCalendarSection
+    from husfort.qsqlite import CMgrSqlDb, CDbStruct, CSqlTable, CSqlVar
+    from husfort.qinstruments import CInstruMgr
+    from husfort.qsimulation import CMgrMktDataBase, CMgrMktData, CMgrMajContract, CSignal
+    from husfort.qsimulation import CSimulation, CSimulationVec, TExePriceType, gen_nav_db
+    from husfort.qsimulation import CPosKey, CPosition, CTrade, CTrades, CPositionBook, TPosDirection, TPosOffset
+    from husfort.qsimulation import CSimSweep, CSimCfg, gen_ckpt_account_db, gen_ckpt_positions_db, gen_nav_section_db
+    from husfort.qsimulation import CSimulationSection, CSectionBarStore, CSignalBase, CMgrMajContractBase
+    from husfort.qsimulation import CRollCalendar, gen_rolls_db
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--calendar", type=str, required=True, help="path for calendar")
+    arg_parser.add_argument("--save", type=str, required=True, help="directory to save the test market data db")
+    arg_parser.add_argument("--bgn", type=str, default="20120101", help="begin date, format: YYYYMMDD")
+    arg_parser.add_argument("--stp", type=str, default="20250101", help="stop  date, format: YYYYMMDD")
+    arg_parser.add_argument("--contracts", type=int, default=3000, help="number of contracts")
+    arg_parser.add_argument("--queries", type=int, default=500_000, help="number of queries for latency test")
+    arg_parser.add_argument("--positions", type=int, default=200, help="number of position keys for book test")
+    arg_parser.add_argument("--sim-bgn", type=str, default="20150105", help="begin date of simulation tests")
+    arg_parser.add_argument("--sim-stp", type=str, default="20190102", help="stop  date of simulation tests")
+    args = arg_parser.parse_args()
+
+    calendar = CCalendar(args.calendar)
+    h_dates = calendar.get_iter_list(bgn_date=args.bgn, stp_date=args.stp)
+    md_fields = ["pre_close", "pre_settle", "open", "high", "low", "close", "settle", "vol", "amount", "oi"]
+
+    # --- each contract is traded for about one year, some days are missing
+    rng = np.random.default_rng(0)
+    dfs = []
+    for k in range(args.contracts):
+        bgn_idx = rng.integers(0, len(h_dates) - 1)
+        dates = [d for d in h_dates[bgn_idx:bgn_idx + 250] if rng.random() > 0.02]
+        dfs.append(pd.DataFrame({"trade_date": dates, "ts_code": f"C{k:05d}.SHF"}))
+    md_data = pd.concat(dfs, ignore_index=True)
+    for field in md_fields:
+        md_data[field] = np.round(rng.uniform(1000, 5000, size=len(md_data)), 1)
+    md_data.loc[rng.random(len(md_data)) < 0.01, "open"] = np.nan
+    fmd = CDbStruct(
+        db_save_dir=args.save,
+        db_name="test_fmd.db",
+        table=CSqlTable(
+            name="fmd",
+            primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("ts_code", "TEXT")],
+            value_columns=[CSqlVar(_, "REAL") for _ in md_fields],
+        ),
+    )
+    CMgrSqlDb(db_save_dir=fmd.db_save_dir, db_name=fmd.db_name, table=fmd.table, mode="w").update(md_data)
+    print(f"{len(md_data)} rows of market data are saved")
+
+
+    class CMgrMktDataDict(CMgrMktDataBase):
+        # reference implementation with dict-of-dicts
+        def __init__(self, fmd_struct: CDbStruct):
+            data = CMgrSqlDb(fmd_struct.db_save_dir, fmd_struct.db_name, fmd_struct.table, mode="r").read()
+            data[["open", "close", "settle"]] = data[["open", "close", "settle"]].bfill(axis=1)
+            self.md: dict[tuple[str, str], dict] = data.set_index(["trade_date", "ts_code"]).to_dict(orient="index")
+
+        def get_md(self, trade_date: str, contract: str, md: str) -> int | float:
+            return self.md[(trade_date, contract)][md]
+
+
+    def load_with_memory(cls: type[CMgrMktDataBase]) -> CMgrMktDataBase:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        mgr = cls(fmd)
+        t1 = time.perf_counter()
+        _, peak = tracemalloc.get_traced_memory()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{cls.__name__:<16s}: load = {t1 - t0:.2f}s, memory = {current / 2 ** 20:.1f}MB, "
+              f"peak = {peak / 2 ** 20:.1f}MB")
+        return mgr
+
+
+    mgr_dict = load_with_memory(CMgrMktDataDict)
+    mgr_cols = load_with_memory(CMgrMktData)
+
+    # --- queries, about 10% of them are missing in market data
+    idx = rng.integers(0, len(md_data), size=args.queries)
+    q_dates = md_data["trade_date"].values[idx]
+    q_contracts = md_data["ts_code"].values[rng.integers(0, len(md_data), size=args.queries)]
+    q_contracts = np.where(rng.random(args.queries) < 0.9, md_data["ts_code"].values[idx], q_contracts)
+
+
+    def query(mgr: CMgrMktDataBase) -> np.ndarray:
+        res = np.full(args.queries, np.nan)
+        for i, (d, c) in enumerate(zip(q_dates, q_contracts)):
+            try:
+                res[i] = mgr.get_md(d, c, "open")
+            except KeyError:
+                pass
+        return res
+
+
+    @qtimer
+    def query_dict() -> np.ndarray:
+        return query(mgr_dict)
+
+
+    @qtimer
+    def query_cols() -> np.ndarray:
+        return query(mgr_cols)
+
+
+    res_dict, res_cols = query_dict(), query_cols()
+    assert np.array_equal(res_dict, res_cols, equal_nan=True)
+
+    # --- bulk queries by date
+    q_day = md_data["trade_date"].mode().iloc[0]
+    day_contracts = md_data["ts_code"].unique().tolist()
+
+
+    @qtimer
+    def query_many_dict() -> np.ndarray:
+        return CMgrMktDataBase.get_md_many(mgr_dict, q_day, day_contracts, "close")
+
+
+    @qtimer
+    def query_many_cols() -> np.ndarray:
+        return mgr_cols.get_md_many(q_day, day_contracts, "close")
+
+
+    assert np.array_equal(query_many_dict(), query_many_cols(), equal_nan=True)
+
+    # --- simulation fixture: 8 instruments, major contract rolls every 30~60 days,
+    # --- each contract is traded 5 days before and after it is the major contract
+    sim_dir = os.path.join(args.save, "sim")
+    sim_instruments = ["CU", "AL", "ZN", "RB", "AU", "AG", "NI", "SN"]
+    sim_universe = [f"{instrument}.SHF" for instrument in sim_instruments]
+    sim_multipliers = [5, 5, 5, 10, 1000, 15, 1, 1]
+    sim_px0 = [50000, 18000, 22000, 4000, 400, 5000, 120000, 200000]
+    sim_fields = ["pre_close", "open", "high", "low", "close", "settle", "vol", "amount", "oi"]
+    check_and_makedirs(sim_dir)
+    pd.DataFrame({
+        "instrumentId": [instrument.lower() for instrument in sim_instruments], "exchange": "SHFE",
+        "minispread": 1.0, "multiplier": sim_multipliers, "timeTableId": "T", "hasNgtSec": 1, "hasDayBrk": 1,
+        "ngtSec": "", "daySec0": "", "daySec1": "", "daySec2": "",
+        "windId": sim_universe, "tushareId": sim_universe,
+    }).to_csv(os.path.join(sim_dir, "instru.csv"), index=False)
+    sim_fmd = CDbStruct(
+        db_save_dir=sim_dir,
+        db_name="fmd.db",
+        table=CSqlTable(
+            name="fmd",
+            primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("ts_code", "TEXT")],
+            value_columns=[CSqlVar(_, "REAL") for _ in sim_fields],
+        ),
+    )
+    sim_major = CDbStruct(
+        db_save_dir=sim_dir,
+        db_name="major.db",
+        table=CSqlTable(
+            name="major",
+            primary_keys=[CSqlVar("trade_date", "TEXT")],
+            value_columns=[CSqlVar("ticker_major", "TEXT")],
+        ),
+    )
+    sim_signal = CDbStruct(
+        db_save_dir=sim_dir,
+        db_name="signal.db",
+        table=CSqlTable(
+            name="signal",
+            primary_keys=[CSqlVar("trade_date", "TEXT"), CSqlVar("instrument", "TEXT")],
+            value_columns=[CSqlVar("weight", "REAL")],
+        ),
+    )
+    md_dfs, sig_dfs = [], []
+    for instrument, wind_id, px0 in zip(sim_instruments, sim_universe, sim_px0):
+        roll_every = int(rng.integers(30, 60))
+        majors = [f"{instrument}{2000 + k // roll_every:04d}.SHF" for k in range(len(h_dates))]
+        db_struct = sim_major.copy_to_another(another_db_name=f"{wind_id}.db")
+        CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="w").update(
+            pd.DataFrame({"trade_date": h_dates, "ticker_major": majors})
+        )
+        for contract in sorted(set(majors)):
+            sns = [k for k, major in enumerate(majors) if major == contract]
+            lo, hi = max(sns[0] - 5, 0), min(sns[-1] + 6, len(h_dates))
+            close = px0 * np.exp(np.cumsum(rng.normal(0, 0.012, size=hi - lo)))
+            md_dfs.append(pd.DataFrame({
+                "trade_date": h_dates[lo:hi], "ts_code": contract,
+                "pre_close": close, "open": close * (1 + rng.normal(0, 0.003, size=hi - lo)),
+                "high": close * 1.01, "low": close * 0.99, "close": close, "settle": close,
+                "vol": 100.0, "amount": 1e6, "oi": 1000.0,
+            }))
+        in_sig = rng.random(len(h_dates)) < 0.8
+        sig_dfs.append(pd.DataFrame({
+            "trade_date": np.array(h_dates)[in_sig], "instrument": wind_id,
+            "weight": np.round(rng.normal(0, 0.15, size=in_sig.sum()), 3),
+        }))
+    sim_md_data = pd.concat(md_dfs, ignore_index=True)
+    sim_md_data.loc[rng.random(len(sim_md_data)) < 0.02, "open"] = np.nan
+    CMgrSqlDb(sim_fmd.db_save_dir, sim_fmd.db_name, sim_fmd.table, mode="w").update(sim_md_data)
+    CMgrSqlDb(sim_signal.db_save_dir, sim_signal.db_name, sim_signal.table, mode="w").update(
+        pd.concat(sig_dfs, ignore_index=True)
+    )
+    sim_mgr_instru = CInstruMgr(os.path.join(sim_dir, "instru.csv"), key="tushareId")
+    sim_mgr_maj_contract = CMgrMajContract(sim_universe, sim_major)
+    sim_mgr_mkt_data = CMgrMktData(sim_fmd)
+
+
+    def create_simulation(engine: type[CSimulation], sim_id: str, **kwargs) -> CSimulation:
+        return engine(
+            signal=kwargs.pop("signal", None) or CSignal("test", sim_signal),
+            init_cash=1e7,
+            cost_rate=3e-4,
+            exe_price_type=kwargs.pop("exe_price_type", TExePriceType.OPEN),
+            mgr_instru=sim_mgr_instru,
+            mgr_maj_contract=kwargs.pop("mgr_maj_contract", sim_mgr_maj_contract),
+            mgr_mkt_data=kwargs.pop("mgr_mkt_data", sim_mgr_mkt_data),
+            sim_save_dir=sim_dir,
+            sim_id=sim_id,
+            **kwargs,
+        )
+
+
+    def read_nav(sim_id: str) -> pd.DataFrame:
+        db_struct = gen_nav_db(sim_dir, save_id=sim_id)
+        if not os.path.exists(os.path.join(db_struct.db_save_dir, db_struct.db_name)):
+            return pd.DataFrame()
+        return CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="r").read()
+
+
+    def read_ckpt_account(sim_id: str) -> pd.DataFrame:
+        db_struct = gen_ckpt_account_db(sim_dir, save_id=sim_id)
+        return CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="r").read()
+
+
+    def reset_sim(sim_id: str):
+        for file in os.listdir(sim_dir):
+            if file.startswith(f"{sim_id}.") or file.startswith(f"{sim_id}-"):
+                path = os.path.join(sim_dir, file)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        return 0
+
+
+    def assert_navs_equal(nav: pd.DataFrame, ref: pd.DataFrame, tol: float = 1e-6):
+        assert nav["trade_date"].tolist() == ref["trade_date"].tolist()
+        diff = np.abs(nav.drop(columns="trade_date").values - ref.drop(columns="trade_date").values).max()
+        assert diff <= tol, f"max diff = {diff}"
+        return 0
+
+
+    # --- CSimulation and CSimulationVec
+    for exe_price_type in TExePriceType:
+        navs: dict[str, pd.DataFrame] = {}
+        for engine in (CSimulation, CSimulationVec):
+            sim_id = f"{engine.__name__}-{exe_price_type}"
+            reset_sim(sim_id)
+            t0 = time.perf_counter()
+            create_simulation(engine, sim_id, exe_price_type=exe_price_type).main(
+                args.sim_bgn, args.sim_stp, calendar)
+            print(f"{engine.__name__:<16s}: exe price = {exe_price_type}, {time.perf_counter() - t0:.3f}s")
+            navs[engine.__name__] = read_nav(sim_id)
+        assert_navs_equal(navs["CSimulationVec"], navs["CSimulation"])
+        print(f"navs of CSimulation and CSimulationVec are equal, last nav = {navs['CSimulation']['nav'].iloc[-1]:.2f}")
+
+    # --- missing market data is not allowed by both engines
+    missing_date = calendar.get_next_date(args.sim_bgn, shift=20)
+    missing_contract = sim_mgr_maj_contract.get_contract(missing_date, sim_universe[0])
+    sim_fmd_missing = sim_fmd.copy_to_another(another_db_name="fmd_missing.db")
+    CMgrSqlDb(sim_fmd_missing.db_save_dir, sim_fmd_missing.db_name, sim_fmd_missing.table, mode="w").update(
+        sim_md_data[(sim_md_data["trade_date"] != missing_date) | (sim_md_data["ts_code"] != missing_contract)]
+    )
+    sim_mgr_mkt_data_missing = CMgrMktData(sim_fmd_missing)
+    for engine in (CSimulation, CSimulationVec):
+        try:
+            create_simulation(engine, "missing", mgr_mkt_data=sim_mgr_mkt_data_missing).run(
+                args.sim_bgn, args.sim_stp, calendar)
+        except KeyError as e:
+            print(f"{engine.__name__:<16s}: {e}")
+        else:
+            raise AssertionError(f"{engine.__name__} should raise KeyError for missing market data")
+
+    # --- CPositionBook and a dict of CPosition
+    pos_keys = [
+        CPosKey(f"C{k:05d}.SHF", direction=TPosDirection.LNG if k % 2 else TPosDirection.SRT)
+        for k in range(args.positions)
+    ]
+    held_qtys = np.zeros(args.positions, dtype=np.int64)
+    daily_trades: list[list[CTrade]] = []
+    for _ in h_dates:
+        trades = []
+        for k in rng.choice(args.positions, size=args.positions // 4, replace=False):
+            tgt_qty = int(rng.integers(0, 20))
+            if tgt_qty != held_qtys[k]:
+                trades.append(CTrade(
+                    key=pos_keys[k],
+                    offset=TPosOffset.OPN if tgt_qty > held_qtys[k] else TPosOffset.CLS,
+                    qty=abs(tgt_qty - int(held_qtys[k])),
+                    multiplier=10,
+                    exe_price=float(np.round(rng.uniform(1000, 5000), 1)),
+                ))
+                held_qtys[k] = tgt_qty
+        daily_trades.append(trades)
+    daily_trades_cols = [CTrades.from_list(trades) for trades in daily_trades]
+
+
+    @qtimer
+    def apply_trades_by_dict() -> tuple[float, float, dict[CPosKey, CPosition]]:
+        positions: dict[CPosKey, CPosition] = {}
+        tot_realized_pnl, tot_cost = 0.0, 0.0
+        for trades in daily_trades:
+            for trade in trades:
+                if trade.key not in positions:
+                    positions[trade.key] = CPosition(
+                        key=trade.key, qty=0, multiplier=trade.multiplier, cost_price=0, last_price=0,
+                    )
+                realized_pnl, cost = positions[trade.key].update_from_trade(trade, cost_rate=3e-4)
+                tot_realized_pnl, tot_cost = tot_realized_pnl + realized_pnl, tot_cost + cost
+            positions = {key: pos for key, pos in positions.items() if pos.qty > 0}
+        return tot_realized_pnl, tot_cost, positions
+
+
+    @qtimer
+    def apply_trades_by_book() -> tuple[float, float, CPositionBook]:
+        book = CPositionBook()
+        tot_realized_pnl, tot_cost = 0.0, 0.0
+        for trades in daily_trades_cols:
+            realized_pnl, cost = book.apply_trades(trades, cost_rate=3e-4)
+            tot_realized_pnl, tot_cost = tot_realized_pnl + realized_pnl, tot_cost + cost
+            book.remove_empty()
+        return tot_realized_pnl, tot_cost, book
+
+
+    dict_realized_pnl, dict_cost, dict_positions = apply_trades_by_dict()
+    book_realized_pnl, book_cost, book_positions = apply_trades_by_book()
+    assert np.isclose(dict_realized_pnl, book_realized_pnl, rtol=1e-10)
+    assert np.isclose(dict_cost, book_cost, rtol=1e-10)
+    assert set(dict_positions) == set(book_positions)
+    for pos_key, pos in dict_positions.items():
+        book_pos = book_positions[pos_key].to_position()
+        assert (book_pos.qty, book_pos.multiplier) == (pos.qty, pos.multiplier)
+        assert np.isclose(book_pos.cost_price, pos.cost_price, rtol=1e-12)
+    print(f"CPositionBook is the same as dict of CPosition, {len(book_positions)} positions left")
+
+    # --- a sweep of 2 cfgs saves the same results as 2 single runs
+    sweep_cfgs = [
+        CSimCfg(
+            signal=CSignal("test", sim_signal), init_cash=1e7, cost_rate=3e-4,
+            exe_price_type=exe_price_type, sim_id=f"sweep-{exe_price_type}",
+        ) for exe_price_type in TExePriceType
+    ]
+    for cfg in sweep_cfgs:
+        reset_sim(cfg.save_id)
+    sweep = CSimSweep(sim_mgr_instru, sim_mgr_maj_contract, sim_mgr_mkt_data, sim_save_dir=sim_dir)
+    sweep.main(sweep_cfgs, args.sim_bgn, args.sim_stp, calendar, processes=2)
+    for cfg in sweep_cfgs:
+        single_id = f"{CSimulationVec.__name__}-{cfg.exe_price_type}"
+        assert_navs_equal(read_nav(cfg.save_id), read_nav(single_id), tol=0)
+        assert read_ckpt_account(cfg.save_id).equals(read_ckpt_account(single_id))
+    print("navs and checkpoints of sweep are the same as single runs")
+
+    # a crashed worker is reported, instead of blocking the sweep
+    class CSignalCrash(CSignalBase):
+        @property
+        def sid(self) -> str:
+            return "crash"
+
+        def get_signal(self, trade_date: str) -> dict[str, float]:
+            os._exit(1)
+
+
+    crash_cfgs = sweep_cfgs[0:1] + [
+        CSimCfg(signal=CSignalCrash(), init_cash=1e7, cost_rate=3e-4, exe_price_type=TExePriceType.OPEN)]
+    try:
+        sweep.run(crash_cfgs, args.sim_bgn, args.sim_stp, calendar, processes=2)
+    except RuntimeError as e:
+        print(f"crashed worker is reported: {e}")
+    else:
+        raise AssertionError("RuntimeError should be raised for a crashed worker")
+
+    # --- resume from checkpoint, keep navs without checkpoint, and rebuild navs with resume = False
+    sim_mid = calendar.get_next_date(args.sim_bgn, shift=250)
+    for engine in (CSimulation, CSimulationVec):
+        sim_id = f"resume-{engine.__name__}"
+        reset_sim(sim_id)
+        create_simulation(engine, sim_id).main(args.sim_bgn, sim_mid, calendar)
+        assert str(read_ckpt_account(sim_id)["trade_date"].iloc[-1]) == str(read_nav(sim_id)["trade_date"].iloc[-1])
+        create_simulation(engine, sim_id).main(sim_mid, args.sim_stp, calendar)
+        full_nav = read_nav(f"{engine.__name__}-{TExePriceType.OPEN}")
+        assert_navs_equal(read_nav(sim_id), full_nav)
+        print(f"{engine.__name__:<16s}: resumed navs from {sim_mid} are the same as navs of a full run")
+
+        # navs without checkpoint, like results saved by an old version
+        create_simulation(engine, sim_id).main(args.sim_bgn, sim_mid, calendar, resume=False)
+        for gen_db in (gen_ckpt_account_db, gen_ckpt_positions_db):
+            db_struct = gen_db(sim_dir, save_id=sim_id)
+            CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="w")
+        old_nav = read_nav(sim_id)
+        create_simulation(engine, sim_id).main(args.sim_bgn, args.sim_stp, calendar)
+        assert_navs_equal(read_nav(sim_id), old_nav, tol=0)
+        create_simulation(engine, sim_id).main(sim_mid, args.sim_stp, calendar)
+        new_nav = read_nav(sim_id)
+        assert_navs_equal(new_nav.iloc[0:len(old_nav)], old_nav, tol=0)
+        assert new_nav["trade_date"].tolist() == full_nav["trade_date"].tolist()
+        print(f"{engine.__name__:<16s}: navs without checkpoint are kept, and new navs are appended")
+        create_simulation(engine, sim_id).main(args.sim_bgn, args.sim_stp, calendar, resume=False)
+        assert_navs_equal(read_nav(sim_id), full_nav)
+        print(f"{engine.__name__:<16s}: navs are rebuilt with resume = False")
+
+    # --- windowed loading returns the same data as loading all, across window boundaries
+    win_days = 30
+    win_signal = CSignal("test", sim_signal, bgn_date=args.sim_bgn, stp_date=args.sim_stp, win_days=win_days)
+    win_mgr_maj_contract = CMgrMajContract(
+        sim_universe, sim_major, bgn_date=args.sim_bgn, stp_date=args.sim_stp, win_days=win_days,
+    )
+    all_signal = CSignal("test", sim_signal)
+    win_dates = calendar.get_iter_list(args.sim_bgn, args.sim_stp)
+    win_lo, win_hi = win_signal.loader.get_window(1)
+    assert any(d < win_lo for d in win_dates) and any(d >= win_hi for d in win_dates)
+    for trade_date in win_dates:
+        assert win_signal.get_signal(trade_date) == all_signal.get_signal(trade_date)
+        for instrument in sim_universe:
+            assert win_mgr_maj_contract.get_contract(trade_date, instrument) == sim_mgr_maj_contract.get_contract(
+                trade_date, instrument)
+    assert np.array_equal(
+        win_mgr_maj_contract.get_contracts_matrix(win_dates, sim_universe),
+        sim_mgr_maj_contract.get_contracts_matrix(win_dates, sim_universe),
+    )
+    print(f"windowed loading with win_days = {win_days} returns the same data for {len(win_dates)} dates")
+
+    # --- section simulation is the same as CSimulation, if each section is taken as a trade date
+    sec_calendar_path = os.path.join(sim_dir, "calendar_no_header.csv")
+    pd.Series(calendar.get_iter_list(calendar.first_date, calendar.last_date)).to_csv(
+        sec_calendar_path, index=False, header=False)
+    sec_calendar = CCalendarSection(sec_calendar_path)
+    _, sec_bgn = sec_calendar.match_id(f"{args.sim_bgn}-TS1")
+    sec_stp = sec_calendar.get_next_sec(sec_bgn, shift=200)
+    sec_ids = [sec.secId for sec in sec_calendar.get_iter_list(sec_calendar.get_next_sec(sec_bgn, -1), sec_stp)]
+    sec_data = sim_md_data[sim_md_data["trade_date"].between(sec_ids[0][0:8], sec_ids[-1][0:8])]
+    bar_store = CSectionBarStore(os.path.join(sim_dir, "bars"), sec_calendar)
+    for contract, contract_data in sec_data.groupby("ts_code"):
+        night_close = (contract_data["pre_close"] + contract_data["close"]) / 2
+        bar_store.save(contract, pd.concat([
+            contract_data[["trade_date"]].assign(section="TS1", open=contract_data["pre_close"], close=night_close),
+            contract_data[["trade_date"]].assign(section="TS2", open=night_close, close=contract_data["close"]),
+        ]))
+    try:
+        bar_store.get_md("20000101-TS2", contract, "close")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError should be raised for an unknown section")
+
+    # dates of the daily calendar, each of them stands for a section
+    sec_dates = calendar.get_iter_list(calendar.first_date, calendar.last_date)[0:len(sec_ids)]
+    sec_id_of_date = dict(zip(sec_dates, sec_ids))
+
+
+    class CSignalSection(CSignalBase):
+        def __init__(self, signal: CSignalBase, date_as_sec: bool):
+            self.__signal, self.date_as_sec = signal, date_as_sec
+
+        @property
+        def sid(self) -> str:
+            return self.__signal.sid
+
+        def get_signal(self, trade_date: str) -> dict[str, float]:
+            sec_id = sec_id_of_date[trade_date] if self.date_as_sec else trade_date
+            sigs = self.__signal.get_signal(sec_id[0:8])
+            return {k: v * 0.5 for k, v in sigs.items()} if sec_id.endswith("TS1") else sigs
+
+
+    class CMgrMajContractSection(CMgrMajContractBase):
+        def get_contract(self, trade_date: str, instrument: str) -> str:
+            return sim_mgr_maj_contract.get_contract(sec_id_of_date[trade_date][0:8], instrument)
+
+
+    class CMgrMktDataSection(CMgrMktDataBase):
+        def get_md(self, trade_date: str, contract: str, md: str) -> int | float:
+            return bar_store.get_md(sec_id_of_date[trade_date], contract, md)
+
+
+    reset_sim("section")
+    sec_sim = create_simulation(
+        CSimulationSection, "section", signal=CSignalSection(all_signal, date_as_sec=False), mgr_mkt_data=bar_store,
+    )
+    sec_sim.main(sec_bgn, sec_stp, sec_calendar)
+    sec_nav_struct = gen_nav_section_db(sim_dir, save_id="section")
+    sec_nav = CMgrSqlDb(sec_nav_struct.db_save_dir, sec_nav_struct.db_name, sec_nav_struct.table, mode="r").read()
+    day_nav = create_simulation(
+        CSimulation, "section-daily", signal=CSignalSection(all_signal, date_as_sec=True),
+        mgr_maj_contract=CMgrMajContractSection(), mgr_mkt_data=CMgrMktDataSection(),
+    ).run(sec_dates[1], calendar.get_next_date(sec_dates[-1], shift=1), calendar)
+    assert (sec_nav["trade_date"] + "-" + sec_nav["section"]).tolist() == sec_ids[1:]
+    assert np.allclose(sec_nav["nav"].values, day_nav["nav"].values, rtol=1e-12)
+    print(f"navs of CSimulationSection for {len(sec_nav)} sections are the same as CSimulation")
+
+    # the first section in calendar has no signal section before it, simulation begins from the next section
+    class CSignalEmpty(CSignalBase):
+        @property
+        def sid(self) -> str:
+            return "empty"
+
+        def get_signal(self, trade_date: str) -> dict[str, float]:
+            return {}
+
+
+    first_sec = sec_calendar.sections[0]
+    first_nav = create_simulation(CSimulationSection, "section-first", signal=CSignalEmpty()).run(
+        first_sec, sec_calendar.get_next_sec(first_sec, shift=3), sec_calendar)
+    assert (first_nav["trade_date"] + "-" + first_nav["section"]).tolist() == [
+        sec.secId for sec in sec_calendar.sections[1:3]]
+
+    # --- rolls of a constant long position are the rolls of major contract, executed on the next date
+    class CSignalConst(CSignalBase):
+        @property
+        def sid(self) -> str:
+            return "const"
+
+        def get_signal(self, trade_date: str) -> dict[str, float]:
+            return {sim_universe[0]: 0.5}
+
+
+    roll_calendar = CRollCalendar(sim_universe, sim_major)
+    expected_rolls = roll_calendar.get_rolls(
+        calendar.get_next_date(args.sim_bgn, shift=-1), calendar.get_next_date(args.sim_stp, shift=-1))
+    expected_rolls = expected_rolls[expected_rolls["instrument"] == sim_universe[0]]
+    expected_rolls = expected_rolls.assign(
+        trade_date=[calendar.get_next_date(d, shift=1) for d in expected_rolls["trade_date"]])
+    for engine in (CSimulation, CSimulationVec):
+        sim_id = f"rolls-{engine.__name__}"
+        reset_sim(sim_id)
+        create_simulation(engine, sim_id, signal=CSignalConst(), mgr_maj_contract=roll_calendar).main(
+            args.sim_bgn, args.sim_stp, calendar)
+        rolls_struct = gen_rolls_db(sim_dir, save_id=sim_id)
+        rolls = CMgrSqlDb(rolls_struct.db_save_dir, rolls_struct.db_name, rolls_struct.table, mode="r").read()
+        assert rolls[expected_rolls.columns].values.tolist() == expected_rolls.values.tolist()
+
+        # check cost of the first roll
+        nav = read_nav(sim_id).set_index("trade_date")
+        roll = rolls.iloc[0]
+        exe_date = roll["trade_date"]
+        sig_date = prev_exe_date = calendar.get_next_date(exe_date, -1)
+        prev_sig_date = calendar.get_next_date(sig_date, -1)
+        multiplier = sim_mgr_instru.get_multiplier(sim_universe[0])
+        old_qty = int(np.round(nav.at[prev_exe_date, "last_nav"] * 0.5 / multiplier / sim_mgr_mkt_data.get_md(
+            prev_sig_date, roll["old_contract"], "close")))
+        new_qty = int(np.round(nav.at[exe_date, "last_nav"] * 0.5 / multiplier / sim_mgr_mkt_data.get_md(
+            sig_date, roll["new_contract"], "close")))
+        old_price = sim_mgr_mkt_data.get_md(exe_date, roll["old_contract"], "open")
+        new_price = sim_mgr_mkt_data.get_md(exe_date, roll["new_contract"], "open")
+        assert roll["qty"] == min(old_qty, new_qty)
+        assert np.isclose(roll["roll_cost"], (old_price + new_price) * multiplier * roll["qty"] * 3e-4, rtol=1e-12)
+        print(f"{engine.__name__:<16s}: {len(rolls)} rolls, first roll @ {exe_date}, "
+              f"{roll['old_contract']} -> {roll['new_contract']}, qty = {roll['qty']}, cost = {roll['roll_cost']:.2f}")
+
+    # --- ledgers of sqlite and parquet are the same, and CSimulationVec writes the same ledgers as CSimulation
+    from husfort.qsimulation import gen_ledger_trades_db, gen_ledger_positions_db
+
+
+    def read_ledger(sim_id: str, ledger: str, name: str) -> pd.DataFrame:
+        if ledger == "sqlite":
+            gen_db = gen_ledger_trades_db if name == "trades" else gen_ledger_positions_db
+            db_struct = gen_db(sim_dir, save_id=sim_id)
+            data = CMgrSqlDb(db_struct.db_save_dir, db_struct.db_name, db_struct.table, mode="r").read()
+        else:
+            ledger_dir = os.path.join(sim_dir, f"{sim_id}-ledger")
+            files = sorted(f for f in os.listdir(ledger_dir) if f.startswith(f"{name}-"))
+            data = pd.concat([pd.read_parquet(os.path.join(ledger_dir, f)) for f in files], ignore_index=True)
+        # order of trades in a day is not the same for engines, so seq is dropped
+        data = data.drop(columns="seq", errors="ignore")
+        return data.sort_values(data.columns[0:4].tolist(), ignore_index=True)
+
+
+    ledgers: dict[tuple[str, str], tuple[pd.DataFrame, pd.DataFrame]] = {}
+    for engine in (CSimulation, CSimulationVec):
+        for ledger in ("sqlite", "parquet"):
+            sim_id = f"ledger-{engine.__name__}-{ledger}"
+            reset_sim(sim_id)
+            create_simulation(engine, sim_id, ledger=ledger, ledger_buffer=500).main(
+                args.sim_bgn, args.sim_stp, calendar)
+            trades, positions = read_ledger(sim_id, ledger, "trades"), read_ledger(sim_id, ledger, "positions")
+            nav = read_nav(sim_id)
+            cost = trades.groupby("trade_date")["cost"].sum().reindex(nav["trade_date"]).fillna(0)
+            assert np.allclose(cost.values, nav["this_day_cost"].values, rtol=1e-9)
+            ledgers[(engine.__name__, ledger)] = (trades, positions)
+            print(f"{engine.__name__:<16s}: ledger = {ledger:<7s}, {len(trades)} trades, {len(positions)} positions")
+    for key, (trades, positions) in ledgers.items():
+        ref_trades, ref_positions = ledgers[("CSimulation", "sqlite")]
+        pd.testing.assert_frame_equal(trades, ref_trades, check_dtype=False, rtol=1e-9)
+        pd.testing.assert_frame_equal(positions, ref_positions, check_dtype=False, rtol=1e-9)
+    print("ledgers of sqlite and parquet, CSimulation and CSimulationVec are equal")